@@ -0,0 +1,145 @@
+"""Benchmark field extraction from observable properties.
+
+Compares the compiled field accessors used by
+:py:func:`StixTransform._field_values_for_properties` against the original
+recursive implementation, which re-split the dotted field names for every
+observable. The observables in tests/CA-TEST-STIX.xml are extracted
+repeatedly (--scale times) for each transform with OBJECT_FIELDS.
+
+Usage:
+    python benchmarks/field_extraction.py [--scale 1000]
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import timeit
+
+import six
+import stix
+
+from certau.transform import TRANSFORM_CLASS, StixTransform
+
+
+def recursive_field_values(cls, object_type, properties):
+    """The original (uncompiled) field extraction, for comparison."""
+    fields = list(cls.OBJECT_FIELDS[object_type])
+    if object_type in cls.OBJECT_CONSTRAINTS.keys():
+        for field in cls.OBJECT_CONSTRAINTS[object_type]:
+            if field not in fields:
+                fields.append(field)
+    values = []
+    _recursive_entity_values(cls, values, properties, fields)
+    if object_type in cls.OBJECT_CONSTRAINTS.keys():
+        for field in cls.OBJECT_CONSTRAINTS[object_type]:
+            for value in values:
+                if (field not in value or value[field] not in
+                        cls.OBJECT_CONSTRAINTS[object_type][field]):
+                    values.remove(value)
+                    break
+                if field not in cls.OBJECT_FIELDS[object_type]:
+                    del value[field]
+    return values
+
+
+def _recursive_entity_values(cls, values, entity, fields, first_part=''):
+    def _first_parts(fields):
+        first_parts = set()
+        for field in fields:
+            parts = field.split('.')
+            first_parts.add(parts[0])
+        return first_parts
+
+    def _next_parts(fields, field):
+        next_parts = set()
+        first_part = field + '.'
+        for field in fields:
+            if field.startswith(first_part):
+                next_parts.add(field[len(first_part):])
+        return next_parts
+
+    def _add_value_to_values(values, value, field):
+        if values:
+            for dict_ in values:
+                cls._add_value_to_dict(dict_, value, field)
+        else:
+            dict_ = dict()
+            cls._add_value_to_dict(dict_, value, field)
+            if dict_:
+                values.append(dict_)
+
+    for field in _first_parts(fields):
+        full_first_part = first_part + '.' + field if first_part else field
+        next_parts = _next_parts(fields, field)
+        value = getattr(entity, field, None)
+        iterable = False
+        if not isinstance(value, six.string_types):
+            try:
+                iter(value)
+                iterable = True
+            except TypeError:
+                pass
+        if iterable:
+            values_copy = copy.deepcopy(values)
+            first = True
+            for item in value:
+                v_list = values if first else copy.deepcopy(values_copy)
+                if next_parts:
+                    _recursive_entity_values(cls, v_list, item, next_parts,
+                                             full_first_part)
+                else:
+                    _add_value_to_values(v_list, item, full_first_part)
+                if not first:
+                    values.extend(v_list)
+                else:
+                    first = False
+        elif value:
+            if next_parts:
+                _recursive_entity_values(cls, values, value, next_parts,
+                                         full_first_part)
+            else:
+                _add_value_to_values(values, value, full_first_part)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=int, default=1000,
+                        help='number of copies of the test package')
+    parser.add_argument('--package', default='tests/CA-TEST-STIX.xml',
+                        help='the STIX package to extract fields from')
+    options = parser.parse_args()
+
+    package = stix.core.STIXPackage.from_xml(options.package)
+    candidates = [
+        (object_type, properties)
+        for _, object_type, properties, _, _ in
+        StixTransform._package_observables(package)
+        if object_type is not None
+    ]
+
+    print('{:<25} {:>10} {:>12} {:>12} {:>8}'.format(
+        'transform', 'objects', 'recursive(s)', 'compiled(s)', 'speedup'))
+    for name, cls in sorted(TRANSFORM_CLASS.items()):
+        if not cls.OBJECT_FIELDS:
+            continue
+        items = [(t, p) for t, p in candidates if t in cls.OBJECT_FIELDS]
+        items *= options.scale
+
+        def recursive():
+            for object_type, properties in items:
+                recursive_field_values(cls, object_type, properties)
+
+        def compiled():
+            for object_type, properties in items:
+                cls._field_values_for_properties(object_type, properties)
+
+        recursive_time = min(timeit.repeat(recursive, number=1, repeat=3))
+        compiled_time = min(timeit.repeat(compiled, number=1, repeat=3))
+        print('{:<25} {:>10} {:>12.3f} {:>12.3f} {:>7.2f}x'.format(
+            cls.__name__, len(items), recursive_time, compiled_time,
+            recursive_time / compiled_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark scanning a large directory tree for input files.
+
+Creates a tree of --files empty files (or uses an existing --directory),
+with --per-directory files in each directory and --fanout subdirectories
+in each directory, then measures the time taken to find (and optionally
+stat) every file with:
+
+* listdir - the scan used before FileScanner (os.listdir with
+  os.path.isdir and os.path.isfile for each entry)
+* scan - FileScanner.files()
+* scan+stat - FileScanner.stat_files(), as used with --manifest
+* scan+stat/N - FileScanner.stat_files() with N --stat-threads
+
+Peak RSS growth is reported for each, since scans should not hold the
+whole tree in memory.
+
+The tree is created in a temporary directory (removed afterwards) unless
+--directory is given, in which case an existing tree (e.g. on a network
+filesystem) is scanned as is.
+
+Usage:
+    python benchmarks/file_scan.py [--files 500000] [--per-directory 1000]
+        [--fanout 10] [--stat-threads 8] [--directory DIR]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from certau.source import FileScanner
+
+
+def make_tree(top, files, per_directory, fanout):
+    """Creates files empty files under top."""
+    directories = [top]
+    created = 0
+    while created < files:
+        directory = directories.pop(0)
+        for i in range(min(per_directory, files - created)):
+            open(os.path.join(directory, '{:06d}.xml'.format(i)), 'w').close()
+            created += 1
+        for i in range(fanout):
+            subdirectory = os.path.join(directory, 'd{:02d}'.format(i))
+            os.mkdir(subdirectory)
+            directories.append(subdirectory)
+
+
+def listdir_scan(path):
+    """The listdir based scan (with working recursion)."""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            subpath = os.path.join(path, name)
+            if os.path.isdir(subpath):
+                for file_ in listdir_scan(subpath):
+                    yield file_
+            elif os.path.isfile(subpath):
+                yield subpath
+    elif os.path.isfile(path):
+        yield path
+
+
+def peak_rss():
+    """The process's peak RSS in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=500000,
+                        help='number of files to create')
+    parser.add_argument('--per-directory', type=int, default=1000,
+                        help='number of files in each directory')
+    parser.add_argument('--fanout', type=int, default=10,
+                        help='number of subdirectories in each directory')
+    parser.add_argument('--stat-threads', type=int, default=8,
+                        help='number of threads for the threaded stat scan')
+    parser.add_argument('--directory',
+                        help='scan this (existing) directory instead')
+    options = parser.parse_args()
+
+    top = options.directory
+    if top is None:
+        top = tempfile.mkdtemp(prefix='file_scan_')
+        start = time.time()
+        make_tree(top, options.files, options.per_directory, options.fanout)
+        print('created {} files in {:.1f}s'.format(options.files,
+                                                    time.time() - start))
+
+    scanner = FileScanner(recurse=True)
+    threaded = FileScanner(recurse=True,
+                           stat_threads=options.stat_threads)
+    scans = [
+        ('listdir', lambda: listdir_scan(top)),
+        ('scan', lambda: scanner.files([top])),
+        ('scan+stat', lambda: scanner.stat_files([top])),
+        ('scan+stat/{}'.format(options.stat_threads),
+         lambda: threaded.stat_files([top])),
+    ]
+    try:
+        print('{:<14} {:>9} {:>9} {:>12} {:>10}'.format(
+            'scan', 'files', 'time(s)', 'files/s', 'RSS+(MB)'))
+        for name, scan in scans:
+            rss = peak_rss()
+            start = time.time()
+            count = sum(1 for _ in scan())
+            elapsed = time.time() - start
+            print('{:<14} {:>9} {:>9.2f} {:>12.0f} {:>10.1f}'.format(
+                name, count, elapsed, count / elapsed, peak_rss() - rss))
+    finally:
+        if options.directory is None:
+            shutil.rmtree(top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark concurrent publishing to MISP against a local mock MISP server.
+
+Generates a synthetic STIX package (see certau.util.stix.generator) with
+--observables observables, then publishes it --packages times to a
+MispServer (which takes --latency seconds to answer each request) with a
+MispPublisher for each of the --workers given, reporting the time taken,
+the packages published per second, the most requests the server handled
+at once and the number of connections it accepted.
+
+The serial row publishes the packages one at a time (without a
+MispPublisher) over a single connection. --max-in-flight and --rate limit
+the requests in flight and the request rate, and --errors injects that
+many server errors (which are retried) into each run.
+
+Usage:
+    python benchmarks/misp_concurrency.py [--observables 1000]
+        [--packages 40] [--latency 0.02] [--workers 1,2,4,8]
+        [--max-in-flight 8] [--rate 0] [--errors 0]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from certau.source import StixFileSourceItem
+from certau.transform import MispPublisher, StixMispTransform
+from certau.util.misp.server import MispServer
+from certau.util.stix.generator import OBJECT_TYPES, PackageGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--observables', type=int, default=1000,
+                        help='number of observables in the package')
+    parser.add_argument('--packages', type=int, default=40,
+                        help='number of times the package is published')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='delay (in seconds) before each response')
+    parser.add_argument('--workers', default='1,2,4,8',
+                        help='comma separated numbers of workers to measure')
+    parser.add_argument('--max-in-flight', type=int, default=8,
+                        help='maximum number of requests in flight')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='maximum number of requests per second')
+    parser.add_argument('--errors', type=int, default=0,
+                        help='number of server errors injected in each run')
+    options = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+
+    per_type, extra = divmod(options.observables, len(OBJECT_TYPES))
+    counts = dict((object_type, per_type + (i < extra))
+                  for i, object_type in enumerate(OBJECT_TYPES))
+    directory = tempfile.mkdtemp(prefix='misp_concurrency_')
+    try:
+        filename = os.path.join(directory, 'package.xml')
+        PackageGenerator(counts).save(filename)
+        source_item = StixFileSourceItem(filename)
+        package = source_item.stix_package
+        items = [(source_item, package)] * options.packages
+
+        print('{:>8} {:>9} {:>10} {:>10} {:>12} {:>8}'.format(
+            'workers', 'time(s)', 'packages/s', 'concurrent', 'connections',
+            'retried'))
+        with MispServer(latency=options.latency) as server:
+            def run(name, misp, publish):
+                server.reset()
+                server.fail_requests(options.errors)
+                start = time.time()
+                publish(misp)
+                elapsed = time.time() - start
+                assert len(server.events) == options.packages
+                print('{:>8} {:>9.2f} {:>10.1f} {:>10} {:>12} {:>8}'.format(
+                    name, elapsed, options.packages / elapsed,
+                    server.max_concurrent_requests, server.connections,
+                    getattr(misp, 'retried', '-')))
+
+            def serial(misp):
+                for _, package_ in items:
+                    StixMispTransform(package_, misp=misp).publish()
+
+            if not options.errors:
+                run('serial', StixMispTransform.get_misp_object(
+                    server.url, 'key', max_in_flight=1), serial)
+            for workers in options.workers.split(','):
+                misp = StixMispTransform.get_misp_object(
+                    server.url, 'key',
+                    max_in_flight=options.max_in_flight,
+                    rate=options.rate,
+                    backoff=0.05,
+                )
+                publisher = MispPublisher(
+                    workers=int(workers),
+                    transform_kwargs=dict(misp=misp),
+                )
+                run(workers, misp,
+                    lambda misp: list(publisher.results(iter(items))))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark publishing repeated packages to MISP with and without an index.
+
+Generates a synthetic STIX package (see certau.util.stix.generator) with
+--observables observables, then publishes it --packages times to a local
+MispServer, as a feed that re-sends its indicators would:
+
+* resent - the same package (same ID and timestamp) each time
+* updated - the same package ID with a newer timestamp each time
+* new-ids - a new package ID each time (with the same indicators)
+
+Each is measured without an index, and with a MispIndex (with the
+'package' and 'server' scopes), reporting the requests made, the
+attributes sent to the server, the events created and the time taken.
+
+Usage:
+    python benchmarks/misp_dedup.py [--observables 5000] [--packages 10]
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import stix.core
+
+from certau.transform import StixMispTransform
+from certau.util.misp.index import MispIndex
+from certau.util.misp.server import MispServer
+from certau.util.stix.generator import OBJECT_TYPES, PackageGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--observables', type=int, default=5000,
+                        help='number of observables in the package')
+    parser.add_argument('--packages', type=int, default=10,
+                        help='number of times the package is published')
+    options = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+
+    per_type, extra = divmod(options.observables, len(OBJECT_TYPES))
+    counts = dict((object_type, per_type + (i < extra))
+                  for i, object_type in enumerate(OBJECT_TYPES))
+    directory = tempfile.mkdtemp(prefix='misp_dedup_')
+    try:
+        filename = os.path.join(directory, 'package.xml')
+        PackageGenerator(counts).save(filename)
+        package = stix.core.STIXPackage.from_xml(filename)
+        package_id, timestamp = package.id_, package.timestamp
+
+        def resent(number):
+            pass
+
+        def updated(number):
+            package.timestamp = timestamp + datetime.timedelta(hours=number)
+
+        def new_ids(number):
+            package.id_ = '{}-{}'.format(package_id, number)
+
+        print('{:<8} {:<8} {:>9} {:>11} {:>7} {:>9}'.format(
+            'feed', 'index', 'requests', 'attributes', 'events', 'time(s)'))
+        with MispServer() as server:
+            misp = StixMispTransform.get_misp_object(server.url, 'key')
+            for feed, change in [('resent', resent), ('updated', updated),
+                                 ('new-ids', new_ids)]:
+                for scope in [None, 'package', 'server']:
+                    server.reset()
+                    package.id_, package.timestamp = package_id, timestamp
+                    kwargs = dict()
+                    if scope is not None:
+                        kwargs['index'] = MispIndex(os.path.join(
+                            directory, '{}-{}.index'.format(feed, scope)))
+                        kwargs['index_scope'] = scope
+                    start = time.time()
+                    for number in range(options.packages):
+                        change(number)
+                        StixMispTransform(package, misp=misp,
+                                          **kwargs).publish()
+                    elapsed = time.time() - start
+                    attributes = sum(len(event['Attribute'])
+                                     for event in server.events.values())
+                    print('{:<8} {:<8} {:>9} {:>11} {:>7} {:>9.2f}'.format(
+                        feed, scope or '-', len(server.requests), attributes,
+                        len(server.events), elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
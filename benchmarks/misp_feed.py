@@ -0,0 +1,87 @@
+"""Benchmark writing packages to a MISP feed against publishing them.
+
+Generates a synthetic STIX package (see certau.util.stix.generator) with
+--observables observables and measures the time taken to:
+
+* attributes - extract the package's MISP attributes (the least any MISP
+  output can take)
+* feed - write the package as a MISP feed event (with MispFeedWriter)
+* publish - publish the package to a local MispServer (which takes
+  --latency seconds to answer each request) in batches of --batch-size
+
+Usage:
+    python benchmarks/misp_feed.py [--observables 20000] [--latency 0.02]
+        [--batch-size 500]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import stix.core
+
+from certau.transform import StixMispTransform
+from certau.util.misp.feed import MispFeedWriter
+from certau.util.misp.server import MispServer
+from certau.util.stix.generator import OBJECT_TYPES, PackageGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--observables', type=int, default=20000,
+                        help='number of observables in the package')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='delay (in seconds) before each response')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='attributes per request when publishing')
+    options = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.ERROR)
+
+    per_type, extra = divmod(options.observables, len(OBJECT_TYPES))
+    counts = dict((object_type, per_type + (i < extra))
+                  for i, object_type in enumerate(OBJECT_TYPES))
+    directory = tempfile.mkdtemp(prefix='misp_feed_')
+    try:
+        filename = os.path.join(directory, 'package.xml')
+        PackageGenerator(counts).save(filename)
+        package = stix.core.STIXPackage.from_xml(filename)
+
+        print('{:<11} {:>10} {:>9} {:>12}'.format(
+            'output', 'attributes', 'time(s)', 'attributes/s'))
+
+        def report(name, attributes, start):
+            elapsed = time.time() - start
+            print('{:<11} {:>10} {:>9.2f} {:>12.0f}'.format(
+                name, attributes, elapsed, attributes / elapsed))
+
+        start = time.time()
+        transform = StixMispTransform(package, misp=None,
+                                      feed=MispFeedWriter(directory))
+        report('attributes', len(transform.attributes()), start)
+
+        start = time.time()
+        with MispFeedWriter(os.path.join(directory, 'feed')) as feed:
+            StixMispTransform(package, misp=None, feed=feed).publish()
+        report('feed', feed.attributes, start)
+
+        with MispServer(latency=options.latency) as server:
+            misp = StixMispTransform.get_misp_object(server.url, 'key')
+            start = time.time()
+            transform = StixMispTransform(package, misp=misp,
+                                          batch_size=options.batch_size)
+            transform.publish()
+            report('publish', sum(len(event['Attribute'])
+                                  for event in server.events.values()),
+                   start)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
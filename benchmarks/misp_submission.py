@@ -0,0 +1,106 @@
+"""Benchmark publishing packages to MISP against a local mock MISP server.
+
+Generates a synthetic STIX package (see certau.util.stix.generator) with
+--observables observables (spread evenly over the object types), then
+publishes it with StixMispTransform to a MispServer for each of the
+--batch-sizes given, reporting the number of requests per package, the
+time taken and the attributes added per second.
+
+A batch size of 1 sends each attribute in its own request (as the
+transform did before attributes were batched), and 0 sends every
+attribute with the event. --latency adds a delay to each response, to
+show the effect of round trips to a remote server.
+
+The package is published --packages times for each batch size, with
+--tags tags defined on the server, to show the effect of caching the tag
+list (which is downloaded once, rather than for every package, unless
+--tag-cache-ttl is 0).
+
+Usage:
+    python benchmarks/misp_submission.py [--observables 20000]
+        [--batch-sizes 1,100,500,0] [--latency 0] [--packages 1]
+        [--tags 0] [--tag-cache-ttl 3600]
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from certau.transform import StixMispTransform
+from certau.util.misp.server import DEFAULT_TAGS, MispServer
+from certau.util.misp.tags import MispTagCache
+from certau.util.stix.generator import OBJECT_TYPES, PackageGenerator
+from certau.util.stix.stream import StreamingStixPackage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--observables', type=int, default=20000,
+                        help='number of observables in the package')
+    parser.add_argument('--batch-sizes', default='1,100,500,0',
+                        help='comma separated batch sizes to measure')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='delay (in seconds) before each response')
+    parser.add_argument('--packages', type=int, default=1,
+                        help='number of times the package is published')
+    parser.add_argument('--tags', type=int, default=0,
+                        help='number of extra tags defined on the server')
+    parser.add_argument('--tag-cache-ttl', type=float, default=3600,
+                        help='passed to StixMispTransform')
+    options = parser.parse_args()
+
+    # (Rejected attributes are logged as warnings)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    per_type, extra = divmod(options.observables, len(OBJECT_TYPES))
+    counts = dict((object_type, per_type + (i < extra))
+                  for i, object_type in enumerate(OBJECT_TYPES))
+    directory = tempfile.mkdtemp(prefix='misp_submission_')
+    try:
+        filename = os.path.join(directory, 'package.xml')
+        PackageGenerator(counts).save(filename)
+
+        tags = DEFAULT_TAGS + tuple('tag-{}'.format(number)
+                                    for number in range(options.tags))
+        print('{:>6} {:>10} {:>12} {:>10} {:>9} {:>12} {:>7}'.format(
+            'batch', 'attributes', 'requests/pkg', 'tag lists', 'time(s)',
+            'attributes/s', 'failed'))
+        with MispServer(tags=tags, latency=options.latency) as server:
+            misp = StixMispTransform.get_misp_object(server.url, 'key')
+            for batch_size in options.batch_sizes.split(','):
+                server.reset()
+                MispTagCache.invalidate_all()
+                attributes = failed = 0
+                start = time.time()
+                for _ in range(options.packages):
+                    transform = StixMispTransform(
+                        StreamingStixPackage(filename),
+                        misp=misp,
+                        batch_size=int(batch_size),
+                        tag_cache_ttl=options.tag_cache_ttl,
+                    )
+                    transform.publish()
+                    attributes += len(transform.attributes())
+                    failed += len(transform.failed_attributes)
+                elapsed = time.time() - start
+                print('{:>6} {:>10} {:>12.0f} {:>10} {:>9.2f} {:>12.0f} '
+                      '{:>7}'.format(
+                          batch_size,
+                          attributes,
+                          len(server.requests) / float(options.packages),
+                          server.requests_for(r'/tags$'),
+                          elapsed,
+                          attributes / elapsed,
+                          failed,
+                      ))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark observable de-duplication in StixTransform.
+
+Times :py:func:`StixTransform._observables_for_package` for packages
+containing increasing numbers of observables (10% of which are duplicate
+references, as when indicators refer to observables in the package root),
+and compares the indexed :py:class:`ObservableRegistry` against the list
+based duplicate check it replaced. The time per observable should remain
+roughly constant as the package grows.
+
+Usage:
+    python benchmarks/observable_registry.py [--max 1000000]
+"""
+
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from certau.transform import StixTransform
+
+
+class SyntheticTransform(StixTransform):
+    """Transform reading observables from a synthetic candidate list."""
+
+    @classmethod
+    def _package_observables(cls, package):
+        return iter(package)
+
+
+def candidates(count):
+    """Returns (id, object_type, properties, observable, location) tuples."""
+    unique = count - count // 10
+    items = [
+        ('example:Observable-{}'.format(i), 'Address', None, None, 'root')
+        for i in range(unique)
+    ]
+    items.extend(
+        ('example:Observable-{}'.format(i), 'Address', None, None,
+         'indicator')
+        for i in range(0, unique, 9)
+    )
+    return items[:count]
+
+
+def list_dedup(package):
+    """The original O(n^2) duplicate check, for comparison."""
+    observable_ids = []
+    observables = dict()
+    for id_, object_type, _, observable, _ in package:
+        if id_ is None or id_ in observable_ids or object_type is None:
+            continue
+        observables.setdefault(object_type, []).append(
+            dict(id=id_, observable=observable, fields=None),
+        )
+        observable_ids.append(id_)
+    return observables
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--max', type=int, default=1000000,
+                        help='largest package size (observables)')
+    parser.add_argument('--list-max', type=int, default=20000,
+                        help='largest package size for the list check')
+    options = parser.parse_args()
+
+    print('{:>10} {:>12} {:>14} {:>12} {:>14}'.format(
+        'count', 'registry(s)', 'registry(us/o)', 'list(s)', 'list(us/o)'))
+    counts = []
+    count = 1000
+    while count < options.max:
+        counts.append(count)
+        count *= 10
+    counts.append(options.max)
+
+    for count in counts:
+        package = candidates(count)
+        registry = min(timeit.repeat(
+            lambda: SyntheticTransform._observables_for_package(package),
+            number=1, repeat=3,
+        ))
+        line = '{:>10} {:>12.4f} {:>14.3f}'.format(
+            count, registry, 1e6 * registry / count)
+        if count <= options.list_max:
+            baseline = min(timeit.repeat(
+                lambda: list_dedup(package), number=1, repeat=3,
+            ))
+            line += ' {:>12.4f} {:>14.3f}'.format(
+                baseline, 1e6 * baseline / count)
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Benchmark stixtransclient end-to-end against a local TAXII server.
+
+Starts a TaxiiPollServer serving --blocks copies of a STIX package (padded
+to --block-size characters) in parts of --page-size blocks, then runs
+stixtransclient.py in a subprocess for each output mode, polling the
+server. Reports the content blocks and bytes received per second, the
+number of connections the client opened and the peak RSS of the client
+process for each mode.
+
+With --compress the server gzips its responses (if the client accepts
+them), and --no-keep-alive makes the client open a connection for each
+request.
+
+Latency and errors can be injected with --latency and --error-part to see
+how the client behaves with a slow or failing server.
+
+Usage:
+    python benchmarks/taxii_throughput.py [--blocks 1000] [--block-size 0]
+        [--page-size 100] [--latency 0] [--prefetch 0] [--workers 1]
+        [--queue-size 0] [--compress] [--no-keep-alive]
+        [--modes stats,text,bro,snort,xml]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from libtaxii.constants import ST_FAILURE
+
+from certau.util.taxii.server import TaxiiPollServer, repeated_blocks
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'certau', 'scripts', 'stixtransclient.py')
+
+MODES = ('stats', 'text', 'bro', 'snort', 'xml')
+
+
+def run_client(args, stdout):
+    """Runs stixtransclient.py and returns (exit status, peak RSS in bytes).
+
+    The peak RSS is taken from the resource usage of the child process
+    (os.wait4), so it isn't affected by earlier runs.
+    """
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(SCRIPT))
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')]))
+    process = subprocess.Popen(
+        [sys.executable, '-W', 'ignore', SCRIPT] + args,
+        stdout=stdout,
+        env=env,
+    )
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status)
+    max_rss = rusage.ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    return process.returncode, max_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--package', default='tests/CA-TEST-STIX.xml',
+                        help='the STIX package to serve')
+    parser.add_argument('--blocks', type=int, default=1000,
+                        help='number of content blocks to serve')
+    parser.add_argument('--block-size', type=int, default=0,
+                        help='minimum size of each content block')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='number of content blocks per result part')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='delay (in seconds) before each response')
+    parser.add_argument('--error-part', type=int, action='append',
+                        default=[],
+                        help='return a TAXII failure for this result part '
+                             '(may be repeated)')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='passed to stixtransclient --poll-prefetch')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='passed to stixtransclient --workers')
+    parser.add_argument('--queue-size', type=int, default=0,
+                        help='passed to stixtransclient '
+                             '--pipeline-queue-size')
+    parser.add_argument('--stream', action='store_true',
+                        help='pass --stream to stixtransclient')
+    parser.add_argument('--compress', action='store_true',
+                        help='gzip responses from the server')
+    parser.add_argument('--no-keep-alive', action='store_true',
+                        help='pass --no-keep-alive to stixtransclient')
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help='comma separated output modes to run '
+                             '(from {})'.format(', '.join(MODES)))
+    options = parser.parse_args()
+
+    modes = options.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error('unknown output mode: {}'.format(mode))
+
+    with open(options.package, 'rb') as file_:
+        document = file_.read().decode('utf-8')
+    blocks = repeated_blocks(document, options.blocks, options.block_size)
+    errors = dict((part, ST_FAILURE) for part in options.error_part)
+
+    print('{:<8} {:>8} {:>9} {:>12} {:>10} {:>6} {:>12} {:>6}'.format(
+        'mode', 'blocks', 'time(s)', 'blocks/s', 'MB/s', 'conns',
+        'peak RSS(MB)', 'exit'))
+    with TaxiiPollServer(blocks, page_size=options.page_size,
+                         latency=options.latency, errors=errors,
+                         compress=options.compress) as server:
+        for mode in modes:
+            args = [
+                '--taxii',
+                '--poll-url', server.poll_url,
+                '--collection', 'benchmark',
+                '--poll-prefetch', str(options.prefetch),
+                '--workers', str(options.workers),
+                '--pipeline-queue-size', str(options.queue_size),
+                '--quiet',
+            ]
+            if options.stream:
+                args.append('--stream')
+            if options.no_keep_alive:
+                args.append('--no-keep-alive')
+            output_dir = None
+            if mode == 'xml':
+                output_dir = tempfile.mkdtemp()
+                args += ['--xml_output', output_dir]
+            else:
+                args.append('--' + mode)
+
+            server.reset()
+            try:
+                with open(os.devnull, 'wb') as devnull:
+                    start = time.time()
+                    status, max_rss = run_client(args, devnull)
+                    elapsed = time.time() - start
+            finally:
+                if output_dir is not None:
+                    shutil.rmtree(output_dir)
+
+            print('{:<8} {:>8} {:>9.2f} {:>12.1f} {:>10.2f} {:>6} {:>12.1f} '
+                  '{:>6}'.format(
+                      mode, server.blocks_sent, elapsed,
+                      server.blocks_sent / elapsed,
+                      server.bytes_sent / elapsed / 1024 ** 2,
+                      server.connections, max_rss / 1024.0 ** 2, status))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark writing Bro Intel rows with StixBroIntelTransform.
+
+Writes --count Bro Intel lines (from a synthetic package summary containing
+Address observables) to /dev/null, first with the original join() - which
+created a StringIO and a csv.writer for every row - and then with the
+current implementation, and reports the cost per row.
+
+Usage:
+    python benchmarks/text_rows.py [--count 1000000]
+"""
+
+from __future__ import print_function
+
+import argparse
+import contextlib
+import csv
+import os
+import time
+
+from six import StringIO
+
+from certau.transform import StixBroIntelTransform
+from certau.util.stix.summary import PackageSummary
+
+
+class OriginalJoinTransform(StixBroIntelTransform):
+    """StixBroIntelTransform with the original per-row csv writer."""
+
+    def join(self, items):
+        with contextlib.closing(StringIO()) as sio:
+            csv.writer(sio, delimiter=self.separator).writerow(items)
+            return sio.getvalue().strip()
+
+
+def package_summary(count):
+    """Returns a PackageSummary containing count Address observables."""
+    header = dict(
+        id='example:Package-1',
+        version='1.2',
+        timestamp=None,
+        title='Benchmark',
+        description=None,
+        tlp='WHITE',
+        produced_time=None,
+    )
+    addresses = [
+        dict(
+            id='cert_au:Observable-{}'.format(i),
+            observable=None,
+            fields=[{
+                'address_value': '10.{}.{}.{}'.format(
+                    (i >> 16) & 255, (i >> 8) & 255, i & 255),
+                'category': 'ipv4-addr',
+            }],
+        )
+        for i in range(count)
+    ]
+    summary = PackageSummary(header)
+    for transform_class in (StixBroIntelTransform, OriginalJoinTransform):
+        summary.set_observables(transform_class, {'Address': addresses})
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=1000000,
+                        help='number of Bro Intel lines to write')
+    options = parser.parse_args()
+
+    summary = package_summary(options.count)
+    with open(os.devnull, 'w') as devnull:
+        for name, transform_class in (
+                ('original', OriginalJoinTransform),
+                ('current', StixBroIntelTransform)):
+            transform = transform_class(summary)
+            start = time.time()
+            transform.write(devnull)
+            elapsed = time.time() - start
+            print('{:<10} {:>8.2f}s {:>8.2f}us/row'.format(
+                name, elapsed, 1e6 * elapsed / options.count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Benchmark observable extraction and transforms on synthetic packages.
+
+Generates synthetic STIX packages (see certau.util.stix.generator) of each
+of the --sizes given, and measures the throughput of:
+
+* parse - parsing the package with python-stix
+* observables - StixTransform._observables_for_package()
+* each entry in TRANSFORM_CLASS - creating the transform and writing its
+  output to /dev/null (for misp, only extracting its observables, since
+  the transform needs a MISP server)
+
+With --stream, the packages are read with StreamingStixPackage (as with
+stixtransclient --stream) instead, which is needed for the largest sizes.
+
+Results can be saved (--output) and compared with earlier results
+(--baseline), e.g. from a previous release. Any measurement more than
+--threshold slower than the baseline is reported as a regression, and the
+exit status is then 1.
+
+Packages smaller than about 1K contain no observables (just the header).
+
+Usage:
+    python benchmarks/transform_throughput.py [--sizes 4K,100K,1M,10M]
+        [--stream] [--output results.json] [--baseline old.json]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+import stix
+
+from certau import package_version
+from certau.transform import TRANSFORM_CLASS, StixTextTransform
+from certau.transform import StixMispTransform, StixTransform
+from certau.util.stix.generator import PackageGenerator
+from certau.util.stix.stream import StreamingStixPackage
+
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(size):
+    """Converts a size such as 100K or 1G to a number of bytes."""
+    size = size.strip().upper()
+    if size and size[-1] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def measurements(filename, stream):
+    """Yields (name, callable) for each measurement of a package file."""
+    if stream:
+        def package():
+            return StreamingStixPackage(filename)
+    else:
+        parsed = stix.core.STIXPackage.from_xml(filename)
+
+        def package():
+            return parsed
+        yield 'parse', lambda: stix.core.STIXPackage.from_xml(filename)
+
+    yield 'observables', lambda: StixTransform._observables_for_package(
+        package())
+
+    for name, transform_class in sorted(TRANSFORM_CLASS.items()):
+        if transform_class is StixTextTransform:
+            # The base text transform has no fields to output
+            continue
+
+        def run(transform_class=transform_class):
+            if issubclass(transform_class, StixMispTransform):
+                transform_class._observables_for_package(package())
+                return
+            transform = transform_class(package())
+            with open(os.devnull, 'w') as devnull:
+                transform.write(devnull)
+        yield name, run
+
+
+def compare(results, baseline, threshold):
+    """Prints the change from the baseline, returning the regressions."""
+    regressions = []
+    print('\ncompared with {}:'.format(baseline['version']))
+    for size, sizes in sorted(results['results'].items(),
+                              key=lambda item: int(item[0])):
+        for name, result in sorted(sizes.items()):
+            try:
+                old = baseline['results'][size][name]['seconds']
+            except KeyError:
+                continue
+            change = result['seconds'] / old - 1
+            flag = ''
+            if change > threshold:
+                flag = 'REGRESSION'
+                regressions.append((size, name))
+            print('{:>12} {:<12} {:>+8.1%} {}'.format(size, name, change,
+                                                      flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='4K,100K,1M,10M',
+                        help='comma separated package sizes (e.g. 1K,1G)')
+    parser.add_argument('--stream', action='store_true',
+                        help='read packages with StreamingStixPackage')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs for each measurement (the '
+                             'fastest is reported)')
+    parser.add_argument('--idref-ratio', type=float, default=0.2,
+                        help='proportion of observables referenced by '
+                             'indicators')
+    parser.add_argument('--composition-ratio', type=float, default=0.2,
+                        help='proportion of observables in compositions')
+    parser.add_argument('--output',
+                        help='save the results (JSON) to this file')
+    parser.add_argument('--baseline',
+                        help='compare with results saved by --output')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown (from the baseline) reported as a '
+                             'regression')
+    options = parser.parse_args()
+
+    results = dict(
+        version=package_version,
+        stream=options.stream,
+        results=dict(),
+    )
+    directory = tempfile.mkdtemp()
+    try:
+        print('{:>12} {:<12} {:>12} {:>10} {:>10} {:>14}'.format(
+            'size', 'measurement', 'observables', 'time(s)', 'MB/s',
+            'observables/s'))
+        for size in options.sizes.split(','):
+            size = parse_size(size)
+            generator = PackageGenerator.for_size(
+                size,
+                idref_ratio=options.idref_ratio,
+                composition_ratio=options.composition_ratio,
+            )
+            filename = os.path.join(directory, '{}.xml'.format(size))
+            generator.save(filename)
+            actual_size = os.path.getsize(filename)
+            count = generator.observable_count
+
+            sizes = results['results'][str(size)] = dict()
+            for name, function in measurements(filename, options.stream):
+                seconds = min(timeit.repeat(function, number=1,
+                                            repeat=options.repeat))
+                sizes[name] = dict(seconds=seconds, bytes=actual_size,
+                                   observables=count)
+                print('{:>12} {:<12} {:>12} {:>10.4f} {:>10.2f} '
+                      '{:>14.0f}'.format(
+                          size, name, count, seconds,
+                          actual_size / seconds / 1024 ** 2,
+                          count / seconds))
+    finally:
+        shutil.rmtree(directory)
+
+    if options.output:
+        with open(options.output, 'w') as file_:
+            json.dump(results, file_, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as file_:
+            baseline = json.load(file_)
+        if baseline.get('stream') != options.stream:
+            parser.error('baseline was measured with a different --stream')
+        if compare(results, baseline, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
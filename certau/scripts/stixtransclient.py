@@ -7,16 +7,26 @@ the STIX package(s), or a STIX package file can be supplied.
 import os
 import sys
 import logging
+import functools
 import dateutil
+import six
 
+from lxml import etree
 from six.moves.urllib.parse import urlunparse
 
 from certau.source import StixFileSource, TaxiiContentBlockSource
+from certau.source import StixWatchSource, TaxiiMultiCollectionSource
+from certau.source import FileManifest, PackageCache, UpgradeCache
 from certau.transform import transform_package, StixMispTransform
+from certau.transform import TRANSFORM_CLASS, TransformPool
+from certau.transform import TransformPipeline, MispPublisher
 from certau.util.stix.ais import ais_refactor
 from certau.util.stix.helpers import package_tlp
 from certau.util.taxii.client import SimpleTaxiiClient
+from certau.util.taxii.poller import MultiCollectionPoller, parse_poll_target
 from certau.util.config import get_arg_parser
+from certau.util.misp.feed import MispFeedWriter
+from certau.util.misp.index import MispIndex
 
 
 def main():
@@ -38,6 +48,7 @@ def main():
     logger.info("logging enabled")
 
     transform_kwargs = {}
+    feed = None
     transform_kwargs['default_title'] = options.default_title
     #should this overwrite the value for misp-info?
 
@@ -58,16 +69,33 @@ def main():
             transform_kwargs['url'] = options.base_url
     elif options.misp:
         transform = 'misp'
-        misp_kwargs = dict(
-            misp_url=options.misp_url,
-            misp_key=options.misp_key,
-            misp_ssl=options.misp_ssl,
-        )
-        if options.misp_client_cert and options.misp_client_key:
-            misp_kwargs['misp_cert'] = (options.misp_client_cert,
-                                        options.misp_client_key)
-        misp = StixMispTransform.get_misp_object(**misp_kwargs)
-        transform_kwargs['misp'] = misp
+        if options.misp_feed:
+            # Write the events to a feed rather than a MISP host
+            try:
+                feed = MispFeedWriter(options.misp_feed,
+                                      org_name=options.misp_feed_org)
+            except OSError:
+                logger.error('unable to create MISP feed directory')
+                return
+            transform_kwargs['feed'] = feed
+            transform_kwargs['misp'] = None
+        else:
+            misp_kwargs = dict(
+                misp_url=options.misp_url,
+                misp_key=options.misp_key,
+                misp_ssl=options.misp_ssl,
+                max_in_flight=options.misp_max_in_flight,
+                rate=options.misp_rate,
+                burst=options.misp_burst,
+                retries=options.misp_retries,
+                backoff=options.misp_backoff,
+                timeout=options.misp_timeout,
+            )
+            if options.misp_client_cert and options.misp_client_key:
+                misp_kwargs['misp_cert'] = (options.misp_client_cert,
+                                            options.misp_client_key)
+            misp = StixMispTransform.get_misp_object(**misp_kwargs)
+            transform_kwargs['misp'] = misp
         transform_kwargs['distribution'] = options.misp_distribution
         transform_kwargs['threat_level'] = options.misp_threat
         transform_kwargs['analysis'] = options.misp_analysis
@@ -75,6 +103,11 @@ def main():
         transform_kwargs['info_short_only'] = options.misp_info_short_only
         transform_kwargs['info_filename_title'] = options.misp_info_filename_title
         transform_kwargs['published'] = options.misp_published
+        transform_kwargs['batch_size'] = options.misp_batch_size
+        transform_kwargs['tag_cache_ttl'] = options.misp_tag_cache_ttl
+        if options.misp_index:
+            transform_kwargs['index'] = MispIndex(options.misp_index)
+            transform_kwargs['index_scope'] = options.misp_index_scope
     elif options.snort:
         transform = 'snort'
         transform_kwargs['snort_initial_sid'] = options.snort_initial_sid
@@ -84,22 +117,55 @@ def main():
         pass
     else:
         logger.error('Unable to determine transform type from options')
+        return
 
     if options.header:
         transform_kwargs['include_header'] = options.header
 
+    if options.stream and options.xml_output:
+        logger.error('--stream cannot be used with --xml_output')
+        return
+
+    if options.cache_dir and not options.xml_output:
+        try:
+            cache = PackageCache(
+                directory=options.cache_dir,
+                transform_classes=TRANSFORM_CLASS.values(),
+                max_size=options.cache_size * 1024 * 1024,
+            )
+        except OSError:
+            logger.error('unable to create cache directory')
+            return
+    else:
+        cache = None
+
+    if options.upgrade_cache_dir:
+        try:
+            upgrade_cache = UpgradeCache(
+                directory=options.upgrade_cache_dir,
+                max_size=options.cache_size * 1024 * 1024,
+            )
+        except OSError:
+            logger.error('unable to create upgrade cache directory')
+            return
+    else:
+        upgrade_cache = None
+
     if options.taxii:
         logger.info("Processing a TAXII message")
-        taxii_client = SimpleTaxiiClient(
+        client_kwargs = dict(
             username=options.username,
             password=options.password,
             key_file=options.key,
             cert_file=options.cert,
             ca_file=options.ca_file,
+            keep_alive=not options.no_keep_alive,
         )
 
         # Build the poll URL if it wasn't provided
-        if options.poll_url is None:
+        if options.poll_target:
+            poll_url = None
+        elif options.poll_url is None:
             scheme = 'https' if options.ssl else 'http'
             netloc = options.hostname
             if options.port:
@@ -126,24 +192,83 @@ def main():
             logger.error('poll end_timestamp is earlier than begin_timestamp')
             return
 
-        content_blocks = taxii_client.poll(
-            poll_url=options.poll_url,
-            collection=options.collection,
-            subscription_id=options.subscription_id,
-            begin_timestamp=begin_timestamp,
-            end_timestamp=end_timestamp,
-            state_file=options.state_file,
-        )
+        if options.poll_target:
+            # Poll several collections concurrently
+            try:
+                targets = [parse_poll_target(target)
+                           for target in options.poll_target]
+            except ValueError as e:
+                logger.error(str(e))
+                return
+            poller = MultiCollectionPoller(
+                targets=targets,
+                client_kwargs=client_kwargs,
+                host_limit=options.poll_host_limit,
+                begin_timestamp=begin_timestamp,
+                end_timestamp=end_timestamp,
+                state_file=options.state_file,
+                prefetch=options.poll_prefetch,
+            )
+            source = TaxiiMultiCollectionSource(
+                content_blocks=poller.content_blocks(),
+                streaming=options.stream,
+                cache=cache,
+                upgrade_cache=upgrade_cache,
+            )
+        else:
+            taxii_client = SimpleTaxiiClient(**client_kwargs)
+            content_blocks = taxii_client.poll(
+                poll_url=poll_url,
+                collection=options.collection,
+                subscription_id=options.subscription_id,
+                begin_timestamp=begin_timestamp,
+                end_timestamp=end_timestamp,
+                state_file=options.state_file,
+                prefetch=options.poll_prefetch,
+            )
 
-        source = TaxiiContentBlockSource(
-            content_blocks=content_blocks,
-            collection=options.collection,
-        )
+            source = TaxiiContentBlockSource(
+                content_blocks=content_blocks,
+                collection=options.collection,
+                streaming=options.stream,
+                cache=cache,
+                upgrade_cache=upgrade_cache,
+            )
 
         logger.info("Processing TAXII content blocks")
     else:
         logger.info("Processing file input")
-        source = StixFileSource(options.file, options.recurse)
+        manifest = None
+        if options.manifest:
+            manifest = FileManifest(options.manifest)
+        if options.watch:
+            source = StixWatchSource(
+                files=options.file,
+                recurse=options.recurse,
+                streaming=options.stream,
+                cache=cache,
+                upgrade_cache=upgrade_cache,
+                manifest=manifest,
+                interval=options.watch_interval,
+                polling=options.watch_polling,
+                include=options.include,
+                exclude=options.exclude,
+                max_depth=options.max_depth,
+                stat_threads=options.stat_threads,
+            )
+        else:
+            source = StixFileSource(
+                files=options.file,
+                recurse=options.recurse,
+                streaming=options.stream,
+                cache=cache,
+                upgrade_cache=upgrade_cache,
+                manifest=manifest,
+                include=options.include,
+                exclude=options.exclude,
+                max_depth=options.max_depth,
+                stat_threads=options.stat_threads,
+            )
 
     if options.xml_output:
         # Try to create the output directory if it doesn't exist
@@ -154,33 +279,109 @@ def main():
                 logger.error('unable to create output directory')
                 return
 
-    for source_item in source.source_items():
-        package = source_item.stix_package
-        if package is not None:
-            if options.xml_output:
-                # Add AIS Marking
-                if options.ais_marking:
-                    tlp = package_tlp(package) or options.ais_default_tlp
-                    ais_refactor(
-                        package=package,
-                        proprietary=options.ais_proprietary,
-                        consent=options.ais_consent,
-                        color=tlp,
-                        country=options.ais_country,
-                        industry=options.ais_industry_type,
-                        admin_area=options.ais_administrative_area,
-                        organisation=options.ais_organisation,
-                    )
-                source_item.save(options.xml_output)
+    if options.xml_output and options.ais_marking:
+        xml_function = functools.partial(add_ais_marking, options=options)
+    else:
+        xml_function = None
+
+    if options.xml_output:
+        transform_class = None
+    else:
+        transform_class = TRANSFORM_CLASS[transform]
+
+    # Results from a pool or pipeline are already transformed (serialised)
+    pretransformed = True
+    if options.workers > 1:
+        # Parse and transform in worker processes, output from here
+        pool = TransformPool(
+            workers=options.workers,
+            transform_class=transform_class,
+            transform_kwargs=transform_kwargs,
+            xml_function=xml_function,
+        )
+        results = pool.results(source.source_items())
+    elif options.taxii and options.pipeline_queue_size > 0:
+        # Poll, parse and transform in separate threads, output from here
+        pipeline = TransformPipeline(
+            transform_class=transform_class,
+            transform_kwargs=transform_kwargs,
+            xml_function=xml_function,
+            queue_size=options.pipeline_queue_size,
+        )
+        results = pipeline.results(source.source_items())
+    else:
+        pretransformed = False
+        results = (
+            (source_item, source_item.stix_package)
+            for source_item in source.source_items()
+        )
+
+    if (not options.xml_output and transform == 'misp' and
+            options.misp_workers > 1):
+        # Publish several packages at once
+        publisher = MispPublisher(
+            workers=options.misp_workers,
+            transform_kwargs=transform_kwargs,
+        )
+        results = publisher.results(results)
+
+    # File sources record each file once its output is complete
+    mark_processed = getattr(source, 'mark_processed', None)
+
+    for source_item, result in results:
+        if result is None:
+            # The package couldn't be parsed
+            pass
+        elif options.xml_output:
+            if pretransformed:
+                # Already serialised by a worker (or the pipeline)
+                source_item.save(options.xml_output, result)
             else:
-                # Peel off the filenames as they come in
-                if transform == 'misp':
-                    try:
-                        transform_kwargs['file_name'] = source_item.file_name()
-                    except:
-                        transform_kwargs['file_name'] = ""
-                transform_package(package, transform, transform_kwargs)
+                if xml_function is not None:
+                    xml_function(result)
+                source_item.save(options.xml_output)
+        elif isinstance(result, six.string_types):
+            # Text output rendered by a worker
+            sys.stdout.write(result)
+        elif isinstance(result, StixMispTransform):
+            # Already published by the MISP publisher
+            pass
+        else:
+            # Peel off the filenames as they come in
+            if transform == 'misp':
+                try:
+                    transform_kwargs['file_name'] = source_item.file_name()
+                except:
+                    transform_kwargs['file_name'] = ""
+            try:
+                transform_package(result, transform, transform_kwargs)
+            except etree.XMLSyntaxError:
+                # Streamed packages are parsed during the transform
+                logger.error('error parsing STIX package (%s)',
+                             source_item.file_name())
+
+        if mark_processed is not None:
+            mark_processed(source_item)
+        if options.watch:
+            sys.stdout.flush()
+
+    if feed is not None:
+        feed.close()
+
 
+def add_ais_marking(package, options):
+    """Add an AIS Marking to a package using the command line options."""
+    tlp = package_tlp(package) or options.ais_default_tlp
+    ais_refactor(
+        package=package,
+        proprietary=options.ais_proprietary,
+        consent=options.ais_consent,
+        color=tlp,
+        country=options.ais_country,
+        industry=options.ais_industry_type,
+        admin_area=options.ais_administrative_area,
+        organisation=options.ais_organisation,
+    )
 
 if __name__ == '__main__':
     main()
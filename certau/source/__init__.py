@@ -2,6 +2,13 @@
 
 from .base import StixSourceItem
 from .files import StixFileSourceItem
+from .files import StixArchiveMemberSourceItem
 from .files import StixFileSource
+from .watch import StixWatchSource
 from .taxii import TaxiiContentBlockSourceItem
 from .taxii import TaxiiContentBlockSource
+from .taxii import TaxiiMultiCollectionSource
+from .cache import PackageCache
+from .cache import UpgradeCache
+from .manifest import FileManifest
+from .scan import FileScanner
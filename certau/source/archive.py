@@ -0,0 +1,118 @@
+"""Reading STIX packages from compressed files and archives.
+
+Files compressed with gzip, bzip2 or xz are decompressed as they are read.
+Each (regular file) member of a zip or tar archive is read as a separate
+package. The type of file is determined from its name.
+"""
+
+import bz2
+import gzip
+import os
+import tarfile
+import zipfile
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+# Compressed files (holding a single package), by suffix
+COMPRESSED_SUFFIXES = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'xz',
+}
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz', '.tbz2',
+                '.tar.xz', '.txz')
+
+ZIP_SUFFIXES = ('.zip',)
+
+# Separates an archive's file name from a member's name
+MEMBER_SEPARATOR = '!'
+
+
+class ArchiveError(Exception):
+    """A compressed file or archive can't be read."""
+
+
+def file_type(path):
+    """Returns 'tar', 'zip', 'gzip', 'bz2' or 'xz' for an archive or
+    compressed file (from its name), or None for other files."""
+    name = path.lower()
+    if name.endswith(TAR_SUFFIXES):
+        return 'tar'
+    if name.endswith(ZIP_SUFFIXES):
+        return 'zip'
+    return COMPRESSED_SUFFIXES.get(os.path.splitext(name)[1])
+
+
+def is_archive(path):
+    """Does the file contain several packages (i.e. is it a zip or tar
+    archive)?"""
+    return file_type(path) in ('tar', 'zip')
+
+
+def uncompressed_name(path):
+    """Returns a compressed file's name without the compression suffix."""
+    if file_type(path) in COMPRESSED_SUFFIXES.values():
+        return os.path.splitext(path)[0]
+    return path
+
+
+def open_compressed(path):
+    """Returns a file object from which the (decompressed) contents of a
+    compressed file can be read, or None if the file isn't compressed."""
+    compression = file_type(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(path, 'rb')
+    if compression == 'xz':
+        if lzma is None:
+            raise ArchiveError('xz compression is not supported (the lzma '
+                               'module is not available)')
+        return lzma.open(path, 'rb')
+    return None
+
+
+def archive_members(path):
+    """Yields (member, data) for each file in a zip or tar archive.
+
+    The members of a zip archive can be opened (with
+    :py:func:`open_member`) when needed, so data is None. The members of a
+    tar archive can only be read in order as the archive is decompressed,
+    so data is the member's contents.
+
+    Raises:
+        ArchiveError: if the archive can't be read
+    """
+    try:
+        if file_type(path) == 'zip':
+            with zipfile.ZipFile(path) as archive:
+                members = [info.filename for info in archive.infolist()
+                           if not info.filename.endswith('/')]
+            for member in members:
+                yield member, None
+        else:
+            # Read as a stream, so the archive is only decompressed once
+            with tarfile.open(path, 'r|*') as archive:
+                for info in archive:
+                    if info.isfile():
+                        member = archive.extractfile(info)
+                        yield info.name, member.read()
+    except (tarfile.TarError, zipfile.BadZipfile, EOFError, IOError,
+            OSError) as e:
+        raise ArchiveError('unable to read archive {} ({})'.format(path, e))
+
+
+def open_member(path, member):
+    """Returns a file object from which a zip archive member can be read
+    (decompressed as it is read)."""
+    with zipfile.ZipFile(path) as archive:
+        # (The member can still be read once the archive is closed)
+        return archive.open(member)
@@ -1,43 +1,179 @@
+import copy
 import logging
 import os
 
 import ramrod
+import six
+import stix
+from lxml import etree
 from stix.core import STIXPackage
-from stix.utils.parser import UnsupportedVersionError
 from stix.extensions.marking import ais  # Needed to support AIS Markings
 
+from certau.util.stix.stream import StreamingStixPackage, sniff_version
+
+
+def _without_comments(element):
+    # python-stix ignores comments and processing instructions when parsing
+    # a document, but can't parse an element containing them
+    for _ in element.iter(etree.Comment, etree.ProcessingInstruction):
+        element = copy.deepcopy(element)
+        etree.strip_tags(element, etree.Comment, etree.ProcessingInstruction)
+        break
+    return element
+
 
 class StixSourceItem(object):
-    """A base class for STIX package containers."""
+    """A base class for STIX package containers.
+
+    The STIX package is parsed when :py:attr:`stix_package` is first used,
+    so source items are cheap to create and can be pickled (e.g. to be
+    handed to a worker process) before parsing.
+
+    Args:
+        source_item: the item (e.g. file name) containing the STIX package
+        streaming: if True, stix_package is a
+            :py:class:`StreamingStixPackage` which reads the package
+            incrementally (when transformed) instead of a STIXPackage
+        cache: an optional :py:class:`PackageCache`, in which case
+            stix_package is a :py:class:`PackageSummary` which is read from
+            the cache if the package has been seen before
+        upgrade_cache: an optional :py:class:`UpgradeCache` used to store
+            packages upgraded to a STIX version supported by python-stix
+    """
+
+    # Packages using other STIX versions are upgraded to this version
+    UPGRADE_VERSION = '1.1.1'
 
-    def __init__(self, source_item):
+    def __init__(self, source_item, streaming=False, cache=None,
+                 upgrade_cache=None):
         self.source_item = source_item
+        self.streaming = streaming
+        self.cache = cache
+        self.upgrade_cache = upgrade_cache
         self._logger = logging.getLogger()
+        self._stix_package = None
+        self._parsed = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_logger']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._logger = logging.getLogger()
+
+    @property
+    def stix_package(self):
+        """The STIX package, or None if it could not be parsed."""
+        if not self._parsed:
+            if self.cache is not None:
+                self._stix_package = self._cached_summary()
+            elif self.streaming:
+                self._stix_package = StreamingStixPackage(self.io)
+            else:
+                self._stix_package = self._parse_package()
+            self._parsed = True
+        return self._stix_package
+
+    def _cached_summary(self):
+        def _package():
+            if self.streaming:
+                return StreamingStixPackage(lambda: six.BytesIO(document))
+            return self._parse_package()
+
+        document = self.read()
         try:
-            self.stix_package = STIXPackage.from_xml(self.io())
-        except UnsupportedVersionError:
-            updated = ramrod.update(self.io(), to_='1.1.1')
-            document = updated.document.as_stringio()
-            self.stix_package = STIXPackage.from_xml(document)
+            return self.cache.summary(document, _package)
+        except etree.XMLSyntaxError:
+            # Streamed packages are parsed when the summary is created
+            self._logger.error('error parsing STIX package (%s)',
+                               self.file_name())
+            return None
+
+    def _parse_package(self):
+        try:
+            # Check the version first, so packages needing an upgrade are
+            # only parsed (in full) by ramrod
+            element = self.element()
+            if element is None:
+                version = sniff_version(self.io)
+            else:
+                version = element.get('version')
+            if version is None or version in stix.supported_stix_version():
+                if element is None:
+                    return STIXPackage.from_xml(self.io())
+                return STIXPackage.from_xml(_without_comments(element))
+            else:
+                return STIXPackage.from_xml(self._upgraded_package())
         except Exception:
             self._logger.error('error parsing STIX package (%s)',
                                self.file_name())
-            self.stix_package = None
+            return None
+
+    def _upgraded_package(self):
+        """Returns the package upgraded with ramrod (as an XML element)."""
+        if self.upgrade_cache is None:
+            self._logger.info('upgrading STIX package (%s)', self.file_name())
+            updated = ramrod.update(self.io(), to_=self.UPGRADE_VERSION)
+            return updated.document.as_element()
+
+        original = self.read()
+        document = self.upgrade_cache.get(original)
+        if document is None:
+            self._logger.info('upgrading STIX package (%s)', self.file_name())
+            updated = ramrod.update(six.BytesIO(original),
+                                    to_=self.UPGRADE_VERSION)
+            document = etree.tostring(updated.document.as_element())
+            self.upgrade_cache.put(original, document)
+        return etree.fromstring(document, etree.XMLParser(huge_tree=True))
 
     def io(self):
         raise NotImplementedError
 
+    def element(self):
+        """Returns the package's root element, if the source item already
+        holds the parsed package (otherwise None)."""
+        return None
+
+    def read(self):
+        """Returns the contents of the source item (as bytes)."""
+        source = self.io()
+        if isinstance(source, six.string_types):
+            with open(source, 'rb') as file_:
+                return file_.read()
+        try:
+            data = source.read()
+        finally:
+            source.close()
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        return data
+
     def file_name(self):
         raise NotImplementedError
 
-    def save(self, directory):
+    def save_name(self):
+        """Returns the name of the file the package is saved to (see
+        :py:func:`save`)."""
+        return self.file_name()
+
+    def save(self, directory, document=None):
+        """Save the STIX package to a file in the given directory.
+
+        Args:
+            directory: the directory in which to create the file
+            document: the serialised package (if already available),
+                otherwise the package is serialised with to_xml()
+        """
         try:
-            stix_package = self.stix_package
-            file_name = self.file_name()
+            file_name = self.save_name()
             full_path = os.path.join(directory, file_name)
             self._logger.info('saving STIX package to file \'%s\'', full_path)
+            if document is None:
+                document = self.stix_package.to_xml()
             with open(full_path, 'wb') as file_:
-                file_.write(self.stix_package.to_xml())
+                file_.write(document)
         except Exception:
             self._logger.error('unable to save STIX package to file \'%s\'',
                                full_path)
@@ -0,0 +1,214 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import zlib
+
+from certau import package_version
+from certau.util.stix.summary import PackageSummary
+
+
+class FileCache(object):
+    """A base class for on-disk caches keyed by package document.
+
+    Values are stored in the cache directory, one file per document, keyed
+    by the SHA-256 hash of the document and the toolkit version. Files are
+    touched when read, and the least recently used files are removed when
+    the total size of the cache exceeds max_size.
+
+    Subclasses implement :py:func:`_dumps` and :py:func:`_loads` to convert
+    values to and from bytes.
+
+    Args:
+        directory: the cache directory (created if it doesn't exist)
+        max_size: the maximum total size of the cache (in bytes)
+    """
+
+    FORMAT = b''
+    SUFFIX = '.cache'
+
+    # Estimated cache sizes for this process, keyed by directory
+    _sizes = dict()
+
+    def __init__(self, directory, max_size=1024 ** 3):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self._logger = logging.getLogger()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_logger']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._logger = logging.getLogger()
+
+    @staticmethod
+    def key(document):
+        """Returns the cache key for a (bytes) package document."""
+        sha256 = hashlib.sha256(package_version.encode('ascii') + b'\0')
+        sha256.update(document)
+        return sha256.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _dumps(self, value):
+        raise NotImplementedError
+
+    def _loads(self, data):
+        raise NotImplementedError
+
+    def get(self, document):
+        """Returns the cached value for a document (or None)."""
+        path = self._path(self.key(document))
+        try:
+            with open(path, 'rb') as file_:
+                data = file_.read()
+            if not data.startswith(self.FORMAT):
+                raise ValueError('unknown cache file format')
+            value = self._loads(data[len(self.FORMAT):])
+        except (IOError, OSError):
+            return None
+        except Exception:
+            self._logger.warning('removing invalid cache file (%s)', path)
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, document, value):
+        """Stores the value for a document."""
+        data = self.FORMAT + self._dumps(value)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file_:
+                file_.write(data)
+            path = self._path(self.key(document))
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            self._logger.warning('unable to write to cache directory (%s)',
+                                 self.directory)
+            self._remove(temp_path)
+            return
+
+        size = self._sizes.get(self.directory)
+        if size is None or size + len(data) > self.max_size:
+            self.evict()
+        else:
+            self._sizes[self.directory] = size + len(data)
+
+    def evict(self):
+        """Removes least recently used files until the cache fits.
+
+        Files are removed until the cache is below 90% of max_size, so
+        that eviction isn't needed again for a while.
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(file_size for _, file_size, _ in files)
+        if size > self.max_size:
+            files.sort()
+            target = self.max_size * 0.9
+            for _, file_size, path in files:
+                if size <= target:
+                    break
+                self._remove(path)
+                size -= file_size
+        self._sizes[self.directory] = size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class PackageCache(FileCache):
+    """An on-disk cache of STIX package summaries.
+
+    Summaries (see :py:class:`PackageSummary`) containing the observables
+    extracted by each of the given transform classes are stored as
+    compressed pickles. A package that has been seen before can then be
+    transformed, by any of the transform classes, without parsing its XML.
+
+    Args:
+        directory: the cache directory (created if it doesn't exist)
+        transform_classes: the transform classes to extract observables for
+        max_size: the maximum total size of the cache (in bytes)
+    """
+
+    FORMAT = b'CTIS1'
+    SUFFIX = '.summary'
+    PICKLE_PROTOCOL = 2
+
+    def __init__(self, directory, transform_classes, max_size=1024 ** 3):
+        super(PackageCache, self).__init__(directory, max_size)
+        self.transform_classes = list(transform_classes)
+
+    def _dumps(self, value):
+        return zlib.compress(pickle.dumps(value, self.PICKLE_PROTOCOL))
+
+    def _loads(self, data):
+        return pickle.loads(zlib.decompress(data))
+
+    def summary(self, document, package):
+        """Returns the summary for a document, creating it if necessary.
+
+        Args:
+            document: the package document (bytes)
+            package: a callable returning the parsed package (a
+                STIXPackage or StreamingStixPackage), or None if it could
+                not be parsed - only called if the document is not cached
+        """
+        summary = self.get(document)
+        if summary is None:
+            stix_package = package()
+            if stix_package is None:
+                return None
+            summary = PackageSummary.from_package(stix_package,
+                                                  self.transform_classes)
+            self.put(document, summary)
+        return summary
+
+
+class UpgradeCache(FileCache):
+    """An on-disk cache of upgraded STIX package documents.
+
+    Packages using a STIX version not supported by python-stix are upgraded
+    with ramrod before being parsed. This cache stores the upgraded
+    documents (compressed) so each package only needs to be upgraded once.
+
+    Args:
+        directory: the cache directory (created if it doesn't exist)
+        max_size: the maximum total size of the cache (in bytes)
+    """
+
+    FORMAT = b'CTIU1'
+    SUFFIX = '.xml.z'
+
+    def _dumps(self, value):
+        return zlib.compress(value)
+
+    def _loads(self, data):
+        return zlib.decompress(data)
@@ -1,16 +1,90 @@
+import logging
 import os
 
+import six
+
+from .archive import ArchiveError, MEMBER_SEPARATOR
+from .archive import archive_members, is_archive, open_compressed
+from .archive import open_member, uncompressed_name
 from .base import StixSourceItem
+from .manifest import file_signature
+from .scan import FileScanner
 
 
 class StixFileSourceItem(StixSourceItem):
+    """A STIX package file.
+
+    Files compressed with gzip, bzip2 or xz (see :py:mod:`archive`) are
+    decompressed as they are read.
+
+    Args:
+        signature: the file's (size, mtime) when it was found, if it is to
+            be recorded in a :py:class:`FileManifest` once processed
+        final: whether the file has been processed once this item has been
+            processed (False for all but the last member of an archive)
+    """
+
+    def __init__(self, source_item, streaming=False, cache=None,
+                 upgrade_cache=None, signature=None, final=True):
+        super(StixFileSourceItem, self).__init__(
+            source_item,
+            streaming,
+            cache,
+            upgrade_cache,
+        )
+        self.signature = signature
+        self.final = final
 
     def io(self):
-        return self.source_item
+        return open_compressed(self.source_item) or self.source_item
 
     def file_name(self):
         return self.source_item
 
+    def save_name(self):
+        return uncompressed_name(self.source_item)
+
+
+class StixArchiveMemberSourceItem(StixFileSourceItem):
+    """A STIX package file in a zip or tar archive.
+
+    The file name is the archive's file name and the member's name,
+    separated by '!' (e.g. ``packages.zip!2017/package.xml``).
+
+    Args:
+        source_item: the archive's file name
+        member: the member's name
+        data: the member's contents, if already read (otherwise the member
+            is read from the archive when needed)
+    """
+
+    def __init__(self, source_item, member, data=None, streaming=False,
+                 cache=None, upgrade_cache=None, signature=None,
+                 final=True):
+        super(StixArchiveMemberSourceItem, self).__init__(
+            source_item,
+            streaming,
+            cache,
+            upgrade_cache,
+            signature,
+            final,
+        )
+        self.member = member
+        self.data = data
+
+    def io(self):
+        if self.data is not None:
+            return six.BytesIO(self.data)
+        return open_member(self.source_item, self.member)
+
+    def file_name(self):
+        return MEMBER_SEPARATOR.join([self.source_item, self.member])
+
+    def save_name(self):
+        # Saved alongside the archive (as a single file)
+        return MEMBER_SEPARATOR.join([self.source_item,
+                                      self.member.replace('/', '_')])
+
 
 class StixFileSource(object):
     """Return STIX packages from a file or directory.
@@ -20,24 +94,106 @@ class StixFileSource(object):
             directories
         recurse: an optional boolean value (default False), which when set
             to True, will cause subdirectories to be searched recursively
+        streaming: an optional boolean value (default False), which when set
+            to True, will cause packages to be read incrementally (see
+            :py:class:`StreamingStixPackage`)
+        cache: an optional :py:class:`PackageCache` used to store package
+            summaries
+        upgrade_cache: an optional :py:class:`UpgradeCache` used to store
+            upgraded packages
+        manifest: an optional :py:class:`FileManifest`, in which case files
+            already recorded in the manifest are skipped (and the caller
+            records each file with :py:func:`mark_processed`)
+        include: an optional list of patterns for the files to read from
+            directories (see :py:class:`FileScanner`)
+        exclude: an optional list of patterns for the files and
+            subdirectories to skip
+        max_depth: the maximum depth of subdirectories searched when
+            recursing (default no limit)
+        stat_threads: the number of threads used to stat files when
+            checking them against the manifest (e.g. on network
+            filesystems)
     """
 
-    def __init__(self, files, recurse=False):
+    def __init__(self, files, recurse=False, streaming=False, cache=None,
+                 upgrade_cache=None, manifest=None, include=None,
+                 exclude=None, max_depth=None, stat_threads=0):
         self.files = files
         self.recurse = recurse
+        self.streaming = streaming
+        self.cache = cache
+        self.upgrade_cache = upgrade_cache
+        self.manifest = manifest
+        self.scanner = FileScanner(recurse, include, exclude, max_depth,
+                                   stat_threads)
+        self._logger = logging.getLogger()
 
     def source_items(self):
-        for file_ in self.files:
-            for another_file in self.scan(file_):
-                yield StixFileSourceItem(another_file)
+        if self.manifest is None:
+            paths = ((path, None) for path in self.scanner.files(self.files))
+        else:
+            paths = self.scanner.stat_files(self.files)
+        for path, stat in paths:
+            for source_item in self.file_source_items(path, stat):
+                yield source_item
+
+    def file_source_items(self, path, stat=None):
+        """Yields the source items for a file: one for each member of a zip
+        or tar archive (matching the include and exclude patterns), or one
+        for any other file. Nothing is returned for a file recorded in the
+        manifest (or that no longer exists).
+
+        Args:
+            path: the file's name
+            stat: the file's os.stat() result, if already known
+        """
+        signature = None
+        if self.manifest is not None:
+            try:
+                signature = file_signature(stat or os.stat(path))
+            except OSError:
+                return
+            if self.manifest.is_processed(path, signature):
+                return
+        if not is_archive(path):
+            yield StixFileSourceItem(path, self.streaming, self.cache,
+                                     self.upgrade_cache, signature)
+            return
+
+        # Each member is returned once the next is found, so the last one
+        # can be marked as final
+        previous = None
+        try:
+            for member, data in archive_members(path):
+                if not self.scanner.included(member):
+                    continue
+                if previous is not None:
+                    yield previous
+                previous = StixArchiveMemberSourceItem(
+                    path,
+                    member,
+                    data,
+                    self.streaming,
+                    self.cache,
+                    self.upgrade_cache,
+                    signature,
+                    final=False,
+                )
+        except ArchiveError as e:
+            self._logger.error('%s', e)
+            return
+        if previous is not None:
+            previous.final = True
+            yield previous
+
+    def mark_processed(self, source_item):
+        """Records a source item's file in the manifest (if any), once all
+        the items from the file have been processed."""
+        if (self.manifest is not None and source_item.final and
+                source_item.signature is not None):
+            self.manifest.mark_processed(source_item.source_item,
+                                         source_item.signature)
 
     def scan(self, file_):
-        if os.path.isdir(file_):
-            for dir_file in sorted(os.listdir(file_)):
-                path = os.path.join(file_, dir_file)
-                if os.path.isdir(path) and self.recurse:
-                    self.scan(path)
-                elif os.path.isfile(path):
-                    yield path
-        elif os.path.isfile(file_):
-            yield file_
+        """Yields the files in file_ (a file or directory)."""
+        return self.scanner.files([file_])
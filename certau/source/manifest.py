@@ -0,0 +1,86 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_file (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    processed REAL NOT NULL
+);
+"""
+
+
+def file_signature(stat):
+    """Returns the (size, mtime) recorded for a file from its os.stat()
+    result (mtime in nanoseconds)."""
+    mtime = getattr(stat, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(stat.st_mtime * 1e9)
+    return stat.st_size, mtime
+
+
+class FileManifest(object):
+    """Records the input files that have been processed.
+
+    Each file is recorded with its size and modification time, so a file
+    that is modified after it has been processed is processed again. The
+    manifest is kept in an SQLite database, updated as each file is
+    processed, so the files processed before an interruption aren't
+    processed again.
+
+    Args:
+        filename: the manifest file (created if it doesn't exist), or
+            ':memory:' for a manifest that isn't saved
+    """
+
+    def __init__(self, filename):
+        if filename != ':memory:':
+            filename = os.path.abspath(filename)
+        self.filename = filename
+        self._logger = logging.getLogger()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        if filename != ':memory:':
+            # Updates are small and frequent, so don't sync each one to disk
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def is_processed(self, path, signature):
+        """Has the file been processed (with the given signature)?
+
+        Args:
+            path: the file's path
+            signature: the file's (size, mtime) (see
+                :py:func:`file_signature`)
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT size, mtime FROM processed_file WHERE path = ?',
+                (os.path.abspath(path),),
+            ).fetchone()
+        return row is not None and tuple(row) == tuple(signature)
+
+    def mark_processed(self, path, signature):
+        """Records that a file (with the given signature) was processed."""
+        size, mtime = signature
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO processed_file VALUES (?, ?, ?, ?)',
+                (os.path.abspath(path), size, mtime, time.time()),
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM processed_file').fetchone()[0]
@@ -0,0 +1,253 @@
+import collections
+import fnmatch
+import os
+import stat as stat_module
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+# The number of files stat'ed by a thread at a time
+_STAT_BATCH = 64
+
+
+class FileScanner(object):
+    """Finds the files in directories (and, optionally, subdirectories).
+
+    Directories are read with scandir (where available), which returns
+    each entry's type along with its name, so files and directories can
+    usually be told apart without calling stat() for each entry. Each
+    directory's entries are sorted by name, and subdirectories are scanned
+    as they are reached, so files are returned as they are found, and in
+    the same order on every scan, without listing the whole tree first.
+
+    Include and exclude patterns are shell-style wildcards (see
+    :py:mod:`fnmatch`), matched against both the name of a file or
+    directory and its path relative to the directory being scanned (using
+    '/' as the separator), e.g. ``*.xml`` or ``archive/2017/*``. Excluded
+    directories are not scanned. The patterns only apply to the contents of
+    directories: a file that is named explicitly is always returned.
+
+    On network filesystems, where each stat() is a round trip to the
+    server, the files' stat() results (see :py:func:`stat_files`) can be
+    fetched by several threads at once.
+
+    Args:
+        recurse: scan subdirectories
+        include: an optional list of patterns, in which case only files
+            matching one of the patterns are returned
+        exclude: an optional list of patterns for files and directories to
+            skip
+        max_depth: the maximum depth of subdirectories scanned when
+            recursing (1 for the immediate subdirectories only), or None
+            for no limit
+        stat_threads: the number of threads used to stat files (if 0,
+            files are stat'ed as they are returned)
+    """
+
+    def __init__(self, recurse=False, include=None, exclude=None,
+                 max_depth=None, stat_threads=0):
+        self.recurse = recurse
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.max_depth = max_depth if recurse else 0
+        self.stat_threads = stat_threads
+
+    def files(self, paths):
+        """Yields the path of each file in paths (files or directories)."""
+        for entry in self._entries(paths):
+            yield entry.path
+
+    def stat_files(self, paths):
+        """Yields (path, stat) for each file in paths, where stat is the
+        file's os.stat() result (or None if it couldn't be stat'ed)."""
+        if self.stat_threads <= 0:
+            for entry in self._entries(paths):
+                yield entry.path, self._stat(entry)
+            return
+
+        pool = ThreadPool(self.stat_threads)
+        try:
+            # Entries are stat'ed in batches, keeping enough batches in
+            # flight to keep the threads busy without reading ahead through
+            # the whole tree
+            pending = collections.deque()
+            for batch in self._batches(self._entries(paths)):
+                pending.append(pool.apply_async(self._stat_batch, (batch,)))
+                if len(pending) >= self.stat_threads * 2:
+                    for item in pending.popleft().get():
+                        yield item
+            while pending:
+                for item in pending.popleft().get():
+                    yield item
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def _batches(entries, size=_STAT_BATCH):
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @classmethod
+    def _stat_batch(cls, batch):
+        return [(entry.path, cls._stat(entry)) for entry in batch]
+
+    def directories(self, paths):
+        """Yields each directory (in paths) that is scanned."""
+        for path in paths:
+            if os.path.isdir(path):
+                yield path
+                for directory in self._subdirectories(path):
+                    yield directory
+
+    def included(self, path, top=None):
+        """Would a scan of the directory top return the file path?"""
+        if self.excluded(path, top):
+            return False
+        return not self.include or self._matches(
+            self.include,
+            os.path.basename(path),
+            self._relative(path, top),
+        )
+
+    def excluded(self, path, top=None):
+        """Does an exclude pattern match path (in the directory top)?"""
+        return self._matches(self.exclude, os.path.basename(path),
+                             self._relative(path, top))
+
+    @staticmethod
+    def _relative(path, top):
+        if top is None:
+            relative = path
+        else:
+            relative = os.path.relpath(path, top)
+        return relative.replace(os.sep, '/')
+
+    @staticmethod
+    def _matches(patterns, name, relative):
+        for pattern in patterns:
+            if (fnmatch.fnmatch(name, pattern) or
+                    fnmatch.fnmatch(relative, pattern)):
+                return True
+        return False
+
+    @staticmethod
+    def _stat(entry):
+        try:
+            return entry.stat()
+        except OSError:
+            return None
+
+    def _entries(self, paths):
+        # Yields an entry for each file in paths
+        for path in paths:
+            if os.path.isdir(path):
+                for entry in self._scan(path):
+                    yield entry
+            elif os.path.isfile(path):
+                yield _PathEntry(path)
+
+    def _subdirectories(self, top):
+        for entry in self._scan(top, directories=True):
+            yield entry.path
+
+    def _scan(self, top, directories=False):
+        # Yields the file entries in top and its subdirectories (or the
+        # subdirectory entries, if directories is True), depth first
+        # (Each directory's path relative to top is kept with its entries)
+        stack = [(iter(self._listdir(top)), '')]
+        while stack:
+            entries, prefix = stack[-1]
+            entry = next(entries, None)
+            if entry is None:
+                stack.pop()
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            relative = prefix + entry.name
+            if is_dir:
+                if self.max_depth is not None and len(stack) > self.max_depth:
+                    continue
+                if self._matches(self.exclude, entry.name, relative):
+                    continue
+                if entry.is_symlink() and self._is_loop(entry.path):
+                    continue
+                if directories:
+                    yield entry
+                stack.append((iter(self._listdir(entry.path)),
+                              relative + '/'))
+            elif not directories and self._is_file(entry):
+                if self._matches(self.exclude, entry.name, relative):
+                    continue
+                if (self.include and
+                        not self._matches(self.include, entry.name,
+                                          relative)):
+                    continue
+                yield entry
+
+    @staticmethod
+    def _is_loop(path):
+        # Does a symbolic link point to one of its parent directories?
+        target = os.path.join(os.path.realpath(path), '')
+        parent = os.path.join(os.path.realpath(os.path.dirname(path)), '')
+        return parent.startswith(target)
+
+    @staticmethod
+    def _is_file(entry):
+        try:
+            return entry.is_file()
+        except OSError:
+            return False
+
+    @staticmethod
+    def _listdir(directory):
+        # Returns a directory's entries, sorted by name
+        try:
+            if scandir is None:
+                entries = [_PathEntry(os.path.join(directory, name))
+                           for name in os.listdir(directory)]
+            else:
+                entries = list(scandir(directory))
+        except OSError:
+            return []
+        entries.sort(key=lambda entry: entry.name)
+        return entries
+
+
+class _PathEntry(object):
+    """A minimal equivalent of os.DirEntry (for when scandir isn't
+    available, or for files named explicitly)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+    def is_dir(self):
+        return stat_module.S_ISDIR(self.stat().st_mode)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def is_file(self):
+        return stat_module.S_ISREG(self.stat().st_mode)
@@ -1,4 +1,5 @@
-from six import StringIO
+import six
+from libtaxii.messages_11 import ContentBlock
 
 from certau.util.taxii import file_name_for_content_block
 from certau.source.base import StixSourceItem
@@ -6,12 +7,38 @@ from certau.source.base import StixSourceItem
 
 class TaxiiContentBlockSourceItem(StixSourceItem):
 
-    def __init__(self, content_block, collection):
+    def __init__(self, content_block, collection, streaming=False,
+                 cache=None, upgrade_cache=None):
         self.collection = collection
-        super(TaxiiContentBlockSourceItem, self).__init__(content_block)
+        super(TaxiiContentBlockSourceItem, self).__init__(
+            content_block,
+            streaming,
+            cache,
+            upgrade_cache,
+        )
+
+    def __getstate__(self):
+        # Content blocks (with XML content) hold lxml elements, which can't
+        # be pickled, so they are pickled as XML
+        state = super(TaxiiContentBlockSourceItem, self).__getstate__()
+        state['source_item'] = self.source_item.to_xml()
+        return state
+
+    def __setstate__(self, state):
+        state['source_item'] = ContentBlock.from_xml(state['source_item'])
+        super(TaxiiContentBlockSourceItem, self).__setstate__(state)
 
     def io(self):
-        return StringIO(self.source_item.content)
+        content = self.source_item.content
+        if isinstance(content, six.binary_type):
+            return six.BytesIO(content)
+        return six.StringIO(content)
+
+    def element(self):
+        # XML content is held (and can be parsed) as an lxml element
+        if self.source_item.content_is_xml:
+            return self.source_item._content
+        return None
 
     def file_name(self):
         return file_name_for_content_block(
@@ -23,13 +50,47 @@ class TaxiiContentBlockSourceItem(StixSourceItem):
 class TaxiiContentBlockSource(object):
     """Return STIX packages obtained from a TAXII poll."""
 
-    def __init__(self, content_blocks, collection):
+    def __init__(self, content_blocks, collection, streaming=False,
+                 cache=None, upgrade_cache=None):
         self.content_blocks = content_blocks
         self.collection = collection
+        self.streaming = streaming
+        self.cache = cache
+        self.upgrade_cache = upgrade_cache
 
     def source_items(self):
         for content_block in self.content_blocks:
             yield TaxiiContentBlockSourceItem(
                 content_block=content_block,
                 collection=self.collection,
+                streaming=self.streaming,
+                cache=self.cache,
+                upgrade_cache=self.upgrade_cache,
+            )
+
+
+class TaxiiMultiCollectionSource(object):
+    """Return STIX packages obtained by polling several collections.
+
+    Args:
+        content_blocks: (target, content_block) tuples, where target is a
+            :py:class:`PollTarget` (e.g. from
+            :py:func:`MultiCollectionPoller.content_blocks`)
+    """
+
+    def __init__(self, content_blocks, streaming=False, cache=None,
+                 upgrade_cache=None):
+        self.content_blocks = content_blocks
+        self.streaming = streaming
+        self.cache = cache
+        self.upgrade_cache = upgrade_cache
+
+    def source_items(self):
+        for target, content_block in self.content_blocks:
+            yield TaxiiContentBlockSourceItem(
+                content_block=content_block,
+                collection=target.collection,
+                streaming=self.streaming,
+                cache=self.cache,
+                upgrade_cache=self.upgrade_cache,
             )
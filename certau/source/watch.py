@@ -0,0 +1,280 @@
+import collections
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import six
+
+from .files import StixFileSource
+from .manifest import FileManifest
+from .scan import FileScanner
+
+
+# inotify event masks (from <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_EVENT = struct.Struct('iIII')
+
+
+class StixWatchSource(StixFileSource):
+    """Return STIX packages from files as they are added to directories.
+
+    The files are first read as for :py:class:`StixFileSource`, then the
+    directories are watched, and files that are added (or modified) are
+    returned as they appear, until the caller stops iterating. The files in
+    each directory are processed once: the caller records each file in the
+    manifest (see :py:func:`mark_processed`) once it has been processed,
+    and files that are in the manifest (and haven't since been modified)
+    are skipped, including in later runs with the same manifest.
+
+    On Linux, the directories are watched with inotify, and files are
+    returned once they have been closed (after writing) or moved into a
+    directory. Elsewhere, or with polling (e.g. for directories on network
+    filesystems, where inotify doesn't see changes made on other hosts),
+    the directories are scanned every interval seconds.
+
+    Args:
+        files: the names of one or more files or directories (files are
+            only read at startup, and when polling)
+        manifest: an optional :py:class:`FileManifest` (by default, files
+            are only recorded while the source is in use)
+        interval: the time (in seconds) between scans when polling
+        settle: files found by a scan are skipped until they have not been
+            modified for this many seconds (they may still be being written)
+        polling: scan the directories, even if inotify is available
+
+    Other arguments are as for :py:class:`StixFileSource`.
+    """
+
+    def __init__(self, files, recurse=False, streaming=False, cache=None,
+                 upgrade_cache=None, manifest=None, interval=5.0,
+                 settle=1.0, polling=False, include=None, exclude=None,
+                 max_depth=None, stat_threads=0):
+        if manifest is None:
+            manifest = FileManifest(':memory:')
+        super(StixWatchSource, self).__init__(
+            files,
+            recurse,
+            streaming,
+            cache,
+            upgrade_cache,
+            manifest,
+            include,
+            exclude,
+            max_depth,
+            stat_threads,
+        )
+        self.interval = interval
+        self.settle = settle
+        self.polling = polling
+        self._logger = logging.getLogger()
+        # Files returned but not yet processed, with their signatures
+        # (the source may be read in another thread, see TransformPool)
+        self._pending = dict()
+        self._pending_lock = threading.Lock()
+        # Files found by a scan that were still being modified
+        self._unsettled = []
+
+    def source_items(self):
+        inotify = self._inotify()
+        try:
+            if inotify is not None:
+                for directory in self._directories():
+                    inotify.add_watch(directory)
+            paths = self._scan_all()
+            while True:
+                for path in paths:
+                    for source_item in self.file_source_items(path):
+                        yield source_item
+                paths = self._changed_paths(inotify)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def _inotify(self):
+        if self.polling:
+            return None
+        try:
+            return _Inotify()
+        except (OSError, AttributeError) as e:
+            self._logger.info('inotify not available (%s), polling for '
+                              'new files every %s seconds', e, self.interval)
+            return None
+
+    def _directories(self):
+        # The directories to watch (including subdirectories if recursing)
+        return self.scanner.directories(self.files)
+
+    def _top(self, path):
+        # Returns the directory (in files) containing path
+        for file_ in self.files:
+            if path == file_ or path.startswith(os.path.join(file_, '')):
+                return file_
+        return None
+
+    def _new_directory(self, inotify, path, paths):
+        # Watches a new subdirectory (and its subdirectories), adding the
+        # files created before it was watched to paths
+        top = self._top(path)
+        relative = os.path.relpath(path, top).replace(os.sep, '/')
+        depth = relative.count('/') + 1
+        if (self.scanner.max_depth is not None and
+                depth > self.scanner.max_depth):
+            return
+        if self.scanner.excluded(path, top):
+            return
+        scanner = FileScanner(
+            recurse=True,
+            exclude=self.scanner.exclude,
+            max_depth=(None if self.scanner.max_depth is None
+                       else self.scanner.max_depth - depth),
+        )
+        for directory in scanner.directories([path]):
+            inotify.add_watch(directory)
+        for file_ in scanner.files([path]):
+            if self.scanner.included(file_, top):
+                paths[file_] = None
+
+    def _scan_all(self):
+        return self._settled(self.scanner.stat_files(self.files))
+
+    def _settled(self, files):
+        # Returns the files (from (path, stat) tuples) that have settled
+        # (and so can be read), keeping the rest to be checked again
+        now = time.time()
+        settled = []
+        self._unsettled = []
+        for path, stat in files:
+            if stat is None:
+                continue
+            if now - stat.st_mtime >= self.settle:
+                settled.append(path)
+            else:
+                self._unsettled.append(path)
+        return settled
+
+    def _changed_paths(self, inotify):
+        """Waits for new or modified files, returning their paths."""
+        if inotify is None:
+            time.sleep(self.interval)
+            return self._scan_all()
+
+        paths = collections.OrderedDict()
+        unsettled = self._unsettled
+        events = inotify.read(self.settle if unsettled else self.interval)
+        while events:
+            for directory, name, mask in events:
+                if mask & IN_Q_OVERFLOW:
+                    self._logger.warning('missed inotify events, '
+                                         'scanning for new files')
+                    return self._scan_all()
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if self.recurse and mask & (IN_CREATE | IN_MOVED_TO):
+                        self._new_directory(inotify, path, paths)
+                elif (mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and
+                        self.scanner.included(path, self._top(directory))):
+                    paths[path] = None
+            # Collect any further events that are already waiting
+            events = inotify.read(0)
+        for path in self._settled((path, self._stat(path))
+                                  for path in unsettled):
+            paths[path] = None
+        return list(paths)
+
+    @staticmethod
+    def _stat(path):
+        try:
+            return os.stat(path)
+        except OSError:
+            return None
+
+    def file_source_items(self, path, stat=None):
+        source_items = super(StixWatchSource, self).file_source_items(path,
+                                                                     stat)
+        for index, source_item in enumerate(source_items):
+            # (Every item from a file has the file's signature)
+            if index == 0:
+                with self._pending_lock:
+                    returned = (self._pending.get(path) ==
+                                source_item.signature)
+                    self._pending[path] = source_item.signature
+                if returned:
+                    # Already returned (and not yet processed)
+                    source_items.close()
+                    return
+            yield source_item
+
+    def mark_processed(self, source_item):
+        super(StixWatchSource, self).mark_processed(source_item)
+        path = source_item.source_item
+        with self._pending_lock:
+            if (source_item.final and
+                    self._pending.get(path) == source_item.signature):
+                del self._pending[path]
+
+
+class _Inotify(object):
+    """A minimal interface to Linux inotify (using ctypes)."""
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self.fd = self._libc.inotify_init()
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._directories = dict()
+
+    def add_watch(self, directory):
+        path = directory
+        if isinstance(path, six.text_type):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = self._libc.inotify_add_watch(self.fd, path, self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        self._directories[wd] = directory
+
+    def read(self, timeout):
+        """Returns (directory, name, mask) tuples for the events that
+        arrive within timeout seconds (or an empty list)."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            directory = self._directories.get(wd)
+            if mask & IN_IGNORED:
+                # The directory was removed
+                self._directories.pop(wd, None)
+            if six.PY3:
+                name = os.fsdecode(name)
+            events.append((directory, name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
@@ -18,6 +18,7 @@ There are two broad types of transform currently supported:
 
 #. Transforms that interact with a service:
      * :py:class:`StixMispTransform` - publish indicators to a MISP instance
+       (:py:class:`MispPublisher` publishes several packages at once)
 """
 
 import sys
@@ -29,6 +30,10 @@ from .csv import StixCsvTransform
 from .brointel import StixBroIntelTransform
 from .snort import StixSnortTransform
 from .misp import StixMispTransform
+from .pool import TransformPool
+from .pipeline import TransformPipeline
+from .publisher import MispPublisher
+from .registry import ObservableRegistry
 
 
 TRANSFORM_CLASS = {
@@ -47,6 +52,6 @@ def transform_package(package, transform, transform_kwargs):
         transform_class = TRANSFORM_CLASS[transform]
         transform = transform_class(package, **transform_kwargs)
         if isinstance(transform, StixTextTransform):
-            sys.stdout.write(transform.text())
+            transform.write(sys.stdout)
         elif isinstance(transform, StixMispTransform):
             transform.publish()
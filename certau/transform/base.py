@@ -1,15 +1,21 @@
 import logging
 import pprint
-import copy
 import types
 import six
 
+from lxml import etree
 from mixbox.entities import EntityList
 from cybox.core import Object
 from cybox.common import ObjectProperties
 from stix.core import STIXPackage
 
 import certau.util.stix.helpers as stix_helpers
+from certau.util.stix.stream import StreamingStixPackage
+from certau.util.stix.stream import element_value_condition
+from certau.util.stix.summary import PackageSummary
+
+from .fields import compile_fields
+from .registry import ObservableRegistry
 
 
 class StixTransform(object):
@@ -21,7 +27,8 @@ class StixTransform(object):
     transform STIX packages into alternate formats.
 
     The default constructor processes a STIX package to initialise
-    self.observables, a :py:class:`dict` keyed by object type.
+    self.observables, an :py:class:`ObservableRegistry` (a :py:class:`dict`
+    keyed by object type).
     Each entry contains a list :py:class:`list` of :py:class:`dict` objects
     with three keys: 'id', 'observable', and 'fields', containing the
     observable ID, the :py:class:`Observable<cybox.core.observable.Observable>`
@@ -89,7 +96,7 @@ class StixTransform(object):
 
     @package.setter
     def package(self, package):
-        if not isinstance(package, STIXPackage):
+        if not isinstance(package, (STIXPackage, PackageSummary)):
             raise TypeError('expected STIXPackage object')
         self._package = package
 
@@ -215,181 +222,262 @@ class StixTransform(object):
               previous locations
 
         Args:
-            package: a :py:class:`stix:STIXPackage` object
+            package: a :py:class:`stix:STIXPackage` object or a
+                :py:class:`PackageSummary` object (in which case the
+                'observable' entry of each result is None)
 
         Returns:
-            dict: a dictionary of valid observables, keyed by object type
-                (See description above). May be empty.
+            :py:class:`ObservableRegistry`: a dictionary of valid
+                observables, keyed by object type (See description above).
+                May be empty.
         """
+        if isinstance(package, PackageSummary):
+            observables = package.observables_for(cls)
+            if observables is not None:
+                return observables
+
+        observables = ObservableRegistry()
+        for id_, object_type, properties, observable, location in \
+                cls._package_observables(package):
+            if (id_ is None or object_type is None or
+                    observables.has_id(id_)):
+                continue
+            if object_type in cls.OBJECT_FIELDS:
+                fields = cls._field_values_for_properties(
+                    object_type,
+                    properties,
+                )
+                if not fields:
+                    continue
+            elif not cls.OBJECT_FIELDS:
+                fields = None
+            else:
+                continue
+            observables.add(id_, object_type, observable, fields, location)
+        return observables
 
-        def _add_observables(new_observables):
-            for observable in new_observables:
+    @classmethod
+    def _package_observables(cls, package):
+        """Yields the candidate observables from a STIX package.
+
+        Yields:
+            tuple: (id, object_type, properties, observable, location) for
+                each observable found in the locations described in
+                :py:func:`_observables_for_package`, where location is one
+                of :py:attr:`ObservableRegistry.LOCATIONS`.
+        """
+        def _walk(observables, location):
+            for observable in observables:
                 if observable.observable_composition is not None:
-                    _add_observables(
-                        observable.observable_composition.observables
-                    )
+                    composition = observable.observable_composition
+                    for item in _walk(composition.observables, 'composition'):
+                        yield item
                 else:
-                    object_type = cls._observable_object_type(observable)
-                    if (observable.id_ is not None and
-                            observable.id_ not in observable_ids and
-                            object_type is not None):
-                        object_type = cls._observable_object_type(observable)
-                        if object_type in cls.OBJECT_FIELDS.keys():
-                            fields = cls._field_values_for_observable(
-                                observable
-                            )
-                            if not fields:
-                                continue
-                        elif not cls.OBJECT_FIELDS:
-                            fields = None
-                        else:
-                            continue
-                        if object_type not in observables:
-                            observables[object_type] = []
-                        new_observable = dict(
-                            id=observable.id_,
-                            observable=observable,
-                            fields=fields,
-                        )
-                        observables[object_type].append(new_observable)
-                        observable_ids.append(observable.id_)
+                    properties = cls._observable_properties(observable)
+                    yield (
+                        observable.id_,
+                        properties.__class__.__name__ if properties else None,
+                        properties,
+                        observable,
+                        location,
+                    )
+
+        if isinstance(package, StreamingStixPackage):
+            for id_, object_type, properties, location in \
+                    package.iter_observables():
+                yield id_, object_type, properties, None, location
+            return
+        elif isinstance(package, PackageSummary):
+            raise ValueError('package summary contains no observables for '
+                             '{}'.format(cls.__name__))
 
         # Look for observables in the package root and in indicators
-        observable_ids = []
-        observables = dict()
         if package.observables:
-            _add_observables(package.observables)
+            for item in _walk(package.observables, 'root'):
+                yield item
         if package.indicators:
-            for i in package.indicators:
-                if i.observables:
-                    _add_observables(i.observables)
-        return observables
+            for indicator in package.indicators:
+                if indicator.observables:
+                    for item in _walk(indicator.observables, 'indicator'):
+                        yield item
 
     @classmethod
     def _field_values_for_observable(cls, observable):
         """Collects property field values for an observable."""
-        object_type = cls._observable_object_type(observable)
-        fields = list(cls.OBJECT_FIELDS[object_type])
+        return cls._field_values_for_properties(
+            cls._observable_object_type(observable),
+            cls._observable_properties(observable),
+        )
+
+    @classmethod
+    def _field_plan(cls, object_type):
+        """Returns the compiled field accessors for an object type.
 
-        # Add any fields required for constraint checking
-        if object_type in cls.OBJECT_CONSTRAINTS.keys():
-            for field in cls.OBJECT_CONSTRAINTS[object_type]:
+        The accessors cover the OBJECT_FIELDS for the object type as well as
+        any fields required for constraint checking. They are compiled on
+        first use and cached on the transform class.
+        """
+        plans = cls.__dict__.get('_field_plans')
+        if plans is None:
+            plans = dict()
+            cls._field_plans = plans
+        plan = plans.get(object_type)
+        if plan is None:
+            fields = list(cls.OBJECT_FIELDS[object_type])
+
+            # Add any fields required for constraint checking
+            for field in cls.OBJECT_CONSTRAINTS.get(object_type, []):
                 if field not in fields:
                     fields.append(field)
 
-        # Get field values
-        values = []
-        properties = cls._observable_properties(observable)
-        cls._field_values_for_entity(values, properties, fields)
-
-        # Check constraints
-        if object_type in cls.OBJECT_CONSTRAINTS.keys():
-            for field in cls.OBJECT_CONSTRAINTS[object_type]:
-                for value in values:
-                    # Multiple constraints are combined with an implied 'AND'
-                    # (i.e. all of the constraints must be satisfied)
-                    if (field not in value or value[field] not in
-                            cls.OBJECT_CONSTRAINTS[object_type][field]):
-                        values.remove(value)
-                        break
-                    # Remove the constraint field if not needed
-                    if field not in cls.OBJECT_FIELDS[object_type]:
-                        del value[field]
-        return values
+            plan = compile_fields(fields)
+            plans[object_type] = plan
+        return plan
 
     @classmethod
-    def _field_values_for_entity(cls, values, entity, fields, first_part=''):
-        """Returns requested field values from a cybox.Entity object."""
-
-        def _first_parts(fields):
-            """Get the bits on the left of the first dot in the field names.
-            """
-            first_parts = set()
-            for field in fields:
-                parts = field.split('.')
-                first_parts.add(parts[0])
-            return first_parts
-
-        def _next_parts(fields, field):
-            """Get the next parts for this field."""
-            next_parts = set()
-            first_part = field + '.'
-            for field in fields:
-                if field.startswith(first_part):
-                    next_parts.add(field[len(first_part):])
-            return next_parts
-
-        def _convert_to_str(value):
-            if six.PY2:
-                    if isinstance(value, basestring):
-                        return value.encode('utf-8')
-                    else:
-                        return pprint.pformat(value)
-            else:
-                    return str(value)
+    def _field_values_for_properties(cls, object_type, properties):
+        """Collects field values from an object's properties.
+
+        The properties may be a :py:class:`cybox.ObjectProperties` object
+        or the equivalent cybox:Properties XML element.
+
+        Returns:
+            list: a list of dicts (one per combination of values from
+                multi-valued fields) - see :py:func:`_iter_field_values`
+        """
+        return list(cls._iter_field_values(object_type, properties))
+
+    @classmethod
+    def _iter_field_values(cls, object_type, properties):
+        """Yields field values from an object's properties.
+
+        A dict, keyed by field name, is yielded for each combination of
+        values from multi-valued fields (e.g. File.hashes) that satisfies
+        the OBJECT_CONSTRAINTS for the object type. Combinations are
+        produced on demand, so the properties must not be modified (or
+        freed) until the generator is exhausted.
+        """
+        fields = cls.OBJECT_FIELDS[object_type]
+        constraints = cls.OBJECT_CONSTRAINTS.get(object_type, {})
+        rows = cls._field_rows(iter(()), properties,
+                               cls._field_plan(object_type))
+        for row in rows:
+            values = dict(row)
+
+            # Check constraints
+            # Multiple constraints are combined with an implied 'AND'
+            # (i.e. all of the constraints must be satisfied)
+            if any(field not in values or values[field] not in allowed
+                   for field, allowed in constraints.items()):
+                continue
+
+            # Remove constraint fields if not needed
+            for field in constraints:
+                if field not in fields:
+                    del values[field]
+            yield values
+
+    @staticmethod
+    def _convert_to_str(value):
+        if six.PY2:
+                if isinstance(value, basestring):
+                    return value.encode('utf-8')
+                else:
+                    return pprint.pformat(value)
+        else:
+                return str(value)
 
-        def _get_value_condition(value):
-            """Set the condition value to '-' if the field doesn't have a
-            condition attribute to allow us to differentiate it from a value
-            that does contain a condition attribute, but its value is None.
-            """
+    @staticmethod
+    def _value_condition(value):
+        """Returns the value and condition (as strings) of a field value.
+
+        Set the condition value to '-' if the field doesn't have a
+        condition attribute to allow us to differentiate it from a value
+        that does contain a condition attribute, but its value is None.
+        """
+        if isinstance(value, etree._Element):
+            value, condition = element_value_condition(value)
+        else:
             condition = getattr(value, 'condition', '-')
             value = getattr(value, 'value', value)
-            return (_convert_to_str(value), _convert_to_str(condition))
-
-        def _add_value_to_dict(dict_, value, field):
-            value, condition = _get_value_condition(value)
-            if value and (not cls.STRING_CONDITION_CONSTRAINT or
-                          condition in cls.STRING_CONDITION_CONSTRAINT or
-                          condition == '-'):
-                dict_[field] = value
-                if condition != '-':
-                    c_field = cls._condition_key_for_field(field)
-                    dict_[c_field] = condition
-
-        def _add_value_to_values(values, value, field):
-            """Add value and condition (if present) to results."""
-            if values:
-                for dict_ in values:
-                    _add_value_to_dict(dict_, value, field)
-            else:
-                # First entry
-                dict_ = dict()
-                _add_value_to_dict(dict_, value, field)
-                if dict_:
-                    values.append(dict_)
-
-        for field in _first_parts(fields):
-            full_first_part = first_part + '.' + field if first_part else field
-            next_parts = _next_parts(fields, field)
-            value = getattr(entity, field, None)
-
-            # Test if value is not a string and iterable
-            iterable = False
-            if not isinstance(value, six.string_types):
-                try:
-                    iter(value)
-                    iterable = True
-                except TypeError:
-                    pass
-
-            if iterable:
-                values_copy = copy.deepcopy(values)
-                first = True
-                for item in value:
-                    v_list = values if first else copy.deepcopy(values_copy)
-                    if next_parts:
-                        cls._field_values_for_entity(v_list, item, next_parts,
-                                                     full_first_part)
-                    else:
-                        _add_value_to_values(v_list, item, full_first_part)
-                    if not first:
-                        values.extend(v_list)
-                    else:
-                        first = False
-            elif value:
-                if next_parts:
-                    cls._field_values_for_entity(values, value, next_parts,
-                                                 full_first_part)
-                else:
-                    _add_value_to_values(values, value, full_first_part)
+        return (StixTransform._convert_to_str(value),
+                StixTransform._convert_to_str(condition))
+
+    @classmethod
+    def _field_value_pairs(cls, value, field):
+        """Returns the (key, value) pairs to add to a row for a field value.
+
+        A tuple containing the value and its condition (if present) is
+        returned, or an empty tuple if the value is empty or its condition
+        does not satisfy the STRING_CONDITION_CONSTRAINT.
+        """
+        value, condition = cls._value_condition(value)
+        if value and (not cls.STRING_CONDITION_CONSTRAINT or
+                      condition in cls.STRING_CONDITION_CONSTRAINT or
+                      condition == '-'):
+            if condition != '-':
+                c_field = cls._condition_key_for_field(field)
+                return ((field, value), (c_field, condition))
+            return ((field, value),)
+        return ()
+
+    @classmethod
+    def _field_rows(cls, rows, entity, accessors):
+        """Expands rows of field values with the values from an entity.
+
+        Rows are tuples of (field, value) pairs. Each row is extended with
+        the values of the requested fields from a cybox.Entity object (or
+        XML element). Multi-valued fields produce the cartesian product of
+        the existing rows and their values. Rows are immutable and shared
+        between combinations, and are generated on demand.
+
+        Args:
+            rows: an iterator over the existing rows
+            entity: the Cybox entity (or XML element)
+            accessors: a list of :py:class:`FieldAccessor` objects for the
+                fields to collect (see :py:func:`_field_plan`)
+
+        Returns:
+            an iterator over the expanded rows
+        """
+        for accessor in accessors:
+            value = accessor.get(entity)
+            if accessor.is_iterable(value):
+                items = list(value)
+                if items:
+                    rows = cls._field_rows_for_items(rows, items, accessor)
+            elif (value is not None if isinstance(value, etree._Element)
+                    else value):
+                rows = cls._field_rows_for_value(rows, value, accessor)
+        return rows
+
+    @classmethod
+    def _field_rows_for_items(cls, rows, items, accessor):
+        """Yields the rows for each item of a multi-valued field."""
+        if len(items) > 1:
+            # The rows are reused for each item
+            rows = tuple(rows)
+        for item in items:
+            for row in cls._field_rows_for_value(iter(rows), item, accessor):
+                yield row
+
+    @classmethod
+    def _field_rows_for_value(cls, rows, value, accessor):
+        """Expands rows with a single field value."""
+        if accessor.children:
+            return cls._field_rows(rows, value, accessor.children)
+        pairs = cls._field_value_pairs(value, accessor.path)
+        if not pairs:
+            return rows
+        return cls._append_pairs(rows, pairs)
+
+    @staticmethod
+    def _append_pairs(rows, pairs):
+        """Yields rows extended with pairs (or pairs if there are no rows)."""
+        empty = True
+        for row in rows:
+            empty = False
+            yield row + pairs
+        if empty:
+            # First entry
+            yield pairs
@@ -143,8 +143,7 @@ class StixBroIntelTransform(StixTextTransform):
 
     # ##### Overridden class methods
 
-    def text_for_object_type(self, object_type):
-        text = ''
+    def lines_for_object_type(self, object_type):
         if object_type in self.observables:
             for observable in self.observables[object_type]:
                 # Look up source and url from observable ID
@@ -169,5 +168,4 @@ class StixBroIntelTransform(StixTextTransform):
                                 '-',
                                 '-',
                             ]
-                            text += self.join(field_values) + '\n'
-        return text
+                            yield self.join(field_values) + '\n'
@@ -160,15 +160,16 @@ class StixCsvTransform(StixTextTransform):
                     field_values.append(condition)
         return self.join(field_values)
 
-    def text_for_object_type(self, object_type):
-        text = ''
+    def lines_for_object_type(self, object_type):
+        empty = True
         if object_type in self.observables:
             for observable in self.observables[object_type]:
                 id_ = observable['id']
                 for field in observable['fields']:
+                    line = self.text_for_fields(field, object_type) + '\n'
                     if self.include_observable_id:
-                        text += '{}{}'.format(id_, self.separator)
-                    text += self.text_for_fields(field, object_type) + '\n'
-        if text:
-            text += '\n'
-        return text
+                        line = '{}{}'.format(id_, self.separator) + line
+                    yield line
+                    empty = False
+        if not empty:
+            yield '\n'
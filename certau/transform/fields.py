@@ -0,0 +1,102 @@
+"""Compiled accessors for extracting (dotted) fields from Cybox objects.
+
+Transforms list the fields they extract for each object type using dotted
+paths (e.g. 'header.from_.address_value' for an EmailMessage). Rather than
+re-splitting these paths for every observable, they are compiled once per
+transform class into a tree of :py:class:`FieldAccessor` objects, which
+share the leading parts of each path.
+"""
+
+from __future__ import absolute_import
+
+import six
+
+from lxml import etree
+
+from certau.util.stix.stream import element_field
+
+
+class FieldAccessor(object):
+    """Retrieves one part of a dotted field path from an entity.
+
+    Args:
+        name: the name of the attribute (or element) to retrieve
+        path: the full dotted path of the field, up to and including name
+        children: a list of FieldAccessor objects for the remaining parts
+            of any fields starting with path, or None if path is a leaf
+    """
+
+    __slots__ = ('name', 'path', 'children', '_iterable_types')
+
+    def __init__(self, name, path, children=None):
+        self.name = name
+        self.path = path
+        self.children = children
+        self._iterable_types = dict()
+
+    def __repr__(self):
+        return 'FieldAccessor({!r}, {!r}, {!r})'.format(
+            self.name, self.path, self.children)
+
+    def get(self, entity):
+        """Returns the value of the field from a Cybox entity.
+
+        The entity may also be an XML element, in which case the value is
+        located using :py:func:`certau.util.stix.stream.element_field`.
+        """
+        if isinstance(entity, etree._Element):
+            return element_field(entity, self.name)
+        return getattr(entity, self.name, None)
+
+    def is_iterable(self, value):
+        """Returns True if value is iterable (but not a string or element).
+
+        The result is cached by the type of the value.
+        """
+        type_ = type(value)
+        iterable = self._iterable_types.get(type_)
+        if iterable is None:
+            iterable = False
+            if not issubclass(type_, (six.string_types, etree._Element)):
+                try:
+                    iter(value)
+                    iterable = True
+                except TypeError:
+                    pass
+            self._iterable_types[type_] = iterable
+        return iterable
+
+
+def compile_fields(fields, prefix=''):
+    """Compiles a list of dotted field names into an accessor tree.
+
+    Fields sharing a leading part share an accessor, which is returned in
+    the order the leading part first appears in fields.
+
+    Args:
+        fields: a list of dotted field names
+        prefix: the dotted path of the entity the fields belong to
+
+    Returns:
+        list: a list of :py:class:`FieldAccessor` objects
+    """
+    first_parts = []
+    next_parts = dict()
+    for field in fields:
+        first, _, rest = field.partition('.')
+        if first not in next_parts:
+            first_parts.append(first)
+            next_parts[first] = []
+        if rest and rest not in next_parts[first]:
+            next_parts[first].append(rest)
+
+    accessors = []
+    for first in first_parts:
+        path = prefix + '.' + first if prefix else first
+        children = next_parts[first]
+        accessors.append(FieldAccessor(
+            first,
+            path,
+            compile_fields(children, path) if children else None,
+        ))
+    return accessors
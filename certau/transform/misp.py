@@ -1,15 +1,16 @@
 import time
 import logging
+import uuid
 from datetime import datetime
 
 from cybox.common import Hash
 from cybox.objects.address_object import Address
 from cybox.objects.uri_object import URI
 
-# suppress PyMISP warnings about Python 2
-logging.getLogger('pymisp').setLevel(logging.ERROR)
-from pymisp import PyMISP
+import requests
 
+from certau.util.misp.client import PooledPyMISP
+from certau.util.misp.tags import MispTagCache
 from certau.util.stix.helpers import package_time
 from .base import StixTransform
 
@@ -19,20 +20,55 @@ class StixMispTransform(StixTransform):
 
     This class inserts data from a STIX package into MISP (the Malware
     Information Sharing Platform - see http://www.misp-project.org/).
-    A PyMISP (https://github.com/CIRCL/PyMISP) object is passed to
-    the constructor and used for communicating with the MISP host.
-    The helper function :py:func:`get_misp_object` can be used to
-    instantiate a PyMISP object.
+    A :py:class:`PooledPyMISP` (a PyMISP - https://github.com/CIRCL/PyMISP -
+    object) is passed to the constructor and used for communicating with
+    the MISP host. The helper function :py:func:`get_misp_object` can be
+    used to instantiate one.
 
     Args:
         package: the STIX package to process
-        misp: the PyMISP object used to communicate with the MISP host
+        misp: the :py:class:`PooledPyMISP` object used to communicate with
+            the MISP host
         distribution: the distribution setting for the MIST event (0-3)
         threat_level: the threat level setting for the MISP event (0-3)
         analysis: the analysis level setting for the MISP event (0-2)
         information: info field value (string) for the MISP event
         published: a boolean indicating whether the event has been
             published
+        batch_size: the maximum number of attributes sent in each request
+            (the event is created with the first batch, and the rest are
+            added in bulk) - 0 sends all the attributes with the event
+        tag_cache_ttl: the time (in seconds) for which MISP's tag list is
+            cached (by default, the cache's current setting)
+        index: an optional :py:class:`MispIndex` of the packages and
+            attributes already published
+        index_scope: 'package' to skip only attributes already published
+            from the same package, or 'server' to skip attributes already
+            published from any package (when index is given)
+        feed: an optional :py:class:`MispFeedWriter` - the event is written
+            to the feed instead of being published to a MISP host (and misp
+            isn't needed)
+
+    The TLP tag is found with the process-wide :py:class:`MispTagCache` for
+    the MISP server, so the tag list isn't downloaded for every package.
+
+    With an index, a package that has already been published (with the
+    same or a later timestamp) is skipped, and a package with a newer
+    timestamp has its new attributes added to the existing event rather
+    than creating another event.
+
+    With a feed, the event is written to the feed's directory (with the
+    same details, TLP tag and attributes as a published event), keyed by
+    the package ID so that an updated package replaces its event.
+
+    Attributes:
+        failed_attributes: a list of (attribute, error) tuples for the
+            attributes that could not be added to the event
+        requests: the number of requests made to publish the package
+        skipped: True if the package was skipped (because it had already
+            been published)
+        skipped_attributes: the number of attributes that weren't sent
+            because they had already been published
     """
 
     OBJECT_FIELDS = {
@@ -65,21 +101,31 @@ class StixMispTransform(StixTransform):
 
     STRING_CONDITION_CONSTRAINT = ['None', 'Equals']
 
-    MISP_FUNCTION_MAPPING = {
-        'Address': 'add_ipdst',
-        'DomainName': 'add_domain',
-        'EmailMessage': ['add_email_src', 'add_email_subject'],
-        'File': 'add_hashes',
-        'HTTPSession': 'add_useragent',
-        'Mutex': 'add_mutex',
-        'SocketAddress': 'add_ipdst',  # Consider update to PyMISP API for port
-        'URI': 'add_url',
-        'WinRegistryKey': 'add_regkey',
+    # The MISP attribute type and category for each field (the type of a
+    # File attribute is the hash type, and of a WinRegistryKey attribute
+    # depends on whether there is a value)
+    MISP_ATTRIBUTE_MAPPING = {
+        'Address': ('ip-dst', 'Network activity'),
+        'DomainName': ('domain', 'Network activity'),
+        'EmailMessage': [
+            ('email-src', 'Payload delivery'),
+            ('email-subject', 'Payload delivery'),
+        ],
+        'File': (None, 'Artifacts dropped'),
+        'HTTPSession': ('user-agent', 'Network activity'),
+        'Mutex': ('mutex', 'Artifacts dropped'),
+        'SocketAddress': ('ip-dst', 'Network activity'),  # no port attribute
+        'URI': ('url', 'Network activity'),
+        'WinRegistryKey': (None, 'Artifacts dropped'),
     }
 
+    MUTEX_PREFIX = '\\BaseNamedObjects\\'
+
+    INDEX_SCOPES = ('package', 'server')
+
     def __init__(self, package, default_title=None, default_description=None,
                  default_tlp='AMBER',
-                 misp=None,        # PyMISP object must be provided
+                 misp=None,        # PooledPyMISP object must be provided
                  distribution=0,   # this organisation only
                  threat_level=1,   # threat
                  analysis=2,       # analysis
@@ -87,11 +133,17 @@ class StixMispTransform(StixTransform):
                  published=False,
                  file_name="",
                  info_short_only=False,
-                 info_filename_title=False):
+                 info_filename_title=False,
+                 batch_size=500,
+                 tag_cache_ttl=None,
+                 index=None,
+                 index_scope='package',
+                 feed=None):
 
         super(StixMispTransform, self).__init__(
             package, default_title, default_description, default_tlp,
         )
+        self.feed = feed
         self.misp = misp
         self.distribution = distribution
         self.threat_level = threat_level
@@ -101,6 +153,18 @@ class StixMispTransform(StixTransform):
         self.file_name = file_name
         self.info_short_only = info_short_only
         self.info_filename_title = info_filename_title
+        self.batch_size = batch_size
+        if misp is None:
+            self.tag_cache = None
+        else:
+            self.tag_cache = MispTagCache.shared(misp, tag_cache_ttl)
+        self.index = index
+        self.index_scope = index_scope
+        self.event = None
+        self.failed_attributes = []
+        self.requests = 0
+        self.skipped = False
+        self.skipped_attributes = 0
 
     # ##### Properties
 
@@ -110,8 +174,9 @@ class StixMispTransform(StixTransform):
 
     @misp.setter
     def misp(self, misp):
-        if not isinstance(misp, PyMISP):
-            raise TypeError('expected PyMISP object')
+        if not (isinstance(misp, PooledPyMISP) or
+                (misp is None and self.feed is not None)):
+            raise TypeError('expected PooledPyMISP object')
         self._misp = misp
 
     @property
@@ -178,6 +243,24 @@ class StixMispTransform(StixTransform):
     def file_name(self, file_name):
         self._file_name = '' if file_name is None else str(file_name)
 
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, batch_size):
+        self._batch_size = max(0, int(batch_size))
+
+    @property
+    def index_scope(self):
+        return self._index_scope
+
+    @index_scope.setter
+    def index_scope(self, index_scope):
+        if index_scope not in self.INDEX_SCOPES:
+            raise ValueError('invalid index scope: {}'.format(index_scope))
+        self._index_scope = index_scope
+
     @property
     def event(self):
         return self._event
@@ -189,9 +272,14 @@ class StixMispTransform(StixTransform):
     # ##### Class helper methods
 
     @staticmethod
-    def get_misp_object(misp_url, misp_key, misp_ssl=False, misp_cert=None):
+    def get_misp_object(misp_url, misp_key, misp_ssl=False, misp_cert=None,
+                        **kwargs):
         """Returns a PyMISP object for communicating with a MISP host.
 
+        The object is a :py:class:`PooledPyMISP`, which reuses its
+        connections and may be shared by threads publishing packages
+        concurrently (see :py:class:`MispPublisher`).
+
         Args:
             misp_url: URL for MISP API end-point
             misp_key: API key for accessing MISP API
@@ -199,10 +287,15 @@ class StixMispTransform(StixTransform):
                 certificate will be verified
             misp_cert: a tuple containing a certificate and key for SSL
                 client authentication
+            kwargs: passed to :py:class:`PooledPyMISP` (max_in_flight,
+                rate, burst, retries, backoff and timeout)
         """
-        return PyMISP(misp_url, misp_key, ssl=misp_ssl, cert=misp_cert)
+        return PooledPyMISP(misp_url, misp_key, ssl=misp_ssl, cert=misp_cert,
+                            **kwargs)
 
-    def init_misp_event(self):
+    def event_details(self):
+        """Returns the MISP event's fields (info, date, distribution, threat
+        level, analysis and published state) as a dictionary."""
         if not self.information:
             # Try the package header for some 'info'
             # Note: This option will overwrite the other info options
@@ -236,80 +329,309 @@ class StixMispTransform(StixTransform):
 
         timestamp = package_time(self.package) or datetime.now()
 
-        self.event = self.misp.new_event(
-            distribution=self.distribution,
-            threat_level_id=self.threat_level,
-            analysis=self.analysis,
-            info=self.information,
-            date=timestamp.strftime('%Y-%m-%d'),
-        )
+        return {
+            'distribution': self.distribution,
+            'threat_level_id': self.threat_level,
+            'analysis': self.analysis,
+            'info': self.information,
+            'date': timestamp.strftime('%Y-%m-%d'),
+            'published': False,
+        }
+
+    def init_misp_event(self, attributes=None):
+        """Creates the MISP event (with the given attributes) and tags it
+        with the package's TLP. Returns False if the event couldn't be
+        created."""
+        event = {'Event': self.event_details()}
+        event['Event']['Attribute'] = list(attributes or [])
+        self.requests += 1
+        self.event = self.misp.add_event(event)
+        if 'Event' not in self.event:
+            self._logger.error('unable to create MISP event: %s',
+                               self._errors(self.event))
+            self._record_failures(attributes or [], self.event)
+            return False
+        self._record_failures(attributes or [], self.event)
 
         # Add TLP tag to the event
         package_tlp = self.package_tlp().lower()
-        tlp_tag_id = None
-        misp_tags = self.misp.get_all_tags()
-        if 'Tag' in misp_tags:
-            for tag in misp_tags['Tag']:
-                if tag['name'] == 'tlp:{}'.format(package_tlp):
-                    tlp_tag_id = tag['id']
-                    break
+        tlp_tag_id, downloaded = self.tag_cache.lookup(
+            self.misp,
+            'tlp:{}'.format(package_tlp),
+        )
+        if downloaded:
+            self.requests += 1
         if tlp_tag_id is not None:
+            self.requests += 1
             self.misp.tag(self.event['Event']['uuid'], tlp_tag_id)
+        return True
 
-    # ##### Overridden class methods
+    def add_attributes(self, attributes):
+        """Adds attributes to the event in a single request, returning the
+        (checked) response.
+
+        Attributes that can't be added are recorded in failed_attributes.
+        """
+        self.requests += 1
+        try:
+            response = self.misp.add_attributes(self.event['Event']['id'],
+                                                attributes)
+        except requests.exceptions.RequestException as e:
+            response = {'errors': [str(e)]}
+        self._record_failures(attributes, response)
+        return response
+
+    def publish_event(self):
+        """Publishes the event (given only its ID, so the event needn't be
+        downloaded)."""
+        self.requests += 1
+        return self.misp.publish(self.event['Event']['id'])
 
-    def publish_fields(self, fields, object_type):
-        if isinstance(self.MISP_FUNCTION_MAPPING[object_type], list):
-            for field, function in zip(
-                    self.OBJECT_FIELDS[object_type],
-                    self.MISP_FUNCTION_MAPPING[object_type]):
-                if field in fields:
-                    add_method = getattr(self.misp, function)
-                    add_method(self.event, fields[field])
+    @staticmethod
+    def _errors(response):
+        errors = response.get('errors') or response.get('message')
+        if isinstance(errors, list):
+            errors = '; '.join(str(error) for error in errors)
+        return errors or 'not saved'
+
+    def _record_failures(self, attributes, response):
+        # Records the attributes that aren't in a response
+        saved = response.get('Attribute')
+        if saved is None:
+            saved = response.get('Event', {}).get('Attribute', [])
+        if isinstance(saved, dict):
+            saved = [saved]
+        saved_uuids = set(attribute.get('uuid') for attribute in saved)
+        error = None
+        for attribute in attributes:
+            if attribute['uuid'] not in saved_uuids:
+                error = error or self._errors(response)
+                self.failed_attributes.append((attribute, error))
+
+    # ##### MISP attributes
+
+    @staticmethod
+    def _attribute(type_, category, value):
+        return {
+            'uuid': str(uuid.uuid4()),
+            'type': type_,
+            'category': category,
+            'value': value,
+            'to_ids': True,
+        }
+
+    def attributes_for_fields(self, fields, object_type):
+        """Returns the MISP attributes (as dictionaries) for a set of
+        observable fields."""
+        mapping = self.MISP_ATTRIBUTE_MAPPING[object_type]
+        if isinstance(mapping, list):
+            return [
+                self._attribute(type_, category, fields[field])
+                for field, (type_, category) in zip(
+                    self.OBJECT_FIELDS[object_type], mapping)
+                if field in fields
+            ]
+
+        type_, category = mapping
+        if object_type == 'File':
+            # The attribute type is the hash type
+            hash_type = fields['hashes.type_'].lower()
+            return [self._attribute(hash_type, category,
+                                    fields['hashes.simple_hash_value'])]
+        elif object_type == 'WinRegistryKey':
+            # Combine hive and key into regkey
+            regkey = ''
+            regkey += fields.get('hive', '')
+            regkey += fields.get('key', '')
+            # Merge the name and values
+            regvalue = ''
+            regvalue += fields.get('values.name', '')
+            data = fields.get('values.data', '')
+            if data:
+                regvalue += '\\' if regvalue else ''
+                regvalue += data
+            if regvalue:
+                return [self._attribute('regkey|value', category,
+                                        '{}|{}'.format(regkey, regvalue))]
+            elif regkey:
+                return [self._attribute('regkey', category, regkey)]
+            self._logger.debug('skipping WinRegistryKey with no data')
+            return []
         else:
-            add_method = getattr(self.misp,
-                                 self.MISP_FUNCTION_MAPPING[object_type])
-            if object_type == 'File':
-                # Convert the hash type and value to kwargs
-                hash_type = fields['hashes.type_'].lower()
-                kwargs = {hash_type: fields['hashes.simple_hash_value']}
-                add_method(self.event, **kwargs)
-            elif object_type == 'WinRegistryKey':
-                # Combine hive and key into regkey
-                regkey = ''
-                regkey += fields.get('hive', '')
-                regkey += fields.get('key', '')
-                # Merge the name and values
-                regvalue = ''
-                regvalue += fields.get('values.name', '')
-                data = fields.get('values.data', '')
-                if data:
-                    regvalue += '\\' if regvalue else ''
-                    regvalue += data
-                if regkey or regvalue:
-                    add_method(self.event, regkey, regvalue)
-                else:
-                    self._logger.debug('skipping WinRegistryKey with no data')
-            else:
-                # A single value
-                field = self.OBJECT_FIELDS[object_type][0]
-                if field in fields:
-                    add_method(self.event, fields[field])
+            # A single value
+            field = self.OBJECT_FIELDS[object_type][0]
+            if field not in fields:
+                return []
+            value = fields[field]
+            if (object_type == 'Mutex' and
+                    not value.startswith(self.MUTEX_PREFIX)):
+                value = self.MUTEX_PREFIX + value
+            return [self._attribute(type_, category, value)]
+
+    def attributes_for_observable(self, observable, object_type):
+        attributes = []
+        for fields in observable.get('fields', []):
+            attributes.extend(self.attributes_for_fields(fields, object_type))
+        return attributes
+
+    def iter_attributes(self):
+        """Yields the MISP attributes for the package's observables."""
+        for object_type in sorted(self.OBJECT_FIELDS.keys()):
+            for observable in self.observables.get(object_type, []):
+                for attribute in self.attributes_for_observable(
+                        observable, object_type):
+                    yield attribute
+
+    def attributes(self):
+        """Returns the MISP attributes for the package's observables."""
+        return list(self.iter_attributes())
+
+    def write_feed_event(self):
+        """Writes the event (with the package's attributes) to the feed."""
+        event = self.feed.write_event(
+            self.event_details(),
+            self.iter_attributes(),
+            tags=['tlp:{}'.format(self.package_tlp().lower())],
+            key=getattr(self.package, 'id_', None),
+            timestamp=getattr(self.package, 'timestamp', None),
+        )
+        self.event = {'Event': event}
+
+    # ##### Publishing
+
+    def _create_event(self, attributes):
+        # Creates the event with the first batch, then adds the rest
+        batch_size = self.batch_size or len(attributes)
+        if not self.init_misp_event(attributes[:batch_size]):
+            return False
+        for start in range(batch_size, len(attributes), batch_size):
+            self.add_attributes(attributes[start:start + batch_size])
+        if self.published:
+            self.publish_event()
+        return True
+
+    def _update_event(self, indexed, attributes):
+        # Adds attributes to an existing event. Returns False if the event
+        # no longer exists.
+        self.event = {'Event': {'id': indexed.event_id,
+                                'uuid': indexed.event_uuid}}
+        batch_size = self.batch_size or len(attributes)
+        for start in range(0, len(attributes), batch_size):
+            failed = len(self.failed_attributes)
+            response = self.add_attributes(
+                attributes[start:start + batch_size],
+            )
+            if start == 0 and 'errors' in response:
+                # (Attributes may also be rejected individually, so check
+                # the event is really gone)
+                self.requests += 1
+                if not self.misp.event_exists(indexed.event_id):
+                    del self.failed_attributes[failed:]
+                    return False
+        if attributes and self.published:
+            # (The event needs publishing again for the new attributes)
+            self.publish_event()
+        return True
 
-    def publish_observable(self, observable, object_type):
-        if 'fields' in observable:
-            for fields in observable['fields']:
-                self.publish_fields(fields, object_type)
+    @staticmethod
+    def _package_changed(indexed, timestamp):
+        if indexed.timestamp is None or timestamp is None:
+            return True
+        try:
+            return timestamp > indexed.timestamp
+        except TypeError:
+            # (Comparing naive and aware timestamps)
+            return True
+
+    def _unpublished_attributes(self, attributes, package_id):
+        # Removes the attributes the index says are already published
+        if self.index_scope == 'package':
+            if package_id is None:
+                return attributes
+            known = self.index.known_attributes(self.misp.root_url,
+                                                attributes, package_id)
+        else:
+            known = self.index.known_attributes(self.misp.root_url,
+                                                attributes)
+        unpublished = [attribute for attribute in attributes
+                       if (attribute['type'], attribute['value']) not in known]
+        self.skipped_attributes = len(attributes) - len(unpublished)
+        return unpublished
+
+    def _save_to_index(self, package_id, timestamp, attributes):
+        failed = set(attribute['uuid']
+                     for attribute, _ in self.failed_attributes)
+        saved = [attribute for attribute in attributes
+                 if attribute['uuid'] not in failed]
+        server = self.misp.root_url
+        event = self.event['Event']
+        self.index.save_attributes(server, package_id or '', event['id'],
+                                   saved)
+        if package_id is not None:
+            self.index.save_package(server, package_id, event['id'],
+                                    event.get('uuid'), timestamp)
+
+    # ##### Overridden class methods
 
     def publish(self):
-        if self.observables:
-            self._logger.info("Publishing results to MISP")
-            self.init_misp_event()
-            for object_type in sorted(self.OBJECT_FIELDS.keys()):
-                if object_type in self.observables:
-                    for observable in self.observables[object_type]:
-                        self.publish_observable(observable, object_type)
-            if self.published:
-                self.misp.publish(self.event)
-        else:
+        if not self.observables:
             self._logger.info("Package has no observables - skipping")
+            return
+
+        if self.feed is not None:
+            self._logger.info("Writing results to MISP feed")
+            self.write_feed_event()
+            return
+
+        self._logger.info("Publishing results to MISP")
+        package_id = getattr(self.package, 'id_', None)
+        timestamp = getattr(self.package, 'timestamp', None)
+        indexed = None
+        if self.index is not None and package_id is not None:
+            indexed = self.index.package(self.misp.root_url, package_id)
+            if (indexed is not None and
+                    not self._package_changed(indexed, timestamp)):
+                self._logger.info('package %s was already published to MISP '
+                                  'event %s - skipping', package_id,
+                                  indexed.event_id)
+                self.skipped = True
+                return
+
+        all_attributes = attributes = self.attributes()
+        if self.index is not None:
+            attributes = self._unpublished_attributes(all_attributes,
+                                                      package_id)
+            if self.skipped_attributes:
+                self._logger.info('%d of %d attributes were already '
+                                  'published to MISP', self.skipped_attributes,
+                                  len(all_attributes))
+
+        if indexed is not None and not self._update_event(indexed, attributes):
+            self._logger.warning('MISP event %s (for package %s) no longer '
+                                 'exists - creating a new event',
+                                 indexed.event_id, package_id)
+            self.index.forget_package(self.misp.root_url, package_id)
+            attributes = self._unpublished_attributes(all_attributes,
+                                                      package_id)
+            indexed = None
+        if indexed is None:
+            if not attributes:
+                self._logger.info('all the attributes were already published '
+                                  'to MISP - skipping')
+                self.skipped = True
+                return
+            if not self._create_event(attributes):
+                return
+
+        if self.failed_attributes:
+            self._logger.warning(
+                '%d of %d attributes could not be added to MISP event '
+                '%s', len(self.failed_attributes), len(attributes),
+                self.event['Event']['id'],
+            )
+            for attribute, error in self.failed_attributes:
+                self._logger.debug('failed to add %s attribute %r: %s',
+                                   attribute['type'], attribute['value'],
+                                   error)
+        if self.index is not None:
+            self._save_to_index(package_id, timestamp, attributes)
@@ -0,0 +1,144 @@
+"""Pipelined fetching, parsing and transformation of STIX packages."""
+
+import logging
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+from lxml import etree
+
+from .pool import _DONE, _StageError, _put, _result_for_package
+from .text import StixTextTransform
+
+
+class TransformPipeline(object):
+    """Fetch, parse and transform STIX packages in separate threads.
+
+    Each source item passes through three stages, each running in its own
+    thread, with a bounded queue between each stage and the next:
+
+        #. fetch - obtain the next source item (e.g. from a TAXII poll)
+        #. parse - parse the source item's package
+        #. transform - transform the package (as for
+           :py:class:`TransformPool`)
+
+    while the caller consumes the results (the sink). Network I/O can then
+    overlap with parsing and output, and at most queue_size items are held
+    between any two stages, however many items the source produces.
+    Results are returned in input order and, as with
+    :py:class:`TransformPool`, anything with side effects is left to the
+    caller.
+
+    Args:
+        transform_class: the transform class, or None to serialise each
+            package to XML instead
+        transform_kwargs: keyword arguments for text transforms (ignored
+            for other transforms)
+        xml_function: an optional function applied to each package before
+            it is serialised to XML
+        queue_size: the maximum number of items waiting between stages
+    """
+
+    def __init__(self, transform_class=None, transform_kwargs=None,
+                 xml_function=None, queue_size=4):
+        self.transform_class = transform_class
+        if (transform_class is not None and
+                issubclass(transform_class, StixTextTransform)):
+            self.transform_kwargs = transform_kwargs or dict()
+        else:
+            self.transform_kwargs = dict()
+        self.xml_function = xml_function
+        self.queue_size = queue_size
+        self._logger = logging.getLogger()
+
+    def _parse(self, source_item):
+        return source_item, source_item.stix_package
+
+    def _transform(self, item):
+        source_item, package = item
+        if package is None:
+            return source_item, None
+        try:
+            return source_item, _result_for_package(
+                package,
+                self.transform_class,
+                self.transform_kwargs,
+                self.xml_function,
+            )
+        except etree.XMLSyntaxError:
+            # Streamed packages are parsed during the transform
+            self._logger.error('error parsing STIX package (%s)',
+                               source_item.file_name())
+            return source_item, None
+
+    def results(self, source_items):
+        """Yields (source_item, result) tuples in input order.
+
+        The results are the same as for :py:func:`TransformPool.results`.
+        An exception raised in any stage (e.g. by the source) is re-raised
+        here, after the results for the earlier items.
+        """
+        stop = threading.Event()
+        fetched = queue.Queue(self.queue_size)
+        parsed = queue.Queue(self.queue_size)
+        transformed = queue.Queue(self.queue_size)
+        threads = [
+            threading.Thread(target=self._run_stage,
+                             args=(stop, iter(source_items), None, fetched)),
+            threading.Thread(target=self._run_stage,
+                             args=(stop, self._iter_queue(stop, fetched),
+                                   self._parse, parsed)),
+            threading.Thread(target=self._run_stage,
+                             args=(stop, self._iter_queue(stop, parsed),
+                                   self._transform, transformed)),
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while True:
+                try:
+                    # (with a timeout, so Python 2 can be interrupted)
+                    item = transformed.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                elif isinstance(item, _StageError):
+                    six.reraise(*item.exc_info)
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _iter_queue(stop, queue_):
+        # Yields items from a queue until the end marker (passing on errors)
+        while not stop.is_set():
+            try:
+                item = queue_.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _run_stage(self, stop, items, function, output):
+        try:
+            for item in items:
+                if not isinstance(item, _StageError) and function is not None:
+                    item = function(item)
+                if not _put(stop, output, item):
+                    return
+        except Exception:
+            _put(stop, output, _StageError(sys.exc_info()))
+        finally:
+            # Close the source (e.g. a TAXII poll) if stopped early
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+        _put(stop, output, _DONE)
@@ -0,0 +1,207 @@
+"""Parallel parsing and transformation of STIX packages."""
+
+import collections
+import logging
+import multiprocessing
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+from lxml import etree
+
+from certau.util.stix.summary import PackageSummary
+from .text import StixTextTransform
+
+
+# Per-process job details, set by _init_worker()
+_job = None
+
+# Marks the end of the items passed between threads
+_DONE = object()
+
+
+class _StageError(object):
+    """Passes an exception raised in a stage on to the following stages."""
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+def _put(stop, queue_, item):
+    # Returns False if stopped before item was queued
+    while not stop.is_set():
+        try:
+            queue_.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _feed(stop, items, output):
+    # Queues items (in its own thread), then the end marker
+    try:
+        for item in items:
+            if not _put(stop, output, item):
+                return
+    except Exception:
+        _put(stop, output, _StageError(sys.exc_info()))
+        return
+    finally:
+        # Close the source (e.g. a TAXII poll) if stopped early
+        close = getattr(items, 'close', None)
+        if close is not None:
+            close()
+    _put(stop, output, _DONE)
+
+
+def _get(result):
+    # (with a timeout, so Python 2 can be interrupted)
+    while not result.ready():
+        result.wait(1)
+    return result.get()
+
+
+def _in_order(items, submit, max_pending):
+    """Submits items as they arrive, yielding (item, submit(item)) tuples in
+    input order once each is finished.
+
+    The items are read in a separate thread, so finished results are
+    yielded while waiting for the next item (e.g. from a
+    :py:class:`StixWatchSource`, which never ends). submit returns an
+    AsyncResult (or None if there is nothing to wait for), and at most
+    max_pending items are submitted but not yet yielded. An exception
+    raised by items is re-raised after the earlier items are yielded.
+    """
+    stop = threading.Event()
+    fetched = queue.Queue(max_pending)
+    # (A daemon thread, as a watch source may never produce another item)
+    thread = threading.Thread(target=_feed, args=(stop, iter(items), fetched))
+    thread.daemon = True
+    thread.start()
+    try:
+        pending = collections.deque()
+        done = False
+        error = None
+        while pending or not done:
+            if pending and (done or len(pending) >= max_pending or
+                            pending[0][1] is None or pending[0][1].ready()):
+                yield pending.popleft()
+                continue
+            try:
+                item = fetched.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _DONE:
+                done = True
+            elif isinstance(item, _StageError):
+                done = True
+                error = item
+            else:
+                pending.append((item, submit(item)))
+        if error is not None:
+            six.reraise(*error.exc_info)
+    finally:
+        stop.set()
+
+
+def _init_worker(transform_class, transform_kwargs, xml_function):
+    global _job
+    _job = (transform_class, transform_kwargs, xml_function)
+
+
+def _process_source_item(source_item):
+    """Parse and transform a single source item (in a worker process)."""
+    try:
+        package = source_item.stix_package
+        if package is None:
+            return None
+        return _result_for_package(package, *_job)
+    except etree.XMLSyntaxError:
+        # Streamed packages are parsed during the transform
+        logging.getLogger().error('error parsing STIX package (%s)',
+                                  source_item.file_name())
+        return None
+
+
+def _result_for_package(package, transform_class, transform_kwargs,
+                        xml_function):
+    """Transform a parsed package (see :py:func:`TransformPool.results`)."""
+    if transform_class is None:
+        if xml_function is not None:
+            xml_function(package)
+        return package.to_xml()
+    elif issubclass(transform_class, StixTextTransform):
+        return transform_class(package, **transform_kwargs).text()
+    else:
+        return PackageSummary.from_package(package, [transform_class])
+
+
+class TransformPool(object):
+    """Parse and transform STIX packages using a pool of worker processes.
+
+    Source items are handed to the workers as they are produced and the
+    results are returned in the same order, so output is deterministic.
+    Only CPU-bound work (parsing, observable extraction, rendering text and
+    serialising XML) happens in the workers. Anything with side effects -
+    writing output, publishing to MISP or saving files - is left to the
+    caller, which acts as the single writer.
+
+    Args:
+        workers: the number of worker processes
+        transform_class: the transform class, or None to serialise each
+            package to XML instead
+        transform_kwargs: keyword arguments for text transforms (ignored
+            for other transforms)
+        xml_function: an optional (picklable) function applied to each
+            package before it is serialised to XML
+        max_pending: the maximum number of source items being processed at
+            once (default: four per worker)
+    """
+
+    def __init__(self, workers, transform_class=None, transform_kwargs=None,
+                 xml_function=None, max_pending=None):
+        self.workers = workers
+        self.transform_class = transform_class
+        if (transform_class is not None and
+                issubclass(transform_class, StixTextTransform)):
+            self.transform_kwargs = transform_kwargs or dict()
+        else:
+            self.transform_kwargs = dict()
+        self.xml_function = xml_function
+        self.max_pending = max_pending or 4 * workers
+
+    def results(self, source_items):
+        """Yields (source_item, result) tuples in input order.
+
+        The result for each source item is None if the package could not be
+        parsed, otherwise:
+
+            - the serialised XML if transform_class is None
+            - the text output for a text transform
+            - a :py:class:`PackageSummary` (which may be transformed with
+              transform_class) for any other transform
+
+        Results are yielded as soon as they (and the results before them)
+        are ready, even while waiting for the next source item.
+        """
+        pool = multiprocessing.Pool(
+            processes=self.workers,
+            initializer=_init_worker,
+            initargs=(self.transform_class, self.transform_kwargs,
+                      self.xml_function),
+        )
+
+        def submit(source_item):
+            return pool.apply_async(_process_source_item, (source_item,))
+
+        try:
+            for source_item, result in _in_order(source_items, submit,
+                                                 self.max_pending):
+                yield source_item, _get(result)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,91 @@
+"""Concurrent publishing of STIX packages to MISP."""
+
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+from lxml import etree
+
+from .misp import StixMispTransform
+from .pool import _get, _in_order
+
+
+class MispPublisher(object):
+    """Publish STIX packages to MISP using a pool of threads.
+
+    Publishing a package is mostly spent waiting for the MISP server, so
+    several packages are published at once, each in its own thread and
+    with its own event. The threads share transform_kwargs['misp'], which
+    should be a :py:class:`PooledPyMISP` (see
+    :py:func:`StixMispTransform.get_misp_object`), so that they share its
+    connections, in-flight request limit and rate limit.
+
+    Results are returned in input order, so (as with
+    :py:class:`TransformPool`) the caller can record each package as
+    processed once it has been published.
+
+    Args:
+        workers: the number of packages published at once
+        transform_kwargs: keyword arguments for
+            :py:class:`StixMispTransform` (the file_name is set from each
+            source item)
+        max_pending: the maximum number of packages being published or
+            waiting to be published (default: two per worker)
+    """
+
+    def __init__(self, workers, transform_kwargs, max_pending=None):
+        self.workers = workers
+        self.transform_kwargs = transform_kwargs
+        self.max_pending = max_pending or 2 * workers
+        self._logger = logging.getLogger()
+
+    def _publish(self, source_item, package):
+        kwargs = dict(self.transform_kwargs)
+        try:
+            kwargs['file_name'] = source_item.file_name()
+        except Exception:
+            kwargs['file_name'] = ''
+        try:
+            transform = StixMispTransform(package, **kwargs)
+            transform.publish()
+        except etree.XMLSyntaxError:
+            # Streamed packages are parsed during the transform
+            self._logger.error('error parsing STIX package (%s)',
+                               kwargs['file_name'])
+            return None
+        except Exception:
+            # Don't stop publishing the other packages
+            self._logger.exception('unable to publish STIX package (%s) to '
+                                   'MISP', kwargs['file_name'])
+            return None
+        return transform
+
+    def results(self, items):
+        """Publishes packages, yielding (source_item, transform) tuples in
+        input order.
+
+        Args:
+            items: (source_item, package) tuples, where package may be a
+                :py:class:`PackageSummary` (from :py:class:`TransformPool`)
+                or None (if the package couldn't be parsed)
+
+        The transform is None if the package could not be published.
+        Results are yielded as soon as they (and the results before them)
+        are ready, even while waiting for the next item.
+        """
+        pool = ThreadPool(processes=self.workers)
+
+        def submit(item):
+            source_item, package = item
+            if package is None:
+                return None
+            return pool.apply_async(self._publish, (source_item, package))
+
+        try:
+            for (source_item, _), result in _in_order(items, submit,
+                                                      self.max_pending):
+                yield source_item, None if result is None else _get(result)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,63 @@
+"""An indexed collection of the observables extracted from a STIX package."""
+
+
+class ObservableRegistry(dict):
+    """Observables extracted from a STIX package, grouped by object type.
+
+    This is the dictionary assigned to :py:attr:`StixTransform.observables`.
+    It is keyed by object type, with each entry containing a list of
+    observable dicts (with keys 'id', 'observable' and 'fields'), and adds
+    hash indexes by observable ID and by the location the observable was
+    found in. All lookups are constant time, so registering n observables
+    takes O(n) time.
+
+    Locations are one of the strings in :py:attr:`LOCATIONS`:
+
+        - 'root' - the root of the STIX package
+        - 'indicator' - within an Indicator in the package root
+        - 'composition' - within an ObservableComposition
+    """
+
+    LOCATIONS = ('root', 'indicator', 'composition')
+
+    def __init__(self):
+        super(ObservableRegistry, self).__init__()
+        self._by_id = dict()
+        self._by_location = dict((location, []) for location in self.LOCATIONS)
+
+    def add(self, id_, object_type, observable, fields, location='root'):
+        """Register an observable.
+
+        Returns:
+            dict: the new observable entry, or None if an observable with
+                the same ID has already been registered
+        """
+        if id_ in self._by_id:
+            return None
+        entry = dict(
+            id=id_,
+            observable=observable,
+            fields=fields,
+        )
+        if object_type not in self:
+            self[object_type] = []
+        self[object_type].append(entry)
+        self._by_id[id_] = entry
+        self._by_location[location].append(entry)
+        return entry
+
+    def has_id(self, id_):
+        """Returns True if an observable with the given ID is registered."""
+        return id_ in self._by_id
+
+    def get_by_id(self, id_):
+        """Returns the observable entry with the given ID (or None)."""
+        return self._by_id.get(id_)
+
+    def by_object_type(self, object_type):
+        """Returns the observable entries with the given object type."""
+        return self.get(object_type, [])
+
+    def by_location(self, location):
+        """Returns the observable entries found in the given location."""
+        return self._by_location[location]
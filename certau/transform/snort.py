@@ -90,8 +90,7 @@ class StixSnortTransform(StixTextTransform):
 
     # ##### Overridden class methods
 
-    def text_for_observable(self, observable, object_type):
-        text = ''
+    def lines_for_observable(self, observable, object_type):
         id_ = observable['id']
         if self.OBJECT_FIELDS and object_type in self.OBJECT_FIELDS:
             if object_type == 'Address' or object_type == 'SocketAddress':
@@ -100,7 +99,7 @@ class StixSnortTransform(StixTextTransform):
                         address = field['address_value']
                     else:
                         address = field['ip_address.address_value']
-                    text += self.snort_rule_text(
+                    yield self.snort_rule_text(
                         match='ip any any -> {} any'.format(address),
                         conditions=[
                             'flow:established,to_server',
@@ -111,7 +110,7 @@ class StixSnortTransform(StixTextTransform):
             elif object_type == 'DomainName':
                 for field in observable['fields']:
                     domain = field['value']
-                    text += self.snort_rule_text(
+                    yield self.snort_rule_text(
                         match='tcp any any -> $EXTERNAL_NET $HTTP_PORTS',
                         conditions=[
                             'flow:established,to_server',
@@ -125,7 +124,7 @@ class StixSnortTransform(StixTextTransform):
             elif object_type == 'URI':
                 for field in observable['fields']:
                     url = urlparse(field['value'])
-                    text += self.snort_rule_text(
+                    yield self.snort_rule_text(
                         match='tcp any any -> $EXTERNAL_NET $HTTP_PORTS',
                         conditions=[
                             'flow:established,to_server',
@@ -139,4 +138,3 @@ class StixSnortTransform(StixTextTransform):
                         ],
                     )
             self.sid += 1
-        return text
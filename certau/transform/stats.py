@@ -56,16 +56,15 @@ class StixStatsTransform(StixTextTransform):
         header += '\n' + self.header_prefix + self.LINE + '\n'
         return header
 
-    def text_for_object_type(self, object_type):
+    def lines_for_object_type(self, object_type):
         if object_type in self.observables:
             count = len(self.observables[object_type])
         else:
             count = 0
         if self.pretty_text:
-            text = '{0:<35} {1:>4}\n'.format(
+            yield '{0:<35} {1:>4}\n'.format(
                 object_type + ' observables:',
                 count,
             )
         else:
-            text = self.join([object_type, count]) + '\n'
-        return text
+            yield self.join([object_type, count]) + '\n'
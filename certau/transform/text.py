@@ -1,18 +1,17 @@
 from __future__ import absolute_import
 
-import contextlib
 import csv
 
-from six import StringIO
-
 from .base import StixTransform
 
 
 class StixTextTransform(StixTransform):
     """A transform for converting a STIX package to simple text.
 
-    This class and its subclasses implement the :py:func:`text` class method
-    which returns a string representation of the STIX package.
+    This class and its subclasses implement the :py:func:`iter_lines` class
+    method which yields the lines of a text representation of the STIX
+    package. The output may be written to a stream with :py:func:`write`,
+    or returned as a string by :py:func:`text`.
     The entire text output may optionally be preceded by a header string.
     Typically, each line of the output will contain details for a particular
     Cybox observable.
@@ -58,6 +57,7 @@ class StixTextTransform(StixTransform):
     @separator.setter
     def separator(self, separator):
         self._separator = '' if separator is None else str(separator)
+        self._csv_writer = None
 
     @property
     def include_header(self):
@@ -81,10 +81,31 @@ class StixTextTransform(StixTransform):
     # ##### Class helper methods
 
     def join(self, items):
-        """str.join, but with quoting when the items contain delimiters."""
-        with contextlib.closing(StringIO()) as sio:
-            csv.writer(sio, delimiter=self.separator).writerow(items)
-            return sio.getvalue().strip()
+        """str.join, but with quoting when the items contain delimiters.
+
+        Items are only passed through the csv module when quoting may be
+        required. The csv writer is created on first use and reused for
+        later rows.
+        """
+        try:
+            line = self.separator.join(items)
+        except TypeError:
+            # Not all of the items are strings
+            line = None
+        if (line is not None and len(self.separator) == 1 and
+                line.count(self.separator) == len(items) - 1 and
+                '"' not in line and '\n' not in line and '\r' not in line and
+                (line or len(items) != 1)):
+            return line.strip()
+
+        if self._csv_writer is None:
+            self._csv_buffer = _RowBuffer()
+            self._csv_writer = csv.writer(
+                self._csv_buffer,
+                delimiter=self.separator,
+            )
+        self._csv_writer.writerow(items)
+        return self._csv_buffer.pop().strip()
 
     # ##### Overridden class methods
 
@@ -117,33 +138,73 @@ class StixTextTransform(StixTransform):
                 field_values.append(field_value)
         return self.join(field_values)
 
-    def text_for_observable(self, observable, object_type):
-        """Returns a string representing the given observable."""
-        text = ''
+    def lines_for_observable(self, observable, object_type):
+        """Yields lines representing the given observable."""
         for field in observable['fields']:
-            text += self.text_for_fields(field, object_type) + '\n'
-        return text
+            yield self.text_for_fields(field, object_type) + '\n'
 
-    def text_for_object_type(self, object_type):
-        """Returns a string representing observables of the given type."""
-        text = ''
+    def lines_for_object_type(self, object_type):
+        """Yields lines representing observables of the given type."""
         if object_type in self.observables:
             for observable in self.observables[object_type]:
-                text += self.text_for_observable(observable, object_type)
-        return text
+                for line in self.lines_for_observable(observable,
+                                                      object_type):
+                    yield line
 
-    def text(self):
-        """Returns a string representation of the STIX package."""
-        text = self.header() if self.include_header else ''
+    def iter_lines(self):
+        """Yields the lines of a text representation of the STIX package.
+
+        Each line includes its trailing newline.
+        """
+        if self.include_header:
+            for line in self.header().splitlines(True):
+                yield line
 
         if self.OBJECT_FIELDS:
             object_types = self.OBJECT_FIELDS.keys()
         else:
             object_types = self.observables.keys()
         for object_type in sorted(object_types):
-            object_text = self.text_for_object_type(object_type)
-            if object_text:
-                if self.include_header:
-                    text += self.header_for_object_type(object_type)
-                text += object_text
-        return text
+            lines = self.lines_for_object_type(object_type)
+            first_line = next(lines, None)
+            if first_line is None:
+                continue
+            if self.include_header:
+                for line in self.header_for_object_type(
+                        object_type).splitlines(True):
+                    yield line
+            yield first_line
+            for line in lines:
+                yield line
+
+    def write(self, stream):
+        """Writes a text representation of the STIX package to a stream."""
+        stream.writelines(self.iter_lines())
+
+    def text_for_observable(self, observable, object_type):
+        """Returns a string representing the given observable."""
+        return ''.join(self.lines_for_observable(observable, object_type))
+
+    def text_for_object_type(self, object_type):
+        """Returns a string representing observables of the given type."""
+        return ''.join(self.lines_for_object_type(object_type))
+
+    def text(self):
+        """Returns a string representation of the STIX package."""
+        return ''.join(self.iter_lines())
+
+
+class _RowBuffer(object):
+    """A minimal file-like object that collects the rows from a csv writer."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(data)
+
+    def pop(self):
+        """Returns (and clears) the data written since the last call."""
+        data = ''.join(self._parts)
+        del self._parts[:]
+        return data
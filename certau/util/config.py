@@ -28,6 +28,13 @@ def get_arg_parser():
         is_config_file=True,
         help="configuration file to use",
     )
+    global_group.add_argument(
+        "--workers",
+        default=1,
+        type=int,
+        help=("number of worker processes used to parse and transform "
+              "STIX packages - default: 1"),
+    )
     global_group.add_argument(
         "-V", "--version",
         action="version",
@@ -67,6 +74,29 @@ def get_arg_parser():
         action="store_true",
         help="poll TAXII server to obtain STIX packages",
     )
+    source_group.add_argument(
+        "--stream",
+        action="store_true",
+        help=("extract observables while parsing STIX packages, without "
+              "building the full package in memory (not with --xml_output)"),
+    )
+    source_group.add_argument(
+        "--cache-dir",
+        help=("cache the observables extracted from each STIX package in "
+              "this directory, so packages seen before aren't parsed again "
+              "(not with --xml_output)"),
+    )
+    source_group.add_argument(
+        "--upgrade-cache-dir",
+        help=("store STIX packages upgraded from older STIX versions in "
+              "this directory, so each package is only upgraded once"),
+    )
+    source_group.add_argument(
+        "--cache-size",
+        default=1024,
+        type=int,
+        help="maximum size of each cache directory in MB - default: 1024",
+    )
 
     # Output (transform) options
     output_group = parser.add_argument_group('output (transform) options')
@@ -113,6 +143,56 @@ def get_arg_parser():
         action="store_true",
         help="recurse subdirectories when processing files.",
     )
+    file_group.add_argument(
+        "--include",
+        action="append",
+        metavar="PATTERN",
+        help=("only process files (in directories) matching this wildcard "
+              "pattern, e.g. '*.xml' (may be given more than once)"),
+    )
+    file_group.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help=("skip files and subdirectories matching this wildcard "
+              "pattern (may be given more than once)"),
+    )
+    file_group.add_argument(
+        "--max-depth",
+        type=int,
+        help="maximum depth of subdirectories to recurse into",
+    )
+    file_group.add_argument(
+        "--stat-threads",
+        default=0,
+        type=int,
+        help=("number of threads used to check files against the manifest "
+              "(e.g. on network filesystems) - default: 0"),
+    )
+    file_group.add_argument(
+        "--manifest",
+        help=("file used to record the files processed (files already "
+              "recorded, and not modified since, are skipped)"),
+    )
+    file_group.add_argument(
+        "--watch",
+        action="store_true",
+        help=("keep running, processing files as they are added to the "
+              "directories given"),
+    )
+    file_group.add_argument(
+        "--watch-interval",
+        default=5.0,
+        type=float,
+        help=("seconds between scans for new files when watching "
+              "directories without inotify - default: 5"),
+    )
+    file_group.add_argument(
+        "--watch-polling",
+        action="store_true",
+        help=("scan for new files rather than using inotify (e.g. for "
+              "network filesystems)"),
+    )
 
     # TAXII source options
     taxii_group = parser.add_argument_group(
@@ -165,6 +245,21 @@ def get_arg_parser():
         "--collection",
         help="TAXII collection to poll",
     )
+    taxii_group.add_argument(
+        "--poll-target",
+        action="append",
+        help=("a collection to poll, as \"POLL_URL COLLECTION "
+              "[SUBSCRIPTION_ID]\" - may be repeated (or given as a list "
+              "in the config file) to poll several collections "
+              "concurrently, instead of --poll-url and --collection"),
+    )
+    taxii_group.add_argument(
+        "--poll-host-limit",
+        default=2,
+        type=int,
+        help=("maximum number of concurrent requests to each TAXII server "
+              "when polling several collections - default: 2"),
+    )
     taxii_group.add_argument(
         "--begin-timestamp",
         help=("the begin timestamp (format: " +
@@ -181,7 +276,29 @@ def get_arg_parser():
     )
     taxii_group.add_argument(
         "--state-file",
-        help="file used to maintain latest poll times",
+        help=("file used to maintain latest poll times (and checkpoints "
+              "for resuming interrupted polls)"),
+    )
+    taxii_group.add_argument(
+        "--poll-prefetch",
+        default=0,
+        type=int,
+        help=("number of poll fulfillment requests (for later result parts) "
+              "to keep in flight while processing content - default: 0"),
+    )
+    taxii_group.add_argument(
+        "--no-keep-alive",
+        action="store_true",
+        help=("open a new connection for each TAXII request (instead of "
+              "reusing connections and accepting compressed responses)"),
+    )
+    taxii_group.add_argument(
+        "--pipeline-queue-size",
+        default=0,
+        type=int,
+        help=("fetch, parse and transform content blocks in separate "
+              "threads, with queues of this size between them - default: 0 "
+              "(no pipeline)"),
     )
 
     # Other output options
@@ -319,6 +436,89 @@ def get_arg_parser():
         action="store_true",
         help="set MISP published state to True",
     )
+    misp_group.add_argument(
+        "--misp-batch-size",
+        default=500,
+        type=int,
+        help=("maximum number of attributes sent to MISP in each request "
+              "(0 to send them all with the event) - default: 500"),
+    )
+    misp_group.add_argument(
+        "--misp-tag-cache-ttl",
+        default=3600,
+        type=float,
+        help=("seconds for which the MISP tag list is cached (0 to download "
+              "it for every package) - default: 3600"),
+    )
+    misp_group.add_argument(
+        "--misp-workers",
+        default=1,
+        type=int,
+        help="number of packages published to MISP at once - default: 1",
+    )
+    misp_group.add_argument(
+        "--misp-max-in-flight",
+        default=4,
+        type=int,
+        help=("maximum number of requests sent to the MISP server at once "
+              "- default: 4"),
+    )
+    misp_group.add_argument(
+        "--misp-rate",
+        default=0,
+        type=float,
+        help=("maximum number of requests sent to the MISP server per "
+              "second (0 for no limit) - default: 0"),
+    )
+    misp_group.add_argument(
+        "--misp-burst",
+        type=int,
+        help=("number of requests that may be sent at once before "
+              "--misp-rate applies - default: one second's worth"),
+    )
+    misp_group.add_argument(
+        "--misp-retries",
+        default=3,
+        type=int,
+        help=("number of times a MISP request is retried after a timeout "
+              "or server error - default: 3"),
+    )
+    misp_group.add_argument(
+        "--misp-backoff",
+        default=0.5,
+        type=float,
+        help=("seconds to wait before retrying a MISP request (doubled for "
+              "each retry) - default: 0.5"),
+    )
+    misp_group.add_argument(
+        "--misp-timeout",
+        default=60,
+        type=float,
+        help="seconds to wait for the MISP server to respond - default: 60",
+    )
+    misp_group.add_argument(
+        "--misp-index",
+        help=("file recording the packages and attributes published to "
+              "MISP, so unchanged packages and known attributes are skipped"),
+    )
+    misp_group.add_argument(
+        "--misp-index-scope",
+        choices=['package', 'server'],
+        default='package',
+        help=("skip attributes already published from the same package, "
+              "or from any package - default: package"),
+    )
+    misp_group.add_argument(
+        "--misp-feed",
+        help=("write the events to a MISP feed in this directory (for MISP "
+              "to pull) instead of publishing them to --misp-url"),
+    )
+    misp_group.add_argument(
+        "--misp-feed-org",
+        default='CTI Toolkit',
+        help=("name of the organisation creating the MISP feed's events "
+              "- default: CTI Toolkit"),
+    )
 
     # File (XML) output options
     xml_group = parser.add_argument_group(
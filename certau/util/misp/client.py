@@ -0,0 +1,292 @@
+"""A PyMISP client for publishing many events concurrently.
+
+PyMISP opens a new HTTP session, and so a new connection, for every
+request. :py:class:`PooledPyMISP` sends the MISP API requests the toolkit
+makes over a single pooled session instead, and can safely be shared by
+several threads. It limits the number of requests in flight and the
+request rate (with a :py:class:`TokenBucket`) to protect the MISP server,
+and retries requests that time out or fail with a server error.
+"""
+
+from __future__ import absolute_import
+
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+import requests
+import six
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urljoin
+
+# suppress PyMISP warnings about Python 2
+logging.getLogger('pymisp').setLevel(logging.ERROR)
+from pymisp import PyMISP, __version__ as pymisp_version
+
+
+class TokenBucket(object):
+    """Limits the rate at which something is done.
+
+    Tokens are added to the bucket at rate tokens per second, up to burst
+    tokens, and :py:func:`acquire` takes a token (waiting for one to be
+    added if the bucket is empty).
+
+    Args:
+        rate: the number of tokens added per second, or 0 for no limit
+        burst: the maximum number of tokens in the bucket (by default, one
+            second's worth and at least 1)
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token from the bucket, waiting until one is available.
+        Returns the time (in seconds) spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class PooledPyMISP(PyMISP):
+    """A PyMISP object that sends its requests over a pooled session.
+
+    The PyMISP methods used by the toolkit (:py:func:`add_event`,
+    :py:func:`add_attributes`, :py:func:`get_event`, :py:func:`tag`,
+    :py:func:`get_all_tags`, :py:func:`publish` and
+    :py:func:`get_recommended_api_version`) are implemented here with
+    :py:func:`request`, which sends requests with a single requests
+    session, rather than relying on PyMISP's (version specific) internals.
+    Connections to the MISP server are kept open and reused, and the
+    object may be used by several threads at once (e.g. by a
+    :py:class:`MispPublisher`). At most max_in_flight requests are sent at a
+    time (others wait for a connection), and requests are started at no
+    more than rate per second. Other PyMISP methods work as usual, but
+    aren't pooled, rate limited or retried.
+
+    Requests that time out, can't connect, or get a server error (one of
+    :py:attr:`RETRY_STATUSES`) are retried up to retries times, waiting
+    backoff * 2 ** n seconds (with jitter) before the nth retry. Note that
+    a request that timed out may have been handled by the server, so
+    retrying it can add an event twice (attributes have UUIDs, so MISP
+    rejects duplicate attributes).
+
+    Args:
+        url: URL for MISP API end-point
+        key: API key for accessing MISP API
+        ssl: a boolean value indicating whether the server's SSL
+            certificate will be verified
+        cert: a tuple containing a certificate and key for SSL client
+            authentication
+        max_in_flight: the maximum number of requests sent at once (and
+            connections kept open)
+        rate: the maximum number of requests started per second (0 for no
+            limit)
+        burst: the number of requests that may be started at once before
+            the rate applies (see :py:class:`TokenBucket`)
+        retries: the number of times a failed request is retried
+        backoff: the time (in seconds) before the first retry
+        timeout: the time (in seconds) to wait for the server to respond
+
+    Attributes:
+        sent: the number of requests sent (including retries)
+        retried: the number of requests that have been retried
+        throttled: the total time (in seconds) requests waited for the rate
+            limit
+    """
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, url, key, ssl=True, cert=None, max_in_flight=4,
+                 rate=0, burst=None, retries=3, backoff=0.5, timeout=60,
+                 **kwargs):
+        # (The session is needed by the requests PyMISP's constructor makes)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sent = 0
+        self.retried = 0
+        self.throttled = 0.0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Authorization': key,
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'User-Agent': 'PyMISP {} - Python {}.{}.{}'.format(
+                pymisp_version, *sys.version_info),
+        })
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        self._bucket = TokenBucket(rate, burst)
+        self._counter_lock = threading.Lock()
+        self._logger = logging.getLogger()
+        super(PooledPyMISP, self).__init__(url, key, ssl=ssl, cert=cert,
+                                           **kwargs)
+
+    # ##### Requests
+
+    def request(self, method, path, data=None):
+        """Sends a request to the MISP API, returning the response as a
+        dictionary, with an 'errors' entry if the request failed.
+
+        Args:
+            method: the HTTP method (e.g. 'GET')
+            path: the path, relative to the MISP URL
+            data: an optional JSON-serialisable request body
+
+        Raises:
+            requests.exceptions.RequestException: if no response was
+                received (after any retries)
+        """
+        request = requests.Request(
+            method,
+            urljoin(self.root_url, path),
+            data=None if data is None else json.dumps(data),
+        )
+        return self._result(self.send(self.session.prepare_request(request)))
+
+    def _result(self, response):
+        # Collects the errors in a response as PyMISP does
+        try:
+            result = response.json()
+        except ValueError:
+            result = {'message': response.text[:200]}
+        if not isinstance(result, dict):
+            result = {'response': result}
+        errors = []
+        for key in ('error', 'errors'):
+            if result.get(key):
+                value = result[key]
+                errors += value if isinstance(value, list) else [value]
+        if response.status_code >= 400 and not errors:
+            errors.append(result.get('message') or
+                          'HTTP {}'.format(response.status_code))
+        errors += self.flatten_error_messages(result)
+        if errors:
+            result['errors'] = errors
+        return result
+
+    def send(self, prepared):
+        """Sends a prepared request, retrying it if it fails. Returns the
+        response (which may be an error response once the retries are
+        used up)."""
+        attempt = 0
+        while True:
+            throttled = self._bucket.acquire()
+            try:
+                with self._in_flight:
+                    with self._counter_lock:
+                        self.sent += 1
+                    response = self.session.send(
+                        prepared,
+                        verify=self.ssl,
+                        proxies=self.proxies,
+                        cert=self.cert,
+                        timeout=self.timeout,
+                    )
+                error = None
+                if response.status_code in self.RETRY_STATUSES:
+                    error = 'HTTP {}'.format(response.status_code)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                response = None
+                error = str(e)
+            with self._counter_lock:
+                self.throttled += throttled
+                if error is not None and attempt < self.retries:
+                    self.retried += 1
+            if error is None or attempt >= self.retries:
+                return response
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+            self._logger.info('MISP request %s %s failed (%s), retrying in '
+                              '%.1fs', prepared.method, prepared.url, error,
+                              delay)
+            attempt += 1
+            time.sleep(delay)
+
+    # ##### MISP API
+
+    @staticmethod
+    def _event_id(event):
+        if isinstance(event, dict):
+            return event.get('Event', event)['id']
+        return event
+
+    def get_recommended_api_version(self):
+        """Returns the PyMISP version recommended by the server."""
+        return self.request('GET', 'servers/getPyMISPVersion.json')
+
+    def get_event(self, event_id):
+        """Returns an event (with its attributes)."""
+        return self.request('GET', 'events/{}'.format(event_id))
+
+    def event_exists(self, event_id):
+        """Returns False if the server says an event doesn't exist (or
+        can't be seen by this user), otherwise True."""
+        url = urljoin(self.root_url, 'events/{}'.format(event_id))
+        request = requests.Request('GET', url)
+        response = self.send(self.session.prepare_request(request))
+        return response.status_code not in (403, 404)
+
+    def add_event(self, event):
+        """Creates an event.
+
+        Args:
+            event: the event (a dictionary or JSON string, which may
+                include the event's attributes)
+        """
+        if isinstance(event, six.string_types):
+            event = json.loads(event)
+        return self.request('POST', 'events', event)
+
+    def add_attributes(self, event_id, attributes):
+        """Adds attributes (a list of dictionaries) to an event in a single
+        request."""
+        return self.request('POST', 'attributes/add/{}'.format(event_id),
+                            list(attributes))
+
+    def tag(self, uuid, tag):
+        """Tags an event (by UUID) with a tag (by ID)."""
+        return self.request('POST', 'tags/attachTagToObject',
+                            {'uuid': uuid, 'tag': tag})
+
+    def get_all_tags(self, quiet=False):
+        """Returns the server's tags (or, if quiet, their names)."""
+        response = self.request('GET', 'tags')
+        if not quiet or response.get('errors'):
+            return response
+        return [tag['name'] for tag in response['Tag']]
+
+    def publish(self, event, alert=True):
+        """Publishes an event (given as an event dictionary or its ID),
+        optionally alerting the server's users."""
+        path = 'events/{}/{}'.format('alert' if alert else 'publish',
+                                     self._event_id(event))
+        return self.request('POST', path)
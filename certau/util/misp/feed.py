@@ -0,0 +1,216 @@
+"""Writing MISP events as a MISP feed.
+
+A MISP feed is a directory (usually served over HTTP) containing a JSON
+file for each event, named by the event's UUID, and a manifest.json file
+summarising the events. MISP servers can be configured to pull a feed
+periodically, so events can be generated offline, as fast as packages can
+be parsed, rather than published through the MISP API.
+
+:py:class:`MispFeedWriter` gives each event a UUID derived from a key
+(e.g. the STIX package ID) and each attribute a UUID derived from the
+event UUID, type and value, so writing an updated package replaces its
+event file, and MISP updates the existing event when it next pulls the
+feed rather than creating a new one.
+"""
+
+from __future__ import absolute_import
+
+import calendar
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import six
+
+
+# The event fields MISP expects as strings
+_STRING_FIELDS = ('distribution', 'threat_level_id', 'analysis')
+
+# The event fields included in the manifest
+_MANIFEST_FIELDS = ('info', 'date', 'analysis', 'threat_level_id',
+                    'timestamp')
+
+
+def _epoch(timestamp):
+    if timestamp is None:
+        return str(int(time.time()))
+    if timestamp.tzinfo is not None:
+        return str(calendar.timegm(timestamp.utctimetuple()))
+    return str(int(time.mktime(timestamp.timetuple())))
+
+
+class MispFeedWriter(object):
+    """Writes MISP events to a MISP feed directory.
+
+    Each event is written to a temporary file as its attributes are
+    produced (so the attributes needn't be held in memory), then renamed
+    to <event UUID>.json. The manifest (which includes any events already
+    in the directory's manifest.json) is then rewritten (also by replacing
+    it), so the feed is consistent even if the writer isn't closed.
+
+    Args:
+        directory: the feed directory (created if it doesn't exist)
+        org_name: the name of the organisation creating the events
+        org_uuid: the organisation's UUID (by default, derived from
+            org_name)
+
+    Attributes:
+        events: the number of events written
+        attributes: the number of attributes written
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory, org_name='CTI Toolkit', org_uuid=None):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.org = {
+            'name': org_name,
+            'uuid': org_uuid or str(uuid.uuid5(uuid.NAMESPACE_URL, org_name)),
+        }
+        self.events = 0
+        self.attributes = 0
+        self._manifest = self._load_manifest()
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_manifest(self):
+        try:
+            with open(self._path(self.MANIFEST)) as file_:
+                return json.load(file_)
+        except (IOError, OSError):
+            return dict()
+
+    def _replace(self, write, name):
+        # Writes a file in the feed directory (with write(file_)) without
+        # leaving it partially written
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file_:
+                write(file_)
+            # (mkstemp creates files only the owner can read)
+            os.chmod(temp_path, 0o644)
+            path = self._path(name)
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def event_uuid(key):
+        """Returns the UUID of the event for a key (e.g. a STIX package
+        ID)."""
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, key))
+
+    def write_event(self, event, attributes, tags=(), key=None,
+                    timestamp=None):
+        """Writes an event to the feed.
+
+        Args:
+            event: the event's fields (e.g. info, date, distribution,
+                threat_level_id and analysis)
+            attributes: an iterable of MISP attributes (dictionaries with
+                type, category, value and to_ids keys)
+            tags: the names of the event's tags (e.g. 'tlp:amber')
+            key: identifies the event (by default, a new event is created
+                each time)
+            timestamp: the time the event was last changed (by default,
+                now)
+
+        Returns:
+            dict: the event (without its attributes)
+        """
+        event = dict(event)
+        event_uuid = self.event_uuid(key) if key else str(uuid.uuid4())
+        epoch = _epoch(timestamp)
+        for field in _STRING_FIELDS:
+            if field in event:
+                event[field] = str(event[field])
+        event.update(
+            uuid=event_uuid,
+            timestamp=epoch,
+            publish_timestamp=epoch,
+            published=True,
+            Orgc=self.org,
+            Tag=[{'name': tag} for tag in tags],
+        )
+        event.pop('Attribute', None)
+
+        counts = []
+
+        def write(file_):
+            # {"Event": {<fields>, "Attribute": [<attributes>]}}
+            file_.write('{"Event": {')
+            for field, value in sorted(event.items()):
+                file_.write('{}: {}, '.format(json.dumps(field),
+                                              json.dumps(value)))
+            file_.write('"Attribute": [')
+            seen = set()
+            for attribute in attributes:
+                attribute = self._attribute(event_uuid, attribute, epoch)
+                if attribute['uuid'] in seen:
+                    continue
+                if seen:
+                    file_.write(', ')
+                seen.add(attribute['uuid'])
+                file_.write(json.dumps(attribute))
+            file_.write(']}}\n')
+            counts.append(len(seen))
+
+        self._replace(write, event_uuid + '.json')
+        entry = dict((field, event[field]) for field in _MANIFEST_FIELDS
+                     if field in event)
+        entry.update(Orgc=self.org, Tag=event['Tag'])
+        with self._lock:
+            self._manifest[event_uuid] = entry
+            self.events += 1
+            self.attributes += counts[0]
+        self.save()
+        self._logger.debug('wrote MISP feed event %s (%d attributes)',
+                           event_uuid, counts[0])
+        return event
+
+    @staticmethod
+    def _attribute(event_uuid, attribute, epoch):
+        # (Identical attributes in an event have the same UUID)
+        attribute = dict(attribute)
+        type_, value = attribute['type'], attribute['value']
+        if isinstance(value, six.binary_type):
+            value = value.decode('utf-8')
+        name = u'{}|{}'.format(six.text_type(type_), value)
+        if six.PY2:
+            name = name.encode('utf-8')
+        attribute['uuid'] = str(uuid.uuid5(uuid.UUID(event_uuid), name))
+        attribute.setdefault('timestamp', epoch)
+        attribute.setdefault('distribution', '5')  # the event's
+        attribute.setdefault('comment', '')
+        return attribute
+
+    def save(self):
+        """Writes the manifest."""
+        # (Held while replacing the file, so an older manifest can't
+        # replace a newer one)
+        with self._lock:
+            manifest = json.dumps(self._manifest, sort_keys=True)
+            self._replace(lambda file_: file_.write(manifest), self.MANIFEST)
+
+    def close(self):
+        """Writes the manifest (once events have been written)."""
+        if self.events:
+            self.save()
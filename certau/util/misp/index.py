@@ -0,0 +1,174 @@
+"""A local index of the packages and attributes published to MISP.
+
+Feeds often send the same packages (and the same indicators in new
+packages) again and again. :py:class:`MispIndex` records, for each MISP
+server, the event each STIX package was published to (with the package's
+timestamp) and the attributes published from each package, so
+:py:class:`StixMispTransform` can skip packages that haven't changed, add
+only the new attributes of an updated package to its existing event, and
+optionally skip attributes already published from any package.
+
+The index is kept in an SQLite database. As with
+:py:class:`PollStateStore`, each update is a single small transaction, so
+the index can be shared by threads (and processes) publishing packages
+concurrently.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import logging
+import os
+import sqlite3
+
+import dateutil.parser
+
+from certau.util.taxii.state import _Connection
+
+
+IndexedPackage = collections.namedtuple(
+    'IndexedPackage',
+    ['event_id', 'event_uuid', 'timestamp'],
+)
+"""The MISP event a package was published to.
+
+Attributes:
+    event_id: the ID of the MISP event
+    event_uuid: the UUID of the MISP event
+    timestamp: the package's timestamp when it was published (or None)
+"""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS misp_package (
+    server TEXT NOT NULL,
+    package_id TEXT NOT NULL,
+    timestamp TEXT,
+    event_id TEXT NOT NULL,
+    event_uuid TEXT,
+    PRIMARY KEY (server, package_id)
+);
+CREATE TABLE IF NOT EXISTS misp_attribute (
+    server TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value TEXT NOT NULL,
+    package_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    PRIMARY KEY (server, type, value, package_id)
+);
+"""
+
+
+class MispIndex(object):
+    """Records the packages and attributes published to MISP servers.
+
+    Packages are identified by their STIX package ID, and attributes by
+    their MISP type and value (and the package they were published from).
+    Servers are identified by their URL.
+
+    Args:
+        filename: the index file (created if it doesn't exist)
+        timeout: how long (in seconds) to wait for another process or
+            thread updating the index
+    """
+
+    def __init__(self, filename, timeout=30.0):
+        self.filename = os.path.abspath(filename)
+        self.timeout = timeout
+        self._logger = logging.getLogger()
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.filename, timeout=self.timeout)
+        # Readers don't block the writer (or vice versa) in WAL mode
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _Connection(connection)
+
+    def package(self, server, package_id):
+        """Returns the :py:class:`IndexedPackage` for a package published
+        to a server (or None)."""
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT event_id, event_uuid, timestamp FROM misp_package '
+                'WHERE server = ? AND package_id = ?',
+                (server, package_id),
+            ).fetchone()
+        if row is None:
+            return None
+        event_id, event_uuid, timestamp = row
+        if timestamp is not None:
+            timestamp = dateutil.parser.parse(timestamp)
+        return IndexedPackage(event_id, event_uuid, timestamp)
+
+    def save_package(self, server, package_id, event_id, event_uuid=None,
+                     timestamp=None):
+        """Records the event a package was published to (replacing any
+        earlier record for the package)."""
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO misp_package VALUES (?, ?, ?, ?, ?)',
+                (server, package_id,
+                 None if timestamp is None else timestamp.isoformat(),
+                 str(event_id), event_uuid),
+            )
+
+    def forget_package(self, server, package_id):
+        """Removes a package (and the attributes published from it), e.g.
+        when its event has been deleted from the server."""
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM misp_package WHERE server = ? AND package_id = ?',
+                (server, package_id),
+            )
+            connection.execute(
+                'DELETE FROM misp_attribute '
+                'WHERE server = ? AND package_id = ?',
+                (server, package_id),
+            )
+
+    def known_attributes(self, server, attributes, package_id=None):
+        """Returns the set of (type, value) tuples for the attributes that
+        have already been published.
+
+        Args:
+            server: the MISP server's URL
+            attributes: MISP attributes (dictionaries with 'type' and
+                'value' keys) or (type, value) tuples
+            package_id: if given, only attributes published from this
+                package are known (otherwise attributes published from any
+                package are)
+        """
+        keys = set(self._key(attribute) for attribute in attributes)
+        if not keys:
+            return set()
+        query = ('SELECT DISTINCT lookup.type, lookup.value FROM lookup '
+                 'JOIN misp_attribute AS a ON a.server = ? '
+                 'AND a.type = lookup.type AND a.value = lookup.value')
+        parameters = (server,)
+        if package_id is not None:
+            query += ' AND a.package_id = ?'
+            parameters += (package_id,)
+        with self._connect() as connection:
+            connection.execute('CREATE TEMP TABLE lookup (type TEXT, '
+                               'value TEXT)')
+            connection.executemany('INSERT INTO lookup VALUES (?, ?)', keys)
+            return set(tuple(row) for row in
+                       connection.execute(query, parameters))
+
+    def save_attributes(self, server, package_id, event_id, attributes):
+        """Records the attributes published from a package."""
+        rows = [(server,) + self._key(attribute) + (package_id, str(event_id))
+                for attribute in attributes]
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO misp_attribute VALUES (?, ?, ?, ?, ?)',
+                rows,
+            )
+
+    @staticmethod
+    def _key(attribute):
+        if isinstance(attribute, dict):
+            return attribute['type'], attribute['value']
+        return tuple(attribute)
+
@@ -0,0 +1,280 @@
+"""A minimal in-process MISP REST API.
+
+:py:class:`MispServer` answers the MISP requests made by PyMISP and
+:py:class:`StixMispTransform` (creating events, adding attributes, tagging
+and publishing events), keeping the events in memory. It is intended as a
+local stand-in for a real MISP instance when testing and benchmarking the
+MISP transform, and has no authentication or persistence.
+
+Latency can be injected to see how the client behaves with a slow server,
+server errors can be injected (with :py:func:`MispServer.fail_requests`)
+to exercise the client's retries, and attributes with particular values
+can be rejected to exercise the client's handling of partial failures.
+"""
+
+from __future__ import absolute_import
+
+import json
+import re
+import threading
+import time
+import uuid
+
+from six.moves import BaseHTTPServer, socketserver
+
+from pymisp import __version__ as pymisp_version
+
+
+DEFAULT_TAGS = ('tlp:white', 'tlp:green', 'tlp:amber', 'tlp:red')
+
+
+class MispServer(object):
+    """Serves a subset of the MISP REST API.
+
+    Args:
+        tags: the names of the tags defined on the server
+        latency: a delay (in seconds) added before each response
+        reject_values: attribute values that are rejected (with a
+            validation error) when added to an event
+        host: the address to listen on
+        port: the port to listen on (by default an unused port is chosen)
+
+    Attributes:
+        requests: a list of (method, path) tuples for the requests received
+        events: a dictionary mapping event IDs to the events created (as
+            MISP event dictionaries, including their attributes)
+        max_concurrent_requests: the largest number of requests handled
+            at the same time
+        connections: the number of connections accepted
+    """
+
+    def __init__(self, tags=DEFAULT_TAGS, latency=0.0, reject_values=None,
+                 host='127.0.0.1', port=0):
+        self.tags = [{'id': str(number), 'name': name}
+                     for number, name in enumerate(tags, 1)]
+        self.latency = latency
+        self.reject_values = set(reject_values or [])
+        self.host = host
+        self.port = port
+        self._lock = threading.Lock()
+        self.reset()
+        self._httpd = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        return 'http://{}:{}/'.format(self.host, self.port)
+
+    def start(self):
+        """Start serving requests (in a background thread)."""
+        handler = type('Handler', (_MispRequestHandler,), dict(server_=self))
+        self._httpd = _ThreadingHTTPServer((self.host, self.port), handler)
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def reset(self):
+        """Clear the recorded requests and the events."""
+        self.requests = []
+        self.events = dict()
+        self.max_concurrent_requests = 0
+        self._event_count = 0
+        self._attribute_count = 0
+        self._failures = []
+        self.connections = 0
+        self._concurrent_requests = 0
+
+    def fail_requests(self, count, status=503):
+        """Answer the next count requests with an error (with the given
+        HTTP status) rather than handling them."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def requests_for(self, pattern):
+        """Returns the number of requests whose path matches a regular
+        expression."""
+        return sum(1 for _, path in self.requests if re.match(pattern, path))
+
+    def response_for(self, method, path, data):
+        """Returns (status, response) for a request, where response is a
+        JSON-serialisable object."""
+        with self._lock:
+            self.requests.append((method, path))
+            status = self._failures.pop(0) if self._failures else None
+        if status is not None:
+            return status, {'name': 'Server error', 'message': 'Server error',
+                            'url': path}
+        path = path.split('?')[0]
+        if method == 'GET':
+            if path == '/servers/getPyMISPVersion.json':
+                return 200, {'version': pymisp_version}
+            if path == '/tags':
+                return 200, {'Tag': self.tags}
+            match = re.match(r'^/events/(\d+)$', path)
+            if match and match.group(1) in self.events:
+                return 200, {'Event': self.events[match.group(1)]}
+        elif method == 'POST':
+            if path == '/events':
+                return self._add_event(data)
+            match = re.match(r'^/attributes/add/(\w+)$', path)
+            if match:
+                return self._add_attributes(match.group(1), data)
+            if path == '/tags/attachTagToObject':
+                return self._attach_tag(data)
+            match = re.match(r'^/events/(publish|alert)/(\d+)$', path)
+            if match and match.group(2) in self.events:
+                self.events[match.group(2)]['published'] = True
+                return 200, {'saved': True, 'success': True,
+                             'name': 'Event published', 'id': match.group(2)}
+        return 404, {'name': 'Not Found', 'message': 'Not Found',
+                     'url': path}
+
+    def _event(self, event_id):
+        # Returns an event by ID or UUID (or None)
+        if event_id in self.events:
+            return self.events[event_id]
+        for event in self.events.values():
+            if event['uuid'] == event_id:
+                return event
+        return None
+
+    def _save_attributes(self, event, attributes):
+        # Returns the attributes that were saved and the errors for the
+        # rest (keyed by their position)
+        saved = []
+        errors = dict()
+        for index, attribute in enumerate(attributes):
+            if attribute.get('value') in self.reject_values:
+                errors[str(index)] = {'value': ['Value rejected']}
+                continue
+            attribute = dict(attribute)
+            attribute.setdefault('uuid', str(uuid.uuid4()))
+            with self._lock:
+                self._attribute_count += 1
+                attribute['id'] = str(self._attribute_count)
+                attribute['event_id'] = event['id']
+                event['Attribute'].append(attribute)
+            saved.append(attribute)
+        return saved, errors
+
+    def _add_event(self, data):
+        event = dict(data.get('Event', data))
+        attributes = event.pop('Attribute', [])
+        for key in ('distribution', 'threat_level_id', 'analysis'):
+            # (MISP returns these as strings)
+            if key in event:
+                event[key] = str(event[key])
+        with self._lock:
+            self._event_count += 1
+            event['id'] = str(self._event_count)
+            event.setdefault('uuid', str(uuid.uuid4()))
+            event['Attribute'] = []
+            event['Tag'] = []
+            self.events[event['id']] = event
+        _, errors = self._save_attributes(event, attributes)
+        response = {'Event': event}
+        if errors:
+            response['errors'] = errors
+        return 200, response
+
+    def _add_attributes(self, event_id, data):
+        event = self._event(event_id)
+        if event is None:
+            return 404, {'name': 'Invalid event', 'message': 'Invalid event',
+                         'url': '/attributes/add/' + event_id}
+        if isinstance(data, list):
+            attributes = data
+        else:
+            attributes = data.get('Attribute', data)
+            if not isinstance(attributes, list):
+                attributes = [attributes]
+        saved, errors = self._save_attributes(event, attributes)
+        if not saved:
+            return 403, {'saved': False, 'name': 'Could not add Attribute',
+                         'message': 'Could not add Attribute',
+                         'errors': errors}
+        response = {'Attribute': saved}
+        if errors:
+            response['errors'] = errors
+        return 200, response
+
+    def _attach_tag(self, data):
+        tag = [tag for tag in self.tags if tag['id'] == str(data.get('tag'))]
+        event = self._event(data.get('uuid'))
+        if not tag or event is None:
+            return 404, {'name': 'Invalid tag or object',
+                         'message': 'Invalid tag or object',
+                         'url': '/tags/attachTagToObject'}
+        event['Tag'].append(tag[0])
+        return 200, {'saved': True, 'success': 'Tag attached.'}
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _MispRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep connections open between requests (and, as real servers do,
+    # disable Nagle's algorithm so responses on them aren't delayed)
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    server_ = None
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server_._lock:
+            self.server_.connections += 1
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        server = self.server_
+        with server._lock:
+            server._concurrent_requests += 1
+            server.max_concurrent_requests = max(
+                server.max_concurrent_requests,
+                server._concurrent_requests,
+            )
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            data = json.loads(body.decode('utf-8')) if body else {}
+            status, response = server.response_for(method, self.path, data)
+        finally:
+            with server._lock:
+                server._concurrent_requests -= 1
+
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, format, *args):
+        pass
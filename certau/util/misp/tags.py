@@ -0,0 +1,125 @@
+"""A cache of the tags defined on MISP servers.
+
+Tagging an event needs the tag's ID, but MISP only lists all of its tags
+at once, which on servers with many tags is a large download.
+:py:class:`MispTagCache` keeps the mapping from tag names to IDs, so the
+tag list is downloaded once (per server and per ttl seconds) rather than
+for every event.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+
+class MispTagCache(object):
+    """Maps tag names to tag IDs for a MISP server.
+
+    The tag list is downloaded (with PyMISP's get_all_tags()) when a tag
+    is first looked up, and again once it is more than ttl seconds old or
+    the cache has been invalidated (e.g. after tags are added to the
+    server). Tags created since the list was downloaded aren't found until
+    it is refreshed.
+
+    :py:func:`shared` returns a cache that is shared by everything in the
+    process using the same server (and API key, since tags may only be
+    visible to some users).
+
+    Args:
+        ttl: the time (in seconds) for which the tag list is used, or 0 to
+            download the list for every lookup
+
+    Attributes:
+        hits: the number of lookups answered from the cached tag list
+        misses: the number of lookups for which the tag list was
+            downloaded
+    """
+
+    # The shared caches for this process, keyed by server URL and API key
+    _shared = dict()
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._tags = None
+        self._loaded = 0
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger()
+
+    @classmethod
+    def shared(cls, misp, ttl=None):
+        """Returns the process-wide cache for a PyMISP object's server.
+
+        Args:
+            misp: the PyMISP object
+            ttl: if given, sets the shared cache's ttl
+        """
+        with cls._shared_lock:
+            key = (misp.root_url, misp.key)
+            cache = cls._shared.get(key)
+            if cache is None:
+                cache = cls._shared[key] = cls()
+        if ttl is not None:
+            cache.ttl = ttl
+        return cache
+
+    @classmethod
+    def invalidate_all(cls):
+        """Invalidates the shared caches (for all servers)."""
+        with cls._shared_lock:
+            caches = list(cls._shared.values())
+        for cache in caches:
+            cache.invalidate()
+
+    def invalidate(self):
+        """Discards the tag list, so it is downloaded for the next
+        lookup."""
+        with self._lock:
+            self._tags = None
+
+    def tag_id(self, misp, name):
+        """Returns the ID of the tag with the given name (or None if there
+        is no such tag).
+
+        Args:
+            misp: the PyMISP object used to download the tag list
+            name: the tag's name (e.g. 'tlp:amber')
+        """
+        return self.lookup(misp, name)[0]
+
+    def lookup(self, misp, name):
+        """Returns a (tag_id, downloaded) tuple for the tag with the given
+        name, where downloaded is True if the tag list was downloaded for
+        this lookup (see :py:func:`tag_id`)."""
+        with self._lock:
+            if (self._tags is None or
+                    time.time() - self._loaded >= self.ttl):
+                self.misses += 1
+                tags = self._download(misp)
+                if tags is None:
+                    # (Not cached, so the download is retried next time)
+                    return None, True
+                self._tags = tags
+                self._loaded = time.time()
+                downloaded = True
+            else:
+                self.hits += 1
+                downloaded = False
+            return self._tags.get(name), downloaded
+
+    def _download(self, misp):
+        response = misp.get_all_tags()
+        if 'Tag' not in response:
+            self._logger.warning('unable to get the MISP tag list: %s',
+                                 response.get('errors'))
+            return None
+        tags = dict()
+        for tag in response['Tag']:
+            tags.setdefault(tag['name'], tag['id'])
+        self._logger.debug('downloaded %d MISP tags from %s', len(tags),
+                           misp.root_url)
+        return tags
@@ -0,0 +1,457 @@
+"""Synthetic STIX packages for testing and benchmarking.
+
+:py:class:`PackageGenerator` writes STIX 1.1.1 packages containing a
+controlled number of observables of each object type handled by the
+transforms, optionally grouped into observable compositions and referenced
+from indicators by idref. The XML is written directly (rather than built
+with python-stix), so packages of any size can be written to a file
+without holding them in memory.
+
+Observable values are derived from each observable's position in the
+package, so the same arguments always produce the same document, apart from
+the package ID: each generator gets a unique one unless package_id is given,
+so packages written by different generators can be cached, indexed and
+published side by side.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import io
+import uuid
+
+from six.moves import range
+
+
+OBJECT_TYPES = (
+    'Address',
+    'DomainName',
+    'URI',
+    'File',
+    'EmailMessage',
+    'SocketAddress',
+    'HTTPSession',
+    'Mutex',
+    'WinRegistryKey',
+)
+
+ID_NAMESPACE = ('example', 'http://example.com/')
+
+# Namespaces required by each object type
+OBJECT_NAMESPACES = {
+    'Address': ['AddressObj'],
+    'DomainName': ['DomainNameObj'],
+    'URI': ['URIObj'],
+    'File': ['FileObj', 'cyboxCommon', 'cyboxVocabs'],
+    'EmailMessage': ['EmailMessageObj', 'AddressObj'],
+    'SocketAddress': ['SocketAddressObj', 'AddressObj', 'PortObj'],
+    'HTTPSession': ['HTTPSessionObj'],
+    'Mutex': ['MutexObj'],
+    'WinRegistryKey': ['WinRegistryKeyObj'],
+}
+
+NAMESPACES = {
+    'AddressObj': 'http://cybox.mitre.org/objects#AddressObject-2',
+    'DomainNameObj': 'http://cybox.mitre.org/objects#DomainNameObject-1',
+    'EmailMessageObj': 'http://cybox.mitre.org/objects#EmailMessageObject-2',
+    'FileObj': 'http://cybox.mitre.org/objects#FileObject-2',
+    'HTTPSessionObj': 'http://cybox.mitre.org/objects#HTTPSessionObject-2',
+    'MutexObj': 'http://cybox.mitre.org/objects#MutexObject-2',
+    'PortObj': 'http://cybox.mitre.org/objects#PortObject-2',
+    'SocketAddressObj':
+        'http://cybox.mitre.org/objects#SocketAddressObject-1',
+    'URIObj': 'http://cybox.mitre.org/objects#URIObject-2',
+    'WinRegistryKeyObj':
+        'http://cybox.mitre.org/objects#WinRegistryKeyObject-2',
+    'cybox': 'http://cybox.mitre.org/cybox-2',
+    'cyboxCommon': 'http://cybox.mitre.org/common-2',
+    'cyboxVocabs': 'http://cybox.mitre.org/default_vocabularies-2',
+    'indicator': 'http://stix.mitre.org/Indicator-2',
+    'marking': 'http://data-marking.mitre.org/Marking-1',
+    'stix': 'http://stix.mitre.org/stix-1',
+    'tlpMarking':
+        'http://data-marking.mitre.org/extensions/MarkingStructure#TLP-1',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+}
+
+CORE_NAMESPACES = ['cybox', 'indicator', 'marking', 'stix', 'tlpMarking',
+                   'xsi']
+
+HASH_TYPES = (
+    ('MD5', hashlib.md5),
+    ('SHA1', hashlib.sha1),
+    ('SHA256', hashlib.sha256),
+)
+
+
+def _ipv4(n):
+    return '10.{}.{}.{}'.format((n >> 16) & 255, (n >> 8) & 255, n & 255)
+
+
+def _address(n):
+    if n % 4 == 3:
+        return (
+            '<cybox:Properties xsi:type="AddressObj:AddressObjectType" '
+            'category="ipv6-addr">'
+            '<AddressObj:Address_Value>2001:db8::{:x}'
+            '</AddressObj:Address_Value></cybox:Properties>'
+        ).format(n)
+    return (
+        '<cybox:Properties xsi:type="AddressObj:AddressObjectType" '
+        'category="ipv4-addr">'
+        '<AddressObj:Address_Value condition="Equals">{}'
+        '</AddressObj:Address_Value></cybox:Properties>'
+    ).format(_ipv4(n))
+
+
+def _domain_name(n):
+    return (
+        '<cybox:Properties xsi:type="DomainNameObj:DomainNameObjectType">'
+        '<DomainNameObj:Value>host{}.example.org</DomainNameObj:Value>'
+        '</cybox:Properties>'
+    ).format(n)
+
+
+def _uri(n):
+    if n % 4 == 3:
+        return (
+            '<cybox:Properties xsi:type="URIObj:URIObjectType" '
+            'type="Domain Name"><URIObj:Value>host{}.example.org'
+            '</URIObj:Value></cybox:Properties>'
+        ).format(n)
+    return (
+        '<cybox:Properties xsi:type="URIObj:URIObjectType" type="URL">'
+        '<URIObj:Value>http://host{0}.example.org/path/{0}</URIObj:Value>'
+        '</cybox:Properties>'
+    ).format(n)
+
+
+def _file(n, hashes):
+    data = str(n).encode('ascii')
+    parts = [
+        '<cybox:Properties xsi:type="FileObj:FileObjectType">'
+        '<FileObj:File_Name condition="Equals">file{}.exe'
+        '</FileObj:File_Name><FileObj:Hashes>'.format(n),
+    ]
+    for name, function in HASH_TYPES[:hashes]:
+        parts.append(
+            '<cyboxCommon:Hash><cyboxCommon:Type condition="Equals" '
+            'xsi:type="cyboxVocabs:HashNameVocab-1.0">{}</cyboxCommon:Type>'
+            '<cyboxCommon:Simple_Hash_Value condition="Equals">{}'
+            '</cyboxCommon:Simple_Hash_Value></cyboxCommon:Hash>'.format(
+                name, function(data).hexdigest()),
+        )
+    parts.append('</FileObj:Hashes></cybox:Properties>')
+    return ''.join(parts)
+
+
+def _email_address(address):
+    return (
+        'xsi:type="AddressObj:AddressObjectType" category="e-mail">'
+        '<AddressObj:Address_Value condition="Equals">{}'
+        '</AddressObj:Address_Value>'
+    ).format(address)
+
+
+def _email_message(n, recipients):
+    parts = [
+        '<cybox:Properties xsi:type="EmailMessageObj:EmailMessageObjectType">'
+        '<EmailMessageObj:Header><EmailMessageObj:To>',
+    ]
+    for i in range(recipients):
+        parts.append('<EmailMessageObj:Recipient {}'
+                     '</EmailMessageObj:Recipient>'.format(
+                         _email_address('user{}@example{}.org'.format(i, n))))
+    parts.append(
+        '</EmailMessageObj:To><EmailMessageObj:From {}</EmailMessageObj:From>'
+        '<EmailMessageObj:Subject condition="Equals">Message {}'
+        '</EmailMessageObj:Subject></EmailMessageObj:Header>'
+        '</cybox:Properties>'.format(
+            _email_address('sender@example{}.org'.format(n)), n),
+    )
+    return ''.join(parts)
+
+
+def _socket_address(n):
+    return (
+        '<cybox:Properties '
+        'xsi:type="SocketAddressObj:SocketAddressObjectType">'
+        '<SocketAddressObj:IP_Address xsi:type="AddressObj:AddressObjectType"'
+        ' category="ipv4-addr"><AddressObj:Address_Value condition="Equals">'
+        '{}</AddressObj:Address_Value></SocketAddressObj:IP_Address>'
+        '<SocketAddressObj:Port xsi:type="PortObj:PortObjectType">'
+        '<PortObj:Port_Value condition="Equals">{}</PortObj:Port_Value>'
+        '<PortObj:Layer4_Protocol condition="Equals">TCP'
+        '</PortObj:Layer4_Protocol></SocketAddressObj:Port>'
+        '</cybox:Properties>'
+    ).format(_ipv4(n), 1024 + n % 64512)
+
+
+def _http_session(n):
+    return (
+        '<cybox:Properties xsi:type="HTTPSessionObj:HTTPSessionObjectType">'
+        '<HTTPSessionObj:HTTP_Request_Response>'
+        '<HTTPSessionObj:HTTP_Client_Request>'
+        '<HTTPSessionObj:HTTP_Request_Header><HTTPSessionObj:Parsed_Header>'
+        '<HTTPSessionObj:User_Agent>Mozilla/5.0 (Synthetic {})'
+        '</HTTPSessionObj:User_Agent></HTTPSessionObj:Parsed_Header>'
+        '</HTTPSessionObj:HTTP_Request_Header>'
+        '</HTTPSessionObj:HTTP_Client_Request>'
+        '</HTTPSessionObj:HTTP_Request_Response></cybox:Properties>'
+    ).format(n)
+
+
+def _mutex(n):
+    return (
+        '<cybox:Properties xsi:type="MutexObj:MutexObjectType">'
+        '<MutexObj:Name condition="Equals">MUTEX_{:06d}</MutexObj:Name>'
+        '</cybox:Properties>'
+    ).format(n)
+
+
+def _win_registry_key(n):
+    return (
+        '<cybox:Properties '
+        'xsi:type="WinRegistryKeyObj:WindowsRegistryKeyObjectType">'
+        '<WinRegistryKeyObj:Key condition="Equals">'
+        '\\Microsoft\\Windows\\CurrentVersion\\Run</WinRegistryKeyObj:Key>'
+        '<WinRegistryKeyObj:Hive condition="Equals">HKEY_CURRENT_USER'
+        '</WinRegistryKeyObj:Hive><WinRegistryKeyObj:Values>'
+        '<WinRegistryKeyObj:Value><WinRegistryKeyObj:Name condition="Equals">'
+        'value{0}</WinRegistryKeyObj:Name>'
+        '<WinRegistryKeyObj:Data condition="Equals">'
+        '%APPDATA%\\malware{0}.exe</WinRegistryKeyObj:Data>'
+        '</WinRegistryKeyObj:Value></WinRegistryKeyObj:Values>'
+        '</cybox:Properties>'
+    ).format(n)
+
+
+class PackageGenerator(object):
+    """Generates synthetic STIX packages.
+
+    Observables of the different object types are interleaved in the
+    package. A proportion of them (composition_ratio) can be grouped into
+    indicators containing an OR observable composition, either inline or as
+    idrefs to observables at the root of the package, and a proportion of
+    the root observables (idref_ratio) can be referenced by idref from
+    indicators of their own.
+
+    Args:
+        counts: a dictionary mapping object types (see OBJECT_TYPES) to the
+            number of observables of that type
+        idref_ratio: the proportion of root observables referenced by idref
+            from an indicator
+        composition_ratio: the proportion of observables included in an
+            observable composition
+        composition_size: the number of observables in each composition
+        inline_compositions: include the observables in each composition
+            inline (rather than as idrefs to root observables)
+        hashes: the number of hashes (1-3) for each File observable
+        recipients: the number of recipients for each EmailMessage
+            observable
+        title: the package title
+        package_id: the package ID (a unique ID is generated if it isn't
+            given)
+    """
+
+    def __init__(self, counts, idref_ratio=0.0, composition_ratio=0.0,
+                 composition_size=4, inline_compositions=False, hashes=3,
+                 recipients=2, title='Synthetic package', package_id=None):
+        for object_type in counts:
+            if object_type not in OBJECT_TYPES:
+                raise ValueError('unsupported object type: ' + object_type)
+        self.counts = dict(counts)
+        self.idref_ratio = idref_ratio
+        self.composition_ratio = composition_ratio
+        self.composition_size = composition_size
+        self.inline_compositions = inline_compositions
+        self.hashes = hashes
+        self.recipients = recipients
+        self.title = title
+        if package_id is None:
+            package_id = '{}:Package-{}'.format(ID_NAMESPACE[0], uuid.uuid4())
+        self.package_id = package_id
+
+    @classmethod
+    def for_size(cls, size, object_types=OBJECT_TYPES, **kwargs):
+        """Returns a generator for a package of approximately size bytes.
+
+        The package contains equal numbers of observables of each of the
+        given object types (the first types get one more when the size
+        isn't a whole number of rounds). The size is estimated from small
+        samples, so it is only accurate to within a few percent, and
+        packages can't be smaller than the header and namespace
+        declarations (around 1 KB).
+        """
+        object_types = list(object_types)
+
+        def _size(rounds, object_type=None):
+            counts = dict((t, rounds) for t in object_types)
+            if object_type is not None:
+                counts[object_type] += 1
+            return len(cls(counts, **kwargs).document().encode('utf-8'))
+
+        # Estimate the size of a round (one observable of each type, plus
+        # any indicators) and of the rest of the package (header, namespace
+        # declarations, etc.) from samples
+        sample = _size(10)
+        per_round = max(1.0, (_size(20) - sample) / 10.0)
+        fixed = sample - 10 * per_round
+
+        rounds = max(0, int((size - fixed) // per_round))
+        counts = dict((t, rounds) for t in object_types)
+        remaining = size - fixed - rounds * per_round
+        for object_type in object_types:
+            per_type = _size(10, object_type) - sample
+            if per_type > remaining:
+                break
+            counts[object_type] += 1
+            remaining -= per_type
+        return cls(counts, **kwargs)
+
+    @property
+    def observable_count(self):
+        """The total number of observables in the package."""
+        return sum(self.counts.values())
+
+    def _sequence(self):
+        # Yields (number, object_type) for each observable, interleaving
+        # the object types
+        types = [t for t in OBJECT_TYPES if self.counts.get(t)]
+        number = 0
+        for i in range(max([self.counts[t] for t in types] or [0])):
+            for object_type in types:
+                if i < self.counts[object_type]:
+                    yield number, object_type
+                    number += 1
+
+    @staticmethod
+    def _selected(number, ratio):
+        # Deterministically selects a proportion (ratio) of numbers
+        return int((number + 1) * ratio) > int(number * ratio)
+
+    def _properties(self, number, object_type):
+        if object_type == 'Address':
+            return _address(number)
+        elif object_type == 'DomainName':
+            return _domain_name(number)
+        elif object_type == 'URI':
+            return _uri(number)
+        elif object_type == 'File':
+            return _file(number, self.hashes)
+        elif object_type == 'EmailMessage':
+            return _email_message(number, self.recipients)
+        elif object_type == 'SocketAddress':
+            return _socket_address(number)
+        elif object_type == 'HTTPSession':
+            return _http_session(number)
+        elif object_type == 'Mutex':
+            return _mutex(number)
+        return _win_registry_key(number)
+
+    def _observable(self, number, object_type):
+        return (
+            '<cybox:Observable id="example:Observable-{0}">'
+            '<cybox:Object id="example:{1}-{0}">{2}</cybox:Object>'
+            '</cybox:Observable>'
+        ).format(number, object_type, self._properties(number, object_type))
+
+    @staticmethod
+    def _indicator(number, observable):
+        return (
+            '\n    <stix:Indicator id="example:indicator-{}" '
+            'xsi:type="indicator:IndicatorType">'
+            '<indicator:Title>Synthetic indicator</indicator:Title>'
+            '{}</stix:Indicator>'
+        ).format(number, observable)
+
+    def _header(self):
+        prefixes = set(CORE_NAMESPACES)
+        for object_type, count in self.counts.items():
+            if count:
+                prefixes.update(OBJECT_NAMESPACES[object_type])
+        declarations = ['xmlns:{}="{}"'.format(*ID_NAMESPACE)]
+        declarations.extend(
+            'xmlns:{}="{}"'.format(prefix, NAMESPACES[prefix])
+            for prefix in sorted(prefixes)
+        )
+        return (
+            '<stix:STIX_Package\n    {}\n    id="{}" '
+            'version="1.1.1" timestamp="2017-01-01T00:00:00+00:00">\n'
+            '  <stix:STIX_Header>\n'
+            '    <stix:Title>{}</stix:Title>\n'
+            '    <stix:Handling><marking:Marking>'
+            '<marking:Controlled_Structure>//node()'
+            '</marking:Controlled_Structure>'
+            '<marking:Marking_Structure '
+            'xsi:type="tlpMarking:TLPMarkingStructureType" color="WHITE"/>'
+            '</marking:Marking></stix:Handling>\n'
+            '  </stix:STIX_Header>\n'
+        ).format('\n    '.join(declarations), self.package_id, self.title)
+
+    def iter_chunks(self):
+        """Yields the package document in (text) chunks."""
+        yield self._header()
+
+        inline = self.inline_compositions and self.composition_ratio
+        yield ('  <stix:Observables cybox_major_version="2" '
+               'cybox_minor_version="1" cybox_update_version="0">')
+        for number, object_type in self._sequence():
+            if inline and self._selected(number, self.composition_ratio):
+                continue
+            yield '\n    ' + self._observable(number, object_type)
+        yield '\n  </stix:Observables>\n'
+
+        if not (self.idref_ratio or self.composition_ratio):
+            yield '</stix:STIX_Package>\n'
+            return
+
+        yield '  <stix:Indicators>'
+        indicator = 0
+        members = []
+        for number, object_type in self._sequence():
+            if (self.composition_ratio and
+                    self._selected(number, self.composition_ratio)):
+                if inline:
+                    members.append(self._observable(number, object_type))
+                else:
+                    members.append('<cybox:Observable idref='
+                                   '"example:Observable-{}"/>'.format(number))
+                if len(members) == self.composition_size:
+                    yield self._indicator(indicator, self._composition(
+                        indicator, members))
+                    indicator += 1
+                    members = []
+                if inline:
+                    continue
+            if self.idref_ratio and self._selected(number, self.idref_ratio):
+                observable = ('<indicator:Observable '
+                              'idref="example:Observable-{}"/>'.format(number))
+                yield self._indicator(indicator, observable)
+                indicator += 1
+        if members:
+            yield self._indicator(indicator, self._composition(indicator,
+                                                               members))
+        yield '\n  </stix:Indicators>\n</stix:STIX_Package>\n'
+
+    @staticmethod
+    def _composition(number, members):
+        return (
+            '<indicator:Observable id="example:Observable-composition-{}">'
+            '<cybox:Observable_Composition operator="OR">{}'
+            '</cybox:Observable_Composition></indicator:Observable>'
+        ).format(number, ''.join(members))
+
+    def document(self):
+        """Returns the package document (text)."""
+        return ''.join(self.iter_chunks())
+
+    def write(self, file_):
+        """Writes the package document (UTF-8 encoded) to a binary file."""
+        for chunk in self.iter_chunks():
+            file_.write(chunk.encode('utf-8'))
+
+    def save(self, filename):
+        """Writes the package document to a file."""
+        with io.open(filename, 'wb') as file_:
+            self.write(file_)
@@ -2,14 +2,26 @@ from __future__ import absolute_import
 
 from stix.extensions.marking.tlp import TLPMarkingStructure
 
+from .summary import PackageSummary
+
 TLP_COLOURS = ["WHITE", "GREEN", "AMBER", "RED"]
 
 
-def package_time(package):
+def package_produced_time(package):
+    """Retrieves the produced time from the header's information source."""
+    if isinstance(package, PackageSummary):
+        return package.produced_time
     if package.stix_header:
         info_source = package.stix_header.information_source
         if info_source and info_source.time and info_source.time.produced_time:
             return info_source.time.produced_time.value
+    return None
+
+
+def package_time(package):
+    produced_time = package_produced_time(package)
+    if produced_time:
+        return produced_time
     if package.timestamp:
         return package.timestamp
     return None
@@ -17,6 +29,8 @@ def package_time(package):
 
 def package_title(package):
     """Retrieves the STIX package title (str) from the header."""
+    if isinstance(package, PackageSummary):
+        return package.title
     if package.stix_header and package.stix_header.title:
         return str(package.stix_header.title)
     else:
@@ -25,6 +39,8 @@ def package_title(package):
 
 def package_description(package):
     """Retrieves the STIX package description (str) from the header."""
+    if isinstance(package, PackageSummary):
+        return package.description
     if package.stix_header and package.stix_header.description:
         return str(package.stix_header.description)
     else:
@@ -33,6 +49,8 @@ def package_description(package):
 
 def package_tlp(package):
     """Retrieves the STIX package TLP (str) from the header."""
+    if isinstance(package, PackageSummary):
+        return package.tlp
     if package.stix_header:
         handling = package.stix_header.handling
         if handling and handling.marking:
@@ -0,0 +1,277 @@
+"""Incremental (streaming) access to STIX packages.
+
+The :py:class:`StreamingStixPackage` class provides an alternative to
+:py:class:`STIXPackage<stix.core.stix_package.STIXPackage>` for transforms
+that only need the package header and the observables. Rather than building
+the full python-stix/cybox object graph, the package XML is walked with
+:py:func:`lxml.etree.iterparse` and each observable's ``cybox:Properties``
+element is handed to the caller as soon as it has been parsed. Elements are
+freed once they have been processed, so memory use is bounded by the size
+of the largest observable rather than the size of the package.
+"""
+
+from __future__ import absolute_import
+
+import dateutil.parser
+import six
+
+from lxml import etree
+
+from cybox.objects import get_class_for_object_type, UnknownObjectType
+
+from .summary import PackageSummary
+
+
+# Field names (from OBJECT_FIELDS) that refer to a list of sub-objects held
+# in a container element, e.g. File.hashes -> FileObj:Hashes/Hash
+LIST_FIELDS = frozenset([
+    'attachments', 'bcc', 'cc', 'hashes', 'to', 'values',
+])
+
+XSI_TYPE = '{http://www.w3.org/2001/XMLSchema-instance}type'
+
+
+def local_name(tag):
+    """Returns the local part of an lxml element tag."""
+    return tag.rpartition('}')[2]
+
+
+def object_type_for_properties(properties):
+    """Determine the object type (Cybox class name) for an XML element.
+
+    Mirrors the object type returned by
+    :py:func:`StixTransform._observable_object_type` for the same
+    observable when parsed with python-cybox.
+    """
+    xsi_type = properties.get(XSI_TYPE)
+    if not xsi_type:
+        return None
+    try:
+        class_ = get_class_for_object_type(xsi_type.rpartition(':')[2])
+    except (UnknownObjectType, ImportError, AttributeError):
+        return None
+    return class_.__name__
+
+
+def element_field(element, field):
+    """Returns the value of a (python-cybox) field from an XML element.
+
+    The field name is matched (ignoring case and trailing underscores)
+    against the local names of the element's children and then its
+    attributes. A list of elements is returned for fields that contain
+    multiple values, a child element for single values, or a string for
+    values held in an attribute. Returns None if the field is not present.
+    """
+    name = field.rstrip('_').lower()
+    children = [
+        child for child in element
+        if isinstance(child.tag, six.string_types) and
+        local_name(child.tag).lower() == name
+    ]
+    if not children:
+        return element.get(name)
+    if len(children) == 1:
+        if name in LIST_FIELDS:
+            return [item for item in children[0]
+                    if isinstance(item.tag, six.string_types)]
+        return children[0]
+    return children
+
+
+def element_value_condition(element):
+    """Returns the text and string condition (or None) of a leaf element."""
+    return element.text, element.get('condition')
+
+
+def open_source(source):
+    """Returns a file name or file-like object suitable for iterparse.
+
+    Args:
+        source: a file name, a file-like object, or a callable returning
+            either of these
+    """
+    source = source() if callable(source) else source
+    if isinstance(source, six.string_types):
+        return source
+    return _BytesReader(source)
+
+
+def sniff_version(source):
+    """Returns the version attribute of a document's root element.
+
+    Only the start of the document is parsed, so this is a cheap way to
+    determine whether a package needs to be upgraded before it is parsed
+    with python-stix.
+
+    Args:
+        source: a file name, a file-like object, or a callable returning
+            either of these
+    """
+    for _, element in etree.iterparse(open_source(source), events=('start',),
+                                      huge_tree=True):
+        return element.get('version')
+    return None
+
+
+class StreamingStixPackage(PackageSummary):
+    """A lightweight stand-in for a STIXPackage object.
+
+    Header details are read on first use with a parse that stops at the
+    end of the STIX_Header element. Observables are obtained with
+    :py:func:`iter_observables`, which parses the whole document
+    incrementally.
+
+    Args:
+        source: a file name, a file-like object, or a callable returning
+            either of these (used when the document needs to be read more
+            than once)
+    """
+
+    def __init__(self, source):
+        super(StreamingStixPackage, self).__init__()
+        self._source = source
+
+    @property
+    def header(self):
+        if self._header is None:
+            for _ in self._iterparse(header_only=True):
+                pass
+        return self._header
+
+    # ##### Parsing
+
+    @staticmethod
+    def _parse_time(value):
+        return dateutil.parser.parse(value) if value else None
+
+    def _read_root(self, root):
+        self._header = dict(
+            id=root.get('id'),
+            version=root.get('version'),
+            timestamp=self._parse_time(root.get('timestamp')),
+            title=None,
+            description=None,
+            tlp=None,
+            produced_time=None,
+        )
+
+    def _read_header(self, stix_header):
+        for element in stix_header:
+            if not isinstance(element.tag, six.string_types):
+                continue
+            name = local_name(element.tag)
+            if name == 'Title' and self._header['title'] is None:
+                self._header['title'] = element.text
+            elif (name == 'Description' and
+                    self._header['description'] is None):
+                self._header['description'] = element.text
+            elif name == 'Handling' and self._header['tlp'] is None:
+                for marking in element.iter('{*}Marking_Structure'):
+                    xsi_type = marking.get(XSI_TYPE, '')
+                    if xsi_type.endswith(':TLPMarkingStructureType'):
+                        self._header['tlp'] = marking.get('color')
+                        break
+            elif name == 'Information_Source':
+                for produced in element.iter('{*}Produced_Time'):
+                    self._header['produced_time'] = self._parse_time(
+                        produced.text,
+                    )
+                    break
+
+    def _iterparse(self, header_only=False):
+        """Walks the package, yielding observable elements.
+
+        Yields an (element, location) tuple for each cybox:Observable
+        element found in the package root ('root') or in a package-level
+        indicator ('indicator'). Elements in the first two levels of
+        the document are freed (with their descendants) once processed.
+        """
+        depth = 0
+        context = etree.iterparse(
+            open_source(self._source),
+            events=('start', 'end'),
+            huge_tree=True,
+        )
+        for event, element in context:
+            if event == 'start':
+                if depth == 0:
+                    self._read_root(element)
+                elif (depth == 1 and header_only and
+                        local_name(element.tag) != 'STIX_Header'):
+                    # The header must precede all other elements
+                    break
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth > 2 or not isinstance(element.tag, six.string_types):
+                continue
+
+            name = local_name(element.tag)
+            if depth == 1:
+                if name == 'STIX_Header':
+                    self._read_header(element)
+                    if header_only:
+                        break
+            elif depth == 2:
+                parent = local_name(element.getparent().tag)
+                if parent == 'STIX_Header':
+                    continue
+                elif parent == 'Observables' and name == 'Observable':
+                    yield element, 'root'
+                elif parent == 'Indicators' and name == 'Indicator':
+                    for observable in element.iterchildren('{*}Observable'):
+                        yield observable, 'indicator'
+
+            # Free the element and any processed siblings
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        del context
+
+    def iter_observables(self):
+        """Yields observables found in the package.
+
+        Observables are sought in the same locations as
+        :py:func:`StixTransform._observables_for_package` - the package
+        root, package-level indicators, and ObservableCompositions within
+        either of these.
+
+        Yields:
+            tuple: (id, object_type, properties, location) for each
+                observable, where properties is the cybox:Properties element
+                (or None) and location is one of 'root', 'indicator' or
+                'composition'. The properties element is only valid until
+                the next item is requested.
+        """
+        def _expand(observable, location):
+            composition = observable.find('{*}Observable_Composition')
+            if composition is not None:
+                for child in composition.iterchildren('{*}Observable'):
+                    for item in _expand(child, 'composition'):
+                        yield item
+            else:
+                properties = observable.find('{*}Object/{*}Properties')
+                if properties is not None:
+                    object_type = object_type_for_properties(properties)
+                else:
+                    object_type = None
+                yield observable.get('id'), object_type, properties, location
+
+        for observable, location in self._iterparse():
+            for item in _expand(observable, location):
+                yield item
+
+
+class _BytesReader(object):
+    """File-like wrapper returning bytes from a text or binary stream."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        return data
@@ -0,0 +1,100 @@
+"""Lightweight, picklable summaries of STIX packages.
+
+A :py:class:`PackageSummary` holds the header details of a STIX package
+and the observables extracted from it by one or more transform classes.
+Transforms accept a summary in place of a
+:py:class:`STIXPackage<stix.core.stix_package.STIXPackage>`, which allows
+packages to be parsed in one place (e.g. a worker process) and transformed
+in another.
+"""
+
+from __future__ import absolute_import
+
+
+class PackageSummary(object):
+    """Header details and extracted observables for a STIX package.
+
+    Args:
+        header: a dict containing the keys 'id', 'version', 'timestamp',
+            'title', 'description', 'tlp' and 'produced_time'
+        observables: a dict, keyed by transform class name, containing the
+            result of that class's
+            :py:func:`StixTransform._observables_for_package`
+    """
+
+    def __init__(self, header=None, observables=None):
+        self._header = header
+        self._observables = dict() if observables is None else observables
+
+    @classmethod
+    def from_package(cls, package, transform_classes):
+        """Create a summary of a package for the given transform classes.
+
+        The 'observable' entry of each extracted observable is set to None
+        so the summary does not refer to the package's object graph.
+        """
+        from .helpers import package_title, package_description
+        from .helpers import package_tlp, package_produced_time
+
+        summary = cls(dict(
+            id=package.id_,
+            version=package.version,
+            timestamp=package.timestamp,
+            title=package_title(package),
+            description=package_description(package),
+            tlp=package_tlp(package),
+            produced_time=package_produced_time(package),
+        ))
+        for transform_class in transform_classes:
+            observables = transform_class._observables_for_package(package)
+            for object_observables in observables.values():
+                for observable in object_observables:
+                    observable['observable'] = None
+            summary.set_observables(transform_class, observables)
+        return summary
+
+    # ##### Header details
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def id_(self):
+        return self.header['id']
+
+    @property
+    def version(self):
+        return self.header['version']
+
+    @property
+    def timestamp(self):
+        return self.header['timestamp']
+
+    @property
+    def title(self):
+        return self.header['title']
+
+    @property
+    def description(self):
+        return self.header['description']
+
+    @property
+    def tlp(self):
+        return self.header['tlp']
+
+    @property
+    def produced_time(self):
+        return self.header['produced_time']
+
+    # ##### Extracted observables
+
+    def observables_for(self, transform_class):
+        """Returns the observables extracted for a transform class.
+
+        Returns None if the observables have not been extracted.
+        """
+        return self._observables.get(transform_class.__name__)
+
+    def set_observables(self, transform_class, observables):
+        self._observables[transform_class.__name__] = observables
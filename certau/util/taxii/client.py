@@ -1,8 +1,7 @@
-import os
 import logging
-import dateutil
-import pickle
+import collections
 
+from multiprocessing.pool import ThreadPool
 from six.moves.urllib.parse import urlparse
 
 from libtaxii import get_message_from_http_response, VID_TAXII_XML_11
@@ -11,6 +10,9 @@ from libtaxii.messages_11 import PollResponse, generate_message_id
 from libtaxii.clients import HttpClient
 
 from certau import version_string
+from .state import PollCheckpoint, PollStateStore
+from .stream import StreamingPollResponse, get_message_from_http_stream
+from .transport import HttpConnectionPool
 
 
 class SimpleTaxiiClient(HttpClient):
@@ -25,10 +27,20 @@ class SimpleTaxiiClient(HttpClient):
                    (for SSL certificate-based authentication)
         ca_file: a file containing the CA's certificate
                  (for verifying the server's certificate)
+        request_semaphore: a semaphore acquired while sending each request
+                 (e.g. shared by the clients for a host, to limit the
+                 number of concurrent connections to it)
+        connection_pool: an :py:class:`HttpConnectionPool` for sending
+                 requests (e.g. shared by several clients)
+        keep_alive: reuse connections (and accept compressed responses),
+                 using a new connection pool if none is given; otherwise
+                 each request is sent on a new connection by libtaxii
     """
 
     def __init__(self, username=None, password=None,
-                 key_file=None, cert_file=None, ca_file=None):
+                 key_file=None, cert_file=None, ca_file=None,
+                 request_semaphore=None, connection_pool=None,
+                 keep_alive=True):
         super(SimpleTaxiiClient, self).__init__()
         self._logger = logging.getLogger()
 
@@ -37,6 +49,10 @@ class SimpleTaxiiClient(HttpClient):
         self.key_file = key_file
         self.cert_file = cert_file
         self.ca_file = ca_file
+        self.request_semaphore = request_semaphore
+        if connection_pool is None and keep_alive:
+            connection_pool = HttpConnectionPool()
+        self.connection_pool = connection_pool if keep_alive else None
 
     def setup_authentication(self, use_ssl):
         """Setup the appropriate credentials and authentication type.
@@ -117,16 +133,58 @@ class SimpleTaxiiClient(HttpClient):
             result_part_number=part_number,
         )
 
-    def send_taxii_message(self, request, host, path, port):
-        # Send the request message and return the response
-        http_response = self.call_taxii_service2(
-            host=host,
-            path=path,
-            message_binding=VID_TAXII_XML_11,
-            post_data=request.to_xml(),
-            port=port,
-            user_agent='{} (libtaxii)'.format(version_string)
-        )
+    def send_taxii_message(self, request, host, path, port, stream=False):
+        """Send the request message and return the response.
+
+        With stream (and a connection pool), a poll response is returned as
+        a :py:class:`StreamingPollResponse`, whose content blocks are parsed
+        as they are received. The request semaphore is then held until the
+        response has been read (or closed).
+        """
+        semaphore = self.request_semaphore
+        if semaphore is None:
+            return self._send_taxii_message(request, host, path, port, stream)
+
+        semaphore.acquire()
+        try:
+            response = self._send_taxii_message(request, host, path, port,
+                                                stream)
+        except Exception:
+            semaphore.release()
+            raise
+        if isinstance(response, StreamingPollResponse):
+            response.on_close(semaphore.release)
+        else:
+            semaphore.release()
+        return response
+
+    def _send_taxii_message(self, request, host, path, port, stream=False):
+        user_agent = '{} (libtaxii)'.format(version_string)
+        pool = self.connection_pool
+        if pool is not None and not pool.uses_proxy(self, host):
+            http_stream = pool.open(
+                client=self,
+                host=host,
+                path=path,
+                post_data=request.to_xml(),
+                port=port,
+                user_agent=user_agent,
+            )
+            if stream:
+                return get_message_from_http_stream(
+                    stream=http_stream,
+                    in_response_to=request.message_id,
+                )
+            http_response = http_stream.response()
+        else:
+            http_response = self.call_taxii_service2(
+                host=host,
+                path=path,
+                message_binding=VID_TAXII_XML_11,
+                post_data=request.to_xml(),
+                port=port,
+                user_agent=user_agent,
+            )
         response = get_message_from_http_response(
             http_response=http_response,
             in_response_to=request.message_id,
@@ -135,34 +193,42 @@ class SimpleTaxiiClient(HttpClient):
 
     @staticmethod
     def get_poll_time(filename, poll_url, collection):
-        if os.path.isfile(filename):
-            with open(filename, 'rb') as state_file:
-                poll_state = pickle.load(state_file)
-                if isinstance(poll_state, dict) and poll_url in poll_state:
-                    if collection in poll_state[poll_url]:
-                        time_string = poll_state[poll_url][collection]
-                        return dateutil.parser.parse(time_string)
-        return None
+        return PollStateStore(filename).get_poll_time(poll_url, collection)
 
     @staticmethod
     def save_poll_time(filename, poll_url, collection, timestamp):
-        if timestamp is not None:
-            poll_state = dict()
-            if os.path.isfile(filename):
-                with open(filename, 'rb') as state_file:
-                    poll_state = pickle.load(state_file)
-                    if not isinstance(poll_state, dict):
-                        raise Exception('unexpected content encountered when '
-                                        'reading TAXII poll state file')
-            if poll_url not in poll_state:
-                poll_state[poll_url] = dict()
-            poll_state[poll_url][collection] = str(timestamp)
-            with open(filename, 'wb') as state_file:
-                pickle.dump(poll_state, state_file, protocol=2)
+        PollStateStore(filename).save_poll_time(poll_url, collection,
+                                                timestamp)
 
     def poll(self, poll_url, collection, subscription_id=None,
-             begin_timestamp=None, end_timestamp=None, state_file=None):
-        """Send the TAXII poll request to the server using the given URL."""
+             begin_timestamp=None, end_timestamp=None, state_file=None,
+             prefetch=0, state=None):
+        """Send the TAXII poll request to the server using the given URL.
+
+        Yields the content blocks from the poll response and from any
+        further result parts, which are obtained with fulfillment requests.
+
+        With a state_file, the end timestamp of the poll is recorded (as the
+        begin timestamp for the next poll) once all the content blocks have
+        been consumed, and a checkpoint is recorded as the content blocks
+        from each result part are consumed. If a poll is interrupted, the
+        next poll (without begin_timestamp or end_timestamp) resumes from
+        the part after the last checkpoint, provided the server still has
+        the result set.
+
+        When requests are sent on a connection pool, each response is
+        parsed as it is received, and its content blocks are yielded as
+        they arrive (except for prefetched responses, which are read in
+        full while earlier parts are consumed).
+
+        Args:
+            prefetch: the number of fulfillment requests to keep in flight
+                while content blocks from the current part are consumed
+                (0 to send each request after the previous part has been
+                consumed). Content blocks are always yielded in order.
+            state: a :py:class:`PollStateStore` (or an object with the same
+                methods) to use instead of state_file
+        """
 
         # Parse the poll_url to get the parts required by libtaxii
         url_parts = urlparse(poll_url)
@@ -181,86 +247,167 @@ class SimpleTaxiiClient(HttpClient):
         # Initialise the authentication settings
         self.setup_authentication(use_ssl)
 
-        if state_file and not begin_timestamp:
-            begin_timestamp = self.get_poll_time(
-                filename=state_file,
-                poll_url=poll_url,
-                collection=collection,
+        def _send(request, stream=True):
+            return self.send_taxii_message(
+                request=request,
+                host=url_parts.hostname,
+                path=url_parts.path,
+                port=url_parts.port,
+                stream=stream,
             )
 
-        request = self.create_poll_request(
-            collection=collection,
-            subscription_id=subscription_id,
-            begin_timestamp=begin_timestamp,
-            end_timestamp=end_timestamp,
-        )
-
-        self._logger.debug('sending poll request (url=%s, collection=%s)',
-                           poll_url, collection)
-        response = self.send_taxii_message(
-            request=request,
-            host=url_parts.hostname,
-            path=url_parts.path,
-            port=url_parts.port,
-        )
+        if state is None and state_file:
+            state = PollStateStore(state_file)
+        checkpoint = None
+        response = None
+        if state and not begin_timestamp and not end_timestamp:
+            checkpoint = state.get_checkpoint(poll_url, collection)
+            if checkpoint:
+                # (Later checkpoints keep the interrupted poll's begin time)
+                begin_timestamp = checkpoint.begin_timestamp
+                response = self._resume_poll(checkpoint, collection, _send)
+                if response is None:
+                    checkpoint = None
+            else:
+                begin_timestamp = state.get_poll_time(poll_url, collection)
 
-        first = True
-        poll_end_time = None
-        while True:
-            if not isinstance(response, PollResponse):
+        if response is None:
+            request = self.create_poll_request(
+                collection=collection,
+                subscription_id=subscription_id,
+                begin_timestamp=begin_timestamp,
+                end_timestamp=end_timestamp,
+            )
+            self._logger.debug('sending poll request (url=%s, collection=%s)',
+                               poll_url, collection)
+            response = _send(request)
+
+        poll_end_time = checkpoint.end_timestamp if checkpoint else None
+        responses = self._poll_responses(response, collection, _send,
+                                         prefetch)
+        for index, response in enumerate(responses):
+            if not self._is_poll_response(response):
                 raise Exception('didn\'t get a poll response')
 
             self._logger.debug('received poll response '
-                               '(content_blocks=%d, result_id=%s, more=%s)',
-                               len(response.content_blocks),
+                               '(result_id=%s, more=%s)',
                                response.result_id,
                                'True' if response.more else 'False')
 
             # Save end timestamp from first PollResponse
-            if first:
+            if index == 0 and checkpoint is None:
                 poll_end_time = response.inclusive_end_timestamp_label
 
-            if len(response.content_blocks) == 0:
-                if first:
+            count = 0
+            try:
+                for content_block in response.content_blocks:
+                    count += 1
+                    yield content_block
+            finally:
+                if isinstance(response, StreamingPollResponse):
+                    response.close()
+            self._logger.debug('poll response contained %d content blocks',
+                               count)
+
+            if count == 0:
+                if index == 0 and checkpoint is None:
                     self._logger.info('poll response contained '
                                       'no content blocks')
                 break
 
-            for content_block in response.content_blocks:
-                yield content_block
+            # All the content blocks in this part have been consumed
+            if state and response.more:
+                state.save_checkpoint(poll_url, collection, PollCheckpoint(
+                    result_id=response.result_id,
+                    part_number=int(response.result_part_number),
+                    begin_timestamp=begin_timestamp,
+                    end_timestamp=poll_end_time,
+                ))
 
-            if not response.more:
-                break
+        # Update the timestamp for the latest poll
+        if state and poll_end_time:
+            state.save_poll_time(poll_url, collection, poll_end_time)
 
-            # Send a fulfilment request
-            if first:
-                # Initialise fulfilment request values
-                part_number = response.result_part_number
-                result_id = response.result_id
-                first = False
+    def _resume_poll(self, checkpoint, collection, send):
+        """Requests the result part following a checkpoint.
 
-            part_number += 1
-            request = self.create_fulfillment_request(
-                collection=collection,
-                result_id=result_id,
-                part_number=part_number,
-            )
+        Returns the poll response, or None if the poll can't be resumed
+        (e.g. because the server no longer has the result set).
+        """
+        self._logger.info('resuming poll (result_id=%s, part_number=%d)',
+                          checkpoint.result_id, checkpoint.part_number + 1)
+        request = self.create_fulfillment_request(
+            collection=collection,
+            result_id=checkpoint.result_id,
+            part_number=checkpoint.part_number + 1,
+        )
+        try:
+            response = send(request)
+        except Exception:
+            response = None
+        if not self._is_poll_response(response):
+            self._logger.warning('unable to resume poll (result_id=%s), '
+                                 'polling again', checkpoint.result_id)
+            return None
+        return response
+
+    @staticmethod
+    def _is_poll_response(response):
+        return isinstance(response, (PollResponse, StreamingPollResponse))
+
+    def _poll_responses(self, response, collection, send, prefetch=0):
+        """Yields a poll response followed by the remaining result parts.
+
+        Fulfillment requests are sent (using send) for each part after the
+        part in the poll response, until a response indicates there are no
+        more parts. With prefetch > 0, that many requests are kept in
+        flight on a thread pool (and their responses are read in full),
+        starting as soon as a response indicates there are more parts, so
+        the following parts are fetched while its content blocks are
+        consumed. Requests may therefore be sent for parts beyond the last
+        part, but their responses are discarded.
+        """
+        if not self._is_poll_response(response) or not response.more:
+            yield response
+            return
+
+        result_id = response.result_id
+        part_number = response.result_part_number
 
+        def _fulfillment_request(part_number):
             self._logger.debug('sending fulfilment request '
                                '(result_id=%s, part_number=%d)',
                                result_id, part_number)
-            response = self.send_taxii_message(
-                request=request,
-                host=url_parts.hostname,
-                path=url_parts.path,
-                port=url_parts.port,
-            )
-
-        # Update the timestamp for the latest poll
-        if state_file and poll_end_time:
-            self.save_poll_time(
-                filename=state_file,
-                poll_url=poll_url,
+            return self.create_fulfillment_request(
                 collection=collection,
-                timestamp=poll_end_time,
+                result_id=result_id,
+                part_number=part_number,
             )
+
+        if prefetch <= 0:
+            yield response
+            while self._is_poll_response(response) and response.more:
+                part_number += 1
+                response = send(_fulfillment_request(part_number))
+                yield response
+            return
+
+        pool = ThreadPool(prefetch)
+        try:
+            pending = collections.deque()
+            while True:
+                # (Sent before this response's content blocks are consumed)
+                while len(pending) < prefetch:
+                    part_number += 1
+                    pending.append(pool.apply_async(
+                        send,
+                        (_fulfillment_request(part_number),),
+                        dict(stream=False),
+                    ))
+                yield response
+                if (not self._is_poll_response(response) or
+                        not response.more):
+                    break
+                response = pending.popleft().get()
+        finally:
+            pool.terminate()
@@ -0,0 +1,219 @@
+"""Concurrent polling of several TAXII collections.
+
+:py:class:`MultiCollectionPoller` polls a list of targets (poll URL,
+collection and optional subscription ID), possibly on different servers,
+at the same time, and returns the content blocks from all of them as they
+arrive. The number of concurrent requests to each host is limited.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import logging
+import threading
+
+from six.moves import queue
+from six.moves.urllib.parse import urlparse
+
+from certau.transform.pool import _put
+from .client import SimpleTaxiiClient
+from .state import PollStateStore
+from .transport import HttpConnectionPool
+
+
+PollTarget = collections.namedtuple(
+    'PollTarget',
+    ['poll_url', 'collection', 'subscription_id'],
+)
+
+
+def parse_poll_target(value):
+    """Parse a poll target from a string.
+
+    The string contains the poll URL, the collection and (optionally) a
+    subscription ID, separated by whitespace, e.g.
+    ``https://taxii.example.com/poll my_collection``.
+    """
+    parts = value.split()
+    if len(parts) not in (2, 3):
+        raise ValueError('invalid poll target (expected "URL COLLECTION '
+                         '[SUBSCRIPTION_ID]"): {}'.format(value))
+    if len(parts) == 2:
+        parts.append(None)
+    return PollTarget(*parts)
+
+
+# Marks the end of the content blocks from a target
+_DONE = object()
+
+
+class _StateUpdate(object):
+    """A poll state update, made when it is taken from the queue."""
+
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+
+    def __call__(self):
+        self.function(*self.args)
+
+
+class _QueuedState(object):
+    """A :py:class:`PollStateStore` for one target's poll whose updates are
+    queued behind the target's content blocks.
+
+    The consumer makes each update once it has taken the content blocks
+    before it, so a checkpoint (or the poll time) never covers content
+    blocks still waiting in the queue.
+    """
+
+    def __init__(self, store, put):
+        self.store = store
+        self.put = put
+
+    def get_poll_time(self, *args):
+        return self.store.get_poll_time(*args)
+
+    def get_checkpoint(self, *args):
+        return self.store.get_checkpoint(*args)
+
+    def save_poll_time(self, *args):
+        self.put(_StateUpdate(self.store.save_poll_time, *args))
+
+    def save_checkpoint(self, *args):
+        self.put(_StateUpdate(self.store.save_checkpoint, *args))
+
+    def clear_checkpoint(self, *args):
+        self.put(_StateUpdate(self.store.clear_checkpoint, *args))
+
+
+class MultiCollectionPoller(object):
+    """Polls several TAXII collections concurrently.
+
+    Each target is polled (see :py:func:`SimpleTaxiiClient.poll`) in its
+    own thread, with its own client. The clients for targets on the same
+    host share a semaphore, so at most host_limit requests are sent to a
+    host at once, and all the clients share a connection pool (unless
+    client_kwargs disables keep_alive). Poll state is kept per poll URL and
+    collection, so a single state_file can be shared by all the targets. A
+    target's poll state (its checkpoints and poll time) is only saved once
+    the content blocks before it have been consumed, i.e. when the next
+    item is requested from :py:func:`content_blocks`.
+
+    An error polling one target is logged and doesn't affect the others.
+
+    Args:
+        targets: a list of :py:class:`PollTarget` tuples
+        client_kwargs: keyword arguments for each
+            :py:class:`SimpleTaxiiClient` (e.g. credentials)
+        host_limit: the maximum number of concurrent requests to each host
+        queue_size: the maximum number of content blocks waiting to be
+            consumed (polls wait while the queue is full)
+        begin_timestamp: the begin timestamp for each poll
+        end_timestamp: the end timestamp for each poll
+        state_file: the file used to maintain poll state
+        prefetch: the number of fulfillment requests to keep in flight for
+            each poll
+
+    Attributes:
+        failed: a list of (target, exception) tuples for the targets that
+            could not be polled
+    """
+
+    def __init__(self, targets, client_kwargs=None, host_limit=2,
+                 queue_size=16, begin_timestamp=None, end_timestamp=None,
+                 state_file=None, prefetch=0):
+        self.targets = list(targets)
+        self.client_kwargs = client_kwargs or dict()
+        self.host_limit = host_limit
+        self.queue_size = queue_size
+        self.begin_timestamp = begin_timestamp
+        self.end_timestamp = end_timestamp
+        self.state_file = state_file
+        self.prefetch = prefetch
+        self.failed = []
+        self._logger = logging.getLogger()
+
+    @staticmethod
+    def _host(poll_url):
+        url_parts = urlparse(poll_url)
+        return (url_parts.hostname, url_parts.port)
+
+    def content_blocks(self):
+        """Yields (target, content_block) tuples as they are received.
+
+        Content blocks from each target are yielded in order, but content
+        blocks from different targets are interleaved.
+        """
+        stop = threading.Event()
+        blocks = queue.Queue(self.queue_size)
+        # (Opened here, so an unusable state file is reported to the caller)
+        store = PollStateStore(self.state_file) if self.state_file else None
+        semaphores = dict()
+        client_kwargs = dict(self.client_kwargs)
+        if client_kwargs.get('keep_alive', True):
+            client_kwargs.setdefault(
+                'connection_pool',
+                HttpConnectionPool(max_idle=self.host_limit),
+            )
+        threads = []
+        for target in self.targets:
+            host = self._host(target.poll_url)
+            if host not in semaphores:
+                semaphores[host] = threading.BoundedSemaphore(self.host_limit)
+            client = SimpleTaxiiClient(request_semaphore=semaphores[host],
+                                       **client_kwargs)
+            thread = threading.Thread(
+                target=self._poll_target,
+                args=(stop, blocks, client, target, store),
+            )
+            thread.daemon = True
+            threads.append(thread)
+
+        for thread in threads:
+            thread.start()
+        try:
+            remaining = len(threads)
+            while remaining:
+                try:
+                    # (with a timeout, so Python 2 can be interrupted)
+                    item = blocks.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    remaining -= 1
+                elif isinstance(item, _StateUpdate):
+                    # (The target's earlier content blocks have been
+                    # consumed)
+                    item()
+                else:
+                    yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def _poll_target(self, stop, blocks, client, target, store):
+        state = None
+        if store is not None:
+            state = _QueuedState(store, lambda item: _put(stop, blocks, item))
+        content_blocks = client.poll(
+            poll_url=target.poll_url,
+            collection=target.collection,
+            subscription_id=target.subscription_id,
+            begin_timestamp=self.begin_timestamp,
+            end_timestamp=self.end_timestamp,
+            prefetch=self.prefetch,
+            state=state,
+        )
+        try:
+            for content_block in content_blocks:
+                if not _put(stop, blocks, (target, content_block)):
+                    return
+        except Exception as e:
+            self._logger.error('error polling %s (collection=%s): %s',
+                               target.poll_url, target.collection, e)
+            self.failed.append((target, e))
+        finally:
+            content_blocks.close()
+        _put(stop, blocks, _DONE)
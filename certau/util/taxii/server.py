@@ -0,0 +1,273 @@
+"""A minimal in-process TAXII 1.1 poll service.
+
+:py:class:`TaxiiPollServer` answers TAXII 1.1 poll and poll fulfillment
+requests from a list of content blocks, split into result parts. It is
+intended as a local stand-in for a real TAXII server when testing and
+benchmarking the client, and has no authentication or persistence.
+
+Latency and errors (TAXII status messages or HTTP errors) can be injected
+to exercise the client's handling of slow or failing servers, and
+:py:func:`repeated_blocks` builds content blocks of a given count and size
+from a sample package.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import gzip
+import threading
+import time
+
+import dateutil.tz
+import six
+from six.moves import BaseHTTPServer, socketserver
+
+from libtaxii.constants import CB_STIX_XML_111, ST_NOT_FOUND
+from libtaxii.constants import VID_TAXII_HTTP_10, VID_TAXII_SERVICES_11
+from libtaxii.constants import VID_TAXII_XML_11
+from libtaxii.messages_11 import ContentBlock, PollFulfillmentRequest
+from libtaxii.messages_11 import PollRequest, PollResponse, StatusMessage
+from libtaxii.messages_11 import generate_message_id, get_message_from_xml
+
+
+class TaxiiPollServer(object):
+    """Serves content blocks in response to TAXII 1.1 poll requests.
+
+    The content blocks are returned in result parts of page_size blocks.
+    The response to a poll request contains the first part, and the
+    remaining parts are returned in response to fulfillment requests.
+
+    Args:
+        content_blocks: a list of content block contents (STIX packages)
+        page_size: the number of content blocks in each result part
+        latency: a delay (in seconds) added before each response
+        errors: a dictionary mapping result part numbers to an error to
+            return instead of that part - either a TAXII status type (e.g.
+            ST_FAILURE), returned in a status message, or an HTTP status
+            code (an int)
+        host: the address to listen on
+        port: the port to listen on (by default an unused port is chosen)
+        path: the path of the poll service
+        compress: gzip responses for clients that accept it
+
+    Attributes:
+        requests: a list of (message_type, part_number) tuples for the
+            requests received, where part_number is None for a poll
+            request
+        blocks_sent: the number of content blocks sent
+        bytes_sent: the total size of the content blocks sent
+        max_concurrent_requests: the largest number of requests handled
+            at the same time
+        connections: the number of connections accepted (connections are
+            kept open for further requests)
+    """
+
+    def __init__(self, content_blocks, page_size=10, latency=0.0,
+                 errors=None, host='127.0.0.1', port=0, path='/taxii-data',
+                 compress=False):
+        self.content_blocks = list(content_blocks)
+        self.page_size = page_size
+        self.latency = latency
+        self.errors = dict(errors or {})
+        self.host = host
+        self.port = port
+        self.path = path
+        self.compress = compress
+        self._lock = threading.Lock()
+        self.reset()
+        self._httpd = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def poll_url(self):
+        return 'http://{}:{}{}'.format(self.host, self.port, self.path)
+
+    @property
+    def part_count(self):
+        """The number of result parts needed for the content blocks."""
+        return max(1, -(-len(self.content_blocks) // self.page_size))
+
+    def start(self):
+        """Start serving requests (in a background thread)."""
+        handler = type('Handler', (_TaxiiRequestHandler,), dict(server_=self))
+        self._httpd = _ThreadingHTTPServer((self.host, self.port), handler)
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+
+    def reset(self):
+        """Clear the recorded requests and the sent block counts."""
+        self.requests = []
+        self.blocks_sent = 0
+        self.bytes_sent = 0
+        self.max_concurrent_requests = 0
+        self.connections = 0
+        self._concurrent_requests = 0
+
+    def response_for(self, request):
+        """Returns the response for a request message.
+
+        The response is a TAXII message, or an HTTP status code if an HTTP
+        error has been injected for the requested part.
+        """
+        if isinstance(request, PollFulfillmentRequest):
+            part_number = int(request.result_part_number)
+            result_id = request.result_id
+            self.requests.append((request.message_type, part_number))
+        elif isinstance(request, PollRequest):
+            part_number = 1
+            result_id = generate_message_id()
+            self.requests.append((request.message_type, None))
+        else:
+            raise ValueError('unexpected request message')
+
+        error = self.errors.get(part_number)
+        if isinstance(error, int):
+            return error
+        elif error is not None:
+            return self._status_message(request, error, 'injected error')
+
+        if part_number > self.part_count:
+            return self._status_message(request, ST_NOT_FOUND,
+                                        'no such result part')
+
+        start = (part_number - 1) * self.page_size
+        contents = self.content_blocks[start:start + self.page_size]
+        with self._lock:
+            self.blocks_sent += len(contents)
+            self.bytes_sent += sum(len(content) for content in contents)
+
+        content_blocks = [
+            ContentBlock(CB_STIX_XML_111, content) for content in contents
+        ]
+        return PollResponse(
+            message_id=generate_message_id(),
+            in_response_to=request.message_id,
+            collection_name=request.collection_name,
+            more=part_number < self.part_count,
+            result_id=result_id,
+            result_part_number=part_number,
+            inclusive_end_timestamp_label=datetime.datetime.now(
+                dateutil.tz.tzutc(),
+            ),
+            content_blocks=content_blocks,
+        )
+
+    @staticmethod
+    def _status_message(request, status_type, message):
+        return StatusMessage(
+            message_id=generate_message_id(),
+            in_response_to=request.message_id,
+            status_type=status_type,
+            message=message,
+        )
+
+
+def repeated_blocks(document, count, block_size=0):
+    """Returns count content blocks containing copies of a package.
+
+    Each copy has an XML comment appended to its root element, which makes
+    the copies distinct (so they aren't served from a package cache) and
+    pads them to at least block_size characters.
+
+    Args:
+        document: the package document (text or bytes)
+        count: the number of content blocks
+        block_size: the minimum size of each content block
+    """
+    binary = isinstance(document, six.binary_type)
+    if binary:
+        document = document.decode('utf-8')
+    head, tag, tail = document.rpartition('</')
+    if not tag:
+        raise ValueError('no closing tag found in package')
+
+    blocks = []
+    for i in range(count):
+        comment = '<!-- block {} -->'.format(i)
+        padding = block_size - len(document) - len(comment)
+        if padding > 0:
+            comment = '<!-- block {} {} -->'.format(i, 'x' * padding)
+        block = head + comment + tag + tail
+        blocks.append(block.encode('utf-8') if binary else block)
+    return blocks
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _TaxiiRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+    server_ = None
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server_._lock:
+            self.server_.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = get_message_from_xml(self.rfile.read(length))
+        server = self.server_
+        with server._lock:
+            server._concurrent_requests += 1
+            server.max_concurrent_requests = max(
+                server.max_concurrent_requests,
+                server._concurrent_requests,
+            )
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            response = server.response_for(request)
+        finally:
+            with server._lock:
+                server._concurrent_requests -= 1
+        if isinstance(response, int):
+            self.send_error(response)
+            return
+        body = response.to_xml()
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        compress = server.compress and 'gzip' in accept_encoding
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        if compress:
+            body = _gzip(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-TAXII-Content-Type', VID_TAXII_XML_11)
+        self.send_header('X-TAXII-Protocol', VID_TAXII_HTTP_10)
+        self.send_header('X-TAXII-Services', VID_TAXII_SERVICES_11)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _gzip(data):
+    buffer_ = six.BytesIO()
+    with gzip.GzipFile(fileobj=buffer_, mode='wb') as file_:
+        file_.write(data)
+    return buffer_.getvalue()
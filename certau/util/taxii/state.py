@@ -0,0 +1,219 @@
+"""Persistent state for TAXII polls.
+
+:py:class:`PollStateStore` records, for each poll URL and collection, the
+end timestamp of the last complete poll (the begin timestamp for the next
+poll) and a checkpoint after each result part of a poll in progress, so an
+interrupted poll can be resumed from the last completed part rather than
+starting again.
+
+The state is kept in an SQLite database. Each update is a single small
+transaction, so the file is never left partially written, and polls for
+different collections (in separate threads or processes) only hold the
+database lock for the duration of an update.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import logging
+import os
+import pickle
+import sqlite3
+import tempfile
+
+import dateutil.parser
+
+
+PollCheckpoint = collections.namedtuple(
+    'PollCheckpoint',
+    ['result_id', 'part_number', 'begin_timestamp', 'end_timestamp'],
+)
+"""The progress of an incomplete poll.
+
+Attributes:
+    result_id: the result ID (used to request further result parts)
+    part_number: the last result part that was completely processed
+    begin_timestamp: the begin timestamp of the poll request
+    end_timestamp: the end timestamp of the poll (from the first response)
+"""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS poll_time (
+    poll_url TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (poll_url, collection)
+);
+CREATE TABLE IF NOT EXISTS poll_checkpoint (
+    poll_url TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    result_id TEXT NOT NULL,
+    part_number INTEGER NOT NULL,
+    begin_timestamp TEXT,
+    end_timestamp TEXT,
+    PRIMARY KEY (poll_url, collection)
+);
+"""
+
+_SQLITE_HEADER = b'SQLite format 3\0'
+
+
+def _timestamp(value):
+    return None if value is None else dateutil.parser.parse(value)
+
+
+def _string(timestamp):
+    return None if timestamp is None else str(timestamp)
+
+
+class PollStateStore(object):
+    """Stores poll times and checkpoints in an SQLite database.
+
+    A state file written by earlier versions (a pickled dictionary of poll
+    times) is converted to the new format when it is first opened.
+
+    Args:
+        filename: the state file (created if it doesn't exist)
+        timeout: how long (in seconds) to wait for another process or
+            thread updating the state
+    """
+
+    def __init__(self, filename, timeout=30.0):
+        self.filename = os.path.abspath(filename)
+        self.timeout = timeout
+        self._logger = logging.getLogger()
+        if self._is_legacy_file():
+            self._convert_legacy_file()
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+
+    def _connect(self, filename=None):
+        connection = sqlite3.connect(filename or self.filename,
+                                     timeout=self.timeout)
+        # Readers don't block the writer (or vice versa) in WAL mode
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _Connection(connection)
+
+    def _is_legacy_file(self):
+        try:
+            with open(self.filename, 'rb') as file_:
+                header = file_.read(len(_SQLITE_HEADER))
+        except (IOError, OSError):
+            return False
+        return bool(header) and header != _SQLITE_HEADER
+
+    def _convert_legacy_file(self):
+        with open(self.filename, 'rb') as file_:
+            poll_state = pickle.load(file_)
+        if not isinstance(poll_state, dict):
+            raise Exception('unexpected content encountered when '
+                            'reading TAXII poll state file')
+
+        # Write the new file alongside the old one, then replace it
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.filename),
+            suffix='.tmp',
+        )
+        os.close(fd)
+        try:
+            with self._connect(temp_path) as connection:
+                connection.executescript(_SCHEMA)
+                connection.executemany(
+                    'INSERT INTO poll_time VALUES (?, ?, ?)',
+                    [
+                        (poll_url, collection, timestamp)
+                        for poll_url, times in poll_state.items()
+                        for collection, timestamp in times.items()
+                    ],
+                )
+            if os.name == 'nt':
+                os.remove(self.filename)
+            os.rename(temp_path, self.filename)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        self._logger.info('converted TAXII poll state file (%s)',
+                          self.filename)
+
+    def get_poll_time(self, poll_url, collection):
+        """Returns the end timestamp of the last complete poll (or None)."""
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT timestamp FROM poll_time '
+                'WHERE poll_url = ? AND collection = ?',
+                (poll_url, collection),
+            ).fetchone()
+        return None if row is None else _timestamp(row[0])
+
+    def save_poll_time(self, poll_url, collection, timestamp):
+        """Records a complete poll, clearing any checkpoint."""
+        if timestamp is None:
+            return
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO poll_time VALUES (?, ?, ?)',
+                (poll_url, collection, _string(timestamp)),
+            )
+            connection.execute(
+                'DELETE FROM poll_checkpoint '
+                'WHERE poll_url = ? AND collection = ?',
+                (poll_url, collection),
+            )
+
+    def get_checkpoint(self, poll_url, collection):
+        """Returns the :py:class:`PollCheckpoint` for an incomplete poll
+        (or None)."""
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT result_id, part_number, begin_timestamp, '
+                'end_timestamp FROM poll_checkpoint '
+                'WHERE poll_url = ? AND collection = ?',
+                (poll_url, collection),
+            ).fetchone()
+        if row is None:
+            return None
+        result_id, part_number, begin_timestamp, end_timestamp = row
+        return PollCheckpoint(result_id, part_number,
+                              _timestamp(begin_timestamp),
+                              _timestamp(end_timestamp))
+
+    def save_checkpoint(self, poll_url, collection, checkpoint):
+        """Records the progress (a :py:class:`PollCheckpoint`) of a poll."""
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO poll_checkpoint '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (poll_url, collection, checkpoint.result_id,
+                 checkpoint.part_number,
+                 _string(checkpoint.begin_timestamp),
+                 _string(checkpoint.end_timestamp)),
+            )
+
+    def clear_checkpoint(self, poll_url, collection):
+        """Removes the checkpoint for a poll."""
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM poll_checkpoint '
+                'WHERE poll_url = ? AND collection = ?',
+                (poll_url, collection),
+            )
+
+
+class _Connection(object):
+    """Commits (or rolls back) and closes an SQLite connection on exit."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __enter__(self):
+        return self._connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._connection.commit()
+            else:
+                self._connection.rollback()
+        finally:
+            self._connection.close()
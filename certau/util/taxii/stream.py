@@ -0,0 +1,181 @@
+"""Incremental parsing of TAXII poll responses.
+
+libtaxii parses a whole poll response (and so holds all its content blocks
+in memory) before any of the content blocks can be used.
+:py:class:`StreamingPollResponse` instead parses the response body as it
+is received (from an :py:class:`HttpResponseStream`), returning each
+content block as soon as it is complete. Content blocks are detached from
+the response as they are returned, so memory use is bounded by the size of
+the largest content block rather than the size of the response.
+"""
+
+from __future__ import absolute_import
+
+import copy
+from email.message import Message
+
+from lxml import etree
+
+from libtaxii import get_message_from_http_response
+from libtaxii.constants import MSG_POLL_RESPONSE, VID_TAXII_XML_11
+from libtaxii.messages_11 import ContentBlock, PollResponse
+from libtaxii.messages_11 import get_message_from_xml, ns_map
+
+
+_POLL_RESPONSE = '{{{}}}{}'.format(ns_map['taxii_11'], MSG_POLL_RESPONSE)
+_CONTENT_BLOCK = '{{{}}}{}'.format(ns_map['taxii_11'], ContentBlock.NAME)
+
+
+def get_message_from_http_stream(stream, in_response_to):
+    """Returns the TAXII message in a response.
+
+    Poll responses are returned as a :py:class:`StreamingPollResponse`, so
+    their content blocks are parsed as they are read. Other messages (e.g.
+    status messages) are read in full and parsed by libtaxii.
+
+    Args:
+        stream: an :py:class:`HttpResponseStream`
+        in_response_to: the message ID of the request
+    """
+    taxii_content_type = stream.getheader('X-TAXII-Content-Type')
+    if (not 200 <= stream.status < 300 or
+            taxii_content_type != VID_TAXII_XML_11):
+        return get_message_from_http_response(stream.response(),
+                                              in_response_to)
+
+    response = StreamingPollResponse(stream)
+    if response.header is not None:
+        return response
+
+    # Not a poll response, so parse it as for libtaxii
+    charset = content_charset(stream.getheader('Content-Type'))
+    with stream:
+        data = response.data + b''.join(iter(stream.read, b''))
+    return get_message_from_xml(data, charset)
+
+
+def content_charset(content_type, default='utf-8'):
+    """Returns the charset in a Content-Type header (or default)."""
+    message = Message()
+    message['Content-Type'] = content_type or 'application/xml'
+    return message.get_content_charset(default)
+
+
+class StreamingPollResponse(object):
+    """A TAXII 1.1 poll response read incrementally.
+
+    The response's attributes (other than content_blocks) are those of a
+    libtaxii :py:class:`PollResponse`, and are available once the response
+    header (the elements before the first content block) has been parsed.
+    content_blocks can only be iterated once, and returns ContentBlock
+    objects as they are received. The response is closed when all the
+    content blocks have been returned.
+
+    Args:
+        stream: a file-like object with the response body (whose read()
+            method returns bytes)
+        chunk_size: the number of bytes read from the stream at a time
+
+    Attributes:
+        header: a PollResponse with the response's attributes but no
+            content blocks (or None if the response isn't a poll response,
+            in which case data is the part of the response read so far)
+    """
+
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.data = b''
+        self._parser = etree.XMLPullParser(
+            events=('start', 'end'),
+            no_network=True,
+            resolve_entities=False,
+        )
+        self._events = self._read_events()
+        self._root = None
+        self._on_close = []
+        try:
+            self.header = self._read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def __getattr__(self, name):
+        # Response attributes (e.g. more, result_id) come from the header
+        header = self.__dict__.get('header')
+        if header is None or name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(header, name)
+
+    def _read_events(self):
+        # Yields (event, element) tuples, reading the stream as needed
+        while True:
+            for event in self._parser.read_events():
+                yield event
+            if self.stream is None:
+                return
+            data = self.stream.read(self.chunk_size)
+            if self._root is None:
+                # Kept in case this isn't a poll response
+                self.data += data
+            if data:
+                self._parser.feed(data)
+            else:
+                self._parser.close()
+                self._close_stream()
+
+    def _read_header(self):
+        for event, element in self._events:
+            if self._root is None:
+                if element.tag != _POLL_RESPONSE:
+                    return None
+                self._root = element
+                self.data = b''
+            elif ((event == 'start' and element.tag == _CONTENT_BLOCK and
+                   element.getparent() is self._root) or
+                  (event == 'end' and element is self._root)):
+                break
+
+        # Parse a copy of the header with libtaxii
+        header = etree.Element(self._root.tag, self._root.attrib,
+                               nsmap=self._root.nsmap)
+        for child in self._root:
+            if child.tag != _CONTENT_BLOCK:
+                header.append(copy.deepcopy(child))
+        return PollResponse.from_etree(header)
+
+    @property
+    def content_blocks(self):
+        """Yields each content block as it is received."""
+        try:
+            for event, element in self._events:
+                if (event != 'end' or element.tag != _CONTENT_BLOCK or
+                        element.getparent() is not self._root):
+                    continue
+                content_block = ContentBlock.from_etree(element)
+                if content_block.content_is_xml:
+                    # Detach the content from the response
+                    content = content_block._content
+                    content.getparent().remove(content)
+                self._root.remove(element)
+                yield content_block
+        finally:
+            self.close()
+
+    def on_close(self, function):
+        """Calls function (with no arguments) when the response is
+        closed."""
+        self._on_close.append(function)
+
+    def _close_stream(self):
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            stream.close()
+
+    def close(self):
+        """Closes the stream (if the response hasn't been read in full)."""
+        self._close_stream()
+        self._events.close()
+        on_close, self._on_close = self._on_close, []
+        for function in on_close:
+            function()
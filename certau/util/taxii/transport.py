@@ -0,0 +1,338 @@
+"""Persistent HTTP connections for TAXII clients.
+
+libtaxii's :py:func:`HttpClient.call_taxii_service2` opens a new connection
+(and, for HTTPS, performs a new TLS handshake) for every request, including
+each poll fulfillment request. :py:class:`HttpConnectionPool` sends the same
+requests over keep-alive connections, which are kept for reuse by later
+requests to the same server, and asks the server to compress its responses.
+
+Responses are returned as the same urllib objects as libtaxii returns, so
+they can be passed to :py:func:`libtaxii.get_message_from_http_response`.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import logging
+import socket
+import threading
+import zlib
+
+import six
+from six.moves import http_client
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import getproxies, proxy_bypass
+from six.moves.urllib.response import addinfourl
+
+from libtaxii.clients import HttpClient, VerifiableHTTPSConnection
+from libtaxii.constants import VID_TAXII_HTTP_10, VID_TAXII_HTTPS_10
+from libtaxii.constants import VID_TAXII_SERVICES_11, VID_TAXII_XML_11
+
+
+_ACCEPT_ENCODING = 'gzip, deflate'
+
+
+class HttpConnectionPool(object):
+    """Keeps HTTP(S) connections open for reuse by TAXII clients.
+
+    Requests are sent with the headers and authentication that libtaxii
+    would use for the client (see
+    :py:func:`SimpleTaxiiClient.setup_authentication`). Once a response has
+    been read its connection is returned to the pool, unless the server
+    closed it, and is used for the next request to the same server (with
+    the same TLS settings). A request on a reused connection that fails
+    (e.g. because the server has since closed the connection) is retried
+    once on a new connection.
+
+    The pool is thread-safe, and may be shared by several clients.
+
+    Args:
+        max_idle: the maximum number of idle connections kept for each
+            server
+        compress: ask servers to compress responses (with gzip or deflate)
+
+    Attributes:
+        connections_opened: the number of connections opened
+        connections_reused: the number of requests sent on a connection
+            that had already been used
+        compressed_responses: the number of compressed responses received
+        bytes_received: the total size of the response bodies received
+            (before decompression)
+    """
+
+    def __init__(self, max_idle=4, compress=True):
+        self.max_idle = max_idle
+        self.compress = compress
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.compressed_responses = 0
+        self.bytes_received = 0
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger()
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            connections = [connection for idle in self._idle.values()
+                           for connection in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+    @staticmethod
+    def uses_proxy(client, host):
+        """Is a request from client to host sent through a proxy?
+
+        The pool connects to servers directly, so clients should send these
+        requests with libtaxii instead.
+        """
+        if client.proxy_string is not None:
+            return client.proxy_string != 'noproxy'
+        scheme = 'https' if client.use_https else 'http'
+        return scheme in getproxies() and not proxy_bypass(host)
+
+    @staticmethod
+    def _tls_settings(client):
+        if not client.use_https:
+            return None
+        if client.auth_type in (HttpClient.AUTH_CERT,
+                                HttpClient.AUTH_CERT_BASIC):
+            credentials = client.auth_credentials
+            key_file = credentials['key_file']
+            cert_file = credentials['cert_file']
+            key_password = credentials.get('key_password')
+        else:
+            key_file = cert_file = key_password = None
+        return (key_file, cert_file, key_password, client.verify_server,
+                client.ca_file)
+
+    def _connect(self, host, port, tls_settings):
+        if tls_settings is None:
+            return http_client.HTTPConnection(host, port)
+        key_file, cert_file, key_password, verify_server, ca_file = (
+            tls_settings)
+        return VerifiableHTTPSConnection(
+            host,
+            port,
+            key_file=key_file,
+            cert_file=cert_file,
+            key_password=key_password,
+            verify_server=verify_server,
+            ca_certs=ca_file,
+        )
+
+    def _checkout(self, key, new=False):
+        # Returns an idle connection for key (or None)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle and not new:
+                self.connections_reused += 1
+                return idle.pop()
+            self.connections_opened += 1
+        return None
+
+    def _checkin(self, key, connection):
+        # Returns a connection (whose response has been read) to the pool
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _headers(self, client, user_agent):
+        # The headers libtaxii sends with a TAXII 1.1 XML message
+        headers = {
+            'User-Agent': user_agent,
+            HttpClient.HEADER_X_TAXII_CONTENT_TYPE: VID_TAXII_XML_11,
+            HttpClient.HEADER_CONTENT_TYPE: 'application/xml',
+            HttpClient.HEADER_ACCEPT: 'application/xml',
+            HttpClient.HEADER_X_TAXII_ACCEPT: VID_TAXII_XML_11,
+            HttpClient.HEADER_X_TAXII_SERVICES: VID_TAXII_SERVICES_11,
+            HttpClient.HEADER_X_TAXII_PROTOCOL: (
+                VID_TAXII_HTTPS_10 if client.use_https else VID_TAXII_HTTP_10
+            ),
+        }
+        if client.auth_type in (HttpClient.AUTH_BASIC,
+                                HttpClient.AUTH_CERT_BASIC):
+            headers['Authorization'] = client.basic_auth_header
+        if self.compress:
+            headers['Accept-Encoding'] = _ACCEPT_ENCODING
+        return headers
+
+    def post(self, client, host, path, post_data, port=None,
+             user_agent=None):
+        """Send a TAXII 1.1 XML message using the client's settings.
+
+        Returns a urllib response, or an HTTPError for an HTTP error status
+        (as for :py:func:`HttpClient.call_taxii_service2`).
+
+        Args:
+            client: the :py:class:`HttpClient` sending the message (with
+                its authentication already set up)
+            host: the server's host name
+            path: the path of the TAXII service
+            post_data: the message XML
+            port: the server's port (by default, 443 or 80)
+            user_agent: the User-Agent header
+        """
+        return self.open(client, host, path, post_data, port,
+                         user_agent).response()
+
+    def open(self, client, host, path, post_data, port=None,
+             user_agent=None):
+        """Send a TAXII 1.1 XML message, without reading the response body.
+
+        Takes the same arguments as :py:func:`post`, and returns an
+        :py:class:`HttpResponseStream` from which the (decompressed) body
+        can be read as it arrives.
+        """
+        if port is None:
+            port = 443 if client.use_https else 80
+        headers = self._headers(client,
+                                user_agent or 'libtaxii.httpclient')
+        tls_settings = self._tls_settings(client)
+        key = (host, port, tls_settings)
+        if isinstance(post_data, six.text_type):
+            post_data = post_data.encode('utf-8')
+
+        connection = self._checkout(key)
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = self._connect(host, port, tls_settings)
+            try:
+                connection.request('POST', path, post_data, headers)
+                response = connection.getresponse()
+                break
+            except (http_client.HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                self._logger.debug('connection to %s:%s was closed, '
+                                   'reconnecting', host, port)
+                connection = self._checkout(key, new=True)
+                reused = False
+
+        url = '{}://{}:{}{}'.format(
+            'https' if client.use_https else 'http', host, port, path)
+        return HttpResponseStream(self, key, connection, response, url)
+
+    def _received(self, size, compressed=False):
+        with self._lock:
+            self.bytes_received += size
+            if compressed:
+                self.compressed_responses += 1
+
+
+class HttpResponseStream(object):
+    """The response to a request sent by :py:class:`HttpConnectionPool`.
+
+    The body is decompressed as it is read. The connection is returned to
+    the pool once the whole body has been read, or closed if the response
+    is closed before then.
+
+    Attributes:
+        status: the HTTP status code
+        reason: the HTTP reason phrase
+        headers: the response headers
+        url: the request URL
+    """
+
+    def __init__(self, pool, key, connection, response, url):
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self.url = url
+        self._pool = pool
+        self._key = key
+        self._connection = connection
+        self._response = response
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        self._decoder = _Decoder(encoding)
+        if self._decoder.compressed:
+            pool._received(0, compressed=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, size=65536):
+        """Returns up to size bytes of the body (or b'' at the end)."""
+        while self._connection is not None:
+            data = self._response.read(size)
+            if not data:
+                data = self._decoder.flush()
+                self._release()
+                return data
+            self._pool._received(len(data))
+            data = self._decoder.decode(data)
+            if data:
+                return data
+        return b''
+
+    def response(self):
+        """Reads the rest of the body, returning a urllib response (or an
+        HTTPError for an HTTP error status)."""
+        with self:
+            data = b''.join(iter(self.read, b''))
+        if not 200 <= self.status < 300:
+            return HTTPError(self.url, self.status, self.reason,
+                             self.headers, six.BytesIO(data))
+        return addinfourl(six.BytesIO(data), self.headers, self.url,
+                          self.status)
+
+    def _release(self):
+        # The whole body has been read, so the connection can be reused
+        if self._response.will_close:
+            self._connection.close()
+        else:
+            self._pool._checkin(self._key, self._connection)
+        self._connection = None
+
+    def close(self):
+        """Close the response, closing the connection if the body hasn't
+        been read."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._response.close()
+
+
+class _Decoder(object):
+    """Decompresses a response body with a Content-Encoding."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.compressed = encoding in ('gzip', 'x-gzip', 'deflate')
+        if encoding in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decompressor = zlib.decompressobj()
+        else:
+            self._decompressor = None
+        self._started = False
+
+    def decode(self, data):
+        if self._decompressor is None:
+            return data
+        started, self._started = self._started, True
+        try:
+            return self._decompressor.decompress(data)
+        except zlib.error:
+            if started or self.encoding != 'deflate':
+                raise
+            # Some servers send a raw deflate stream (without zlib headers)
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decompressor.decompress(data)
+
+    def flush(self):
+        if self._decompressor is None:
+            return b''
+        return self._decompressor.flush()
@@ -27,6 +27,7 @@ setup(
     packages={
         'certau',
         'certau/util',
+        'certau/util/misp',
         'certau/util/stix',
         'certau/util/taxii',
         'certau/scripts',
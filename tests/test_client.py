@@ -3,13 +3,25 @@
 The SimpleTaxiiClient encapsulates the libtaxii.clients.HttpClient,
 configuring it using the passed in configargparse instance.
 """
+import pickle
+import time
+
+import dateutil.parser
 import httpretty
 import libtaxii.clients
+import libtaxii.constants
 import pytest
+import six
 import xmltodict
+from lxml import etree
 
 import certau.source
 import certau.util.taxii.client
+from certau.util.taxii.poller import MultiCollectionPoller, PollTarget
+from certau.util.taxii.server import TaxiiPollServer, repeated_blocks
+from certau.util.taxii.state import PollStateStore
+from certau.util.taxii.stream import StreamingPollResponse, content_charset
+from certau.util.taxii.transport import HttpConnectionPool
 
 
 def test_client_creation():
@@ -211,16 +223,16 @@ def test_send_poll_request():
     headers = {k.lower(): v for k, v in request.headers.items()}
     del headers['content-length']
 
-    # Check we have the correct request headers
+    # Check we have the correct request headers (the connection is kept
+    # open and compressed responses are accepted)
     assert headers == {
         'x-taxii-accept': 'urn:taxii.mitre.org:message:xml:1.1',
         'x-taxii-protocol': 'urn:taxii.mitre.org:protocol:http:1.0',
-        'accept-encoding': 'identity',
+        'accept-encoding': 'gzip, deflate',
         'user-agent': 'cti-toolkit v1.1.1.dev1 (libtaxii)',
-        'connection': 'close',
         'accept': 'application/xml',
         'x-taxii-content-type': 'urn:taxii.mitre.org:message:xml:1.1',
-        'host': 'example.com:80',
+        'host': 'example.com',
         'x-taxii-services': 'urn:taxii.mitre.org:services:1.1',
         'content-type': 'application/xml',
         'authorization': 'Basic dXNlcjpwYXNz'
@@ -247,3 +259,381 @@ def test_send_poll_request():
             u'taxii_11:Exclusive_Begin_Timestamp': u'2015-12-30T10:13:05+10:00'
         }
     }
+
+
+def test_poll_prefetch():
+    """Test that polling with prefetching returns the same content blocks,
+    in the same order, as sequential polling, with fulfillment requests
+    sent concurrently.
+    """
+    contents = ['<block {} />'.format(i) for i in range(23)]
+
+    with TaxiiPollServer(contents, page_size=5) as server:
+        taxii_client = certau.util.taxii.client.SimpleTaxiiClient()
+        content_blocks = taxii_client.poll(
+            poll_url=server.poll_url,
+            collection='my_collection',
+        )
+        assert [cb.content for cb in content_blocks] == contents
+        assert [part for _, part in server.requests] == [None, 2, 3, 4, 5]
+
+    with TaxiiPollServer(contents, page_size=5, latency=0.2) as server:
+        taxii_client = certau.util.taxii.client.SimpleTaxiiClient()
+        start = time.time()
+        content_blocks = taxii_client.poll(
+            poll_url=server.poll_url,
+            collection='my_collection',
+            prefetch=4,
+        )
+        assert [cb.content for cb in content_blocks] == contents
+        elapsed = time.time() - start
+
+        # Parts 2-5 were requested at once, and parts beyond the last part
+        # may also have been requested
+        parts = sorted(part for _, part in server.requests[1:])
+        assert parts[:4] == [2, 3, 4, 5]
+        assert elapsed < 5 * 0.2
+
+        # Parts 2-5 are requested before the first part's content blocks
+        # are consumed
+        time.sleep(0.3)
+        server.reset()
+        content_blocks = taxii_client.poll(
+            poll_url=server.poll_url,
+            collection='my_collection',
+            prefetch=4,
+        )
+        assert next(content_blocks).content == contents[0]
+        time.sleep(0.3)
+        assert sorted(part for _, part in server.requests if part) == \
+            [2, 3, 4, 5]
+        content_blocks.close()
+
+
+def test_poll_errors():
+    """Test that errors injected by the local TAXII server end the poll,
+    after the content blocks from the earlier parts have been returned.
+    """
+    with open('tests/CA-TEST-STIX.xml') as file_:
+        document = file_.read()
+    contents = repeated_blocks(document, 6, block_size=20000)
+    assert len(set(contents)) == 6
+    assert all(len(content) >= 20000 for content in contents)
+
+    for error in (libtaxii.constants.ST_FAILURE, 500):
+        with TaxiiPollServer(contents, page_size=2,
+                             errors={2: error}) as server:
+            taxii_client = certau.util.taxii.client.SimpleTaxiiClient()
+            content_blocks = taxii_client.poll(
+                poll_url=server.poll_url,
+                collection='my_collection',
+            )
+            received = []
+            with pytest.raises(Exception):
+                for content_block in content_blocks:
+                    received.append(content_block)
+            assert len(received) == 2
+            assert server.blocks_sent == 2
+
+
+def test_content_block_source_item_pickle():
+    """Test that source items for content blocks can be pickled (to be
+    handed to worker processes).
+    """
+    with open('tests/CA-TEST-STIX.xml') as file_:
+        contents = [file_.read()]
+
+    with TaxiiPollServer(contents) as server:
+        taxii_client = certau.util.taxii.client.SimpleTaxiiClient()
+        source = certau.source.TaxiiContentBlockSource(
+            content_blocks=taxii_client.poll(
+                poll_url=server.poll_url,
+                collection='my_collection',
+            ),
+            collection='my_collection',
+        )
+        source_item = next(source.source_items())
+
+    copy = pickle.loads(pickle.dumps(source_item))
+    assert copy.read() == source_item.read()
+    assert copy.stix_package.stix_header.title == 'CA-TEST-STIX'
+
+
+def test_poll_resume(tmpdir):
+    """Test that an interrupted poll is resumed from the last result part
+    that was completely consumed.
+    """
+    state_file = str(tmpdir.join('state'))
+    contents = ['<block {} />'.format(i) for i in range(10)]
+    poll_kwargs = dict(collection='my_collection', state_file=state_file)
+
+    with TaxiiPollServer(contents, page_size=2,
+                         errors={4: libtaxii.constants.ST_FAILURE}) as server:
+        taxii_client = certau.util.taxii.client.SimpleTaxiiClient()
+        received = []
+        with pytest.raises(Exception):
+            for content_block in taxii_client.poll(poll_url=server.poll_url,
+                                                   **poll_kwargs):
+                received.append(content_block.content)
+        assert received == contents[:6]
+
+        store = PollStateStore(state_file)
+        checkpoint = store.get_checkpoint(server.poll_url, 'my_collection')
+        assert checkpoint.part_number == 3
+        assert store.get_poll_time(server.poll_url, 'my_collection') is None
+
+        # The next poll continues from part 4
+        server.errors.clear()
+        server.reset()
+        received = [content_block.content for content_block in
+                    taxii_client.poll(poll_url=server.poll_url, **poll_kwargs)]
+        assert received == contents[6:]
+        assert [part for _, part in server.requests] == [4, 5]
+        assert store.get_checkpoint(server.poll_url, 'my_collection') is None
+        assert store.get_poll_time(server.poll_url, 'my_collection') == \
+            checkpoint.end_timestamp
+
+        # A poll that can't be resumed is started again
+        store.save_checkpoint(server.poll_url, 'my_collection',
+                              checkpoint._replace(part_number=10))
+        server.reset()
+        received = [content_block.content for content_block in
+                    taxii_client.poll(poll_url=server.poll_url, **poll_kwargs)]
+        assert received == contents
+        assert [part for _, part in server.requests] == [11, None, 2, 3, 4, 5]
+
+
+def test_poll_resume_twice(tmpdir):
+    """Test that a resumed poll that is interrupted again keeps the begin
+    timestamp of the original poll.
+    """
+    state_file = str(tmpdir.join('state'))
+    contents = ['<block {} />'.format(i) for i in range(10)]
+    poll_kwargs = dict(collection='my_collection', state_file=state_file)
+    store = PollStateStore(state_file)
+
+    with TaxiiPollServer(contents, page_size=2,
+                         errors={3: libtaxii.constants.ST_FAILURE}) as server:
+        begin_timestamp = dateutil.parser.parse('2017-01-01T00:00:00+00:00')
+        store.save_poll_time(server.poll_url, 'my_collection',
+                             begin_timestamp)
+        taxii_client = certau.util.taxii.client.SimpleTaxiiClient()
+
+        def poll(received):
+            with pytest.raises(Exception):
+                for content_block in taxii_client.poll(
+                        poll_url=server.poll_url, **poll_kwargs):
+                    received.append(content_block.content)
+
+        received = []
+        poll(received)
+        checkpoint = store.get_checkpoint(server.poll_url, 'my_collection')
+        assert checkpoint.part_number == 2
+        assert checkpoint.begin_timestamp == begin_timestamp
+
+        # Resumed from part 3, then interrupted at part 5
+        server.errors = {5: libtaxii.constants.ST_FAILURE}
+        poll(received)
+        assert received == contents[:8]
+        checkpoint = store.get_checkpoint(server.poll_url, 'my_collection')
+        assert checkpoint.part_number == 4
+        assert checkpoint.begin_timestamp == begin_timestamp
+
+        # Once the result set has expired, the poll starts again from the
+        # original begin timestamp
+        store.save_checkpoint(server.poll_url, 'my_collection',
+                              checkpoint._replace(part_number=10))
+        server.errors.clear()
+        requests = []
+        create_poll_request = taxii_client.create_poll_request
+
+        def record_poll_request(**kwargs):
+            requests.append(kwargs)
+            return create_poll_request(**kwargs)
+
+        taxii_client.create_poll_request = record_poll_request
+        received = [content_block.content for content_block in
+                    taxii_client.poll(poll_url=server.poll_url, **poll_kwargs)]
+        assert received == contents
+        assert [kwargs['begin_timestamp'] for kwargs in requests] == [
+            begin_timestamp,
+        ]
+
+
+def test_poll_state_conversion(tmpdir):
+    """Test that a (pickled) state file from an earlier version is
+    converted.
+    """
+    state_file = tmpdir.join('state')
+    with open(str(state_file), 'wb') as file_:
+        pickle.dump({'http://taxii/poll': {
+            'my_collection': '2016-01-01 00:00:00+00:00',
+        }}, file_, protocol=2)
+
+    client_class = certau.util.taxii.client.SimpleTaxiiClient
+    timestamp = client_class.get_poll_time(str(state_file),
+                                           'http://taxii/poll',
+                                           'my_collection')
+    assert timestamp.isoformat() == '2016-01-01T00:00:00+00:00'
+    assert state_file.read_binary().startswith(b'SQLite format 3')
+    assert client_class.get_poll_time(str(state_file), 'http://taxii/poll',
+                                      'other_collection') is None
+
+
+def test_multi_collection_poll(tmpdir):
+    """Test polling several collections concurrently, with a limit on the
+    number of concurrent requests to each host.
+    """
+    state_file = str(tmpdir.join('state'))
+    contents = ['<block {} />'.format(i) for i in range(6)]
+
+    with TaxiiPollServer(contents, page_size=2, latency=0.2) as server_1, \
+            TaxiiPollServer(contents, page_size=2, latency=0.2) as server_2:
+        targets = [
+            PollTarget(server_1.poll_url, 'collection_1', None),
+            PollTarget(server_1.poll_url, 'collection_2', None),
+            PollTarget(server_1.poll_url, 'collection_3', None),
+            PollTarget(server_2.poll_url, 'collection_1', 'subscription'),
+            PollTarget('ftp://invalid/poll', 'collection_1', None),
+        ]
+        poller = MultiCollectionPoller(targets, host_limit=2,
+                                       state_file=state_file)
+        received = dict()
+        for target, content_block in poller.content_blocks():
+            received.setdefault(target, []).append(content_block.content)
+
+        assert sorted(received) == sorted(targets[:4])
+        for target in targets[:4]:
+            assert received[target] == contents
+        assert [target for target, _ in poller.failed] == targets[4:]
+        assert server_1.max_concurrent_requests == 2
+        assert server_2.max_concurrent_requests == 1
+
+        store = PollStateStore(state_file)
+        for target in targets[:4]:
+            assert store.get_poll_time(target.poll_url,
+                                       target.collection) is not None
+
+
+def test_multi_collection_poll_state(tmpdir):
+    """Test that a target's poll state is only saved once the content
+    blocks before it have been consumed.
+    """
+    state_file = str(tmpdir.join('state'))
+    contents = ['<block {} />'.format(i) for i in range(6)]
+
+    with TaxiiPollServer(contents, page_size=2) as server:
+        target = PollTarget(server.poll_url, 'collection_1', None)
+        poller = MultiCollectionPoller([target], state_file=state_file)
+        store = PollStateStore(state_file)
+        content_blocks = poller.content_blocks()
+        checkpoints = []
+        for _, content_block in content_blocks:
+            if content_block.content == contents[0]:
+                # (The whole poll is now waiting in the queue)
+                time.sleep(0.5)
+                assert len(server.requests) == 3
+            checkpoint = store.get_checkpoint(target.poll_url,
+                                              target.collection)
+            checkpoints.append(checkpoint and checkpoint.part_number)
+            assert store.get_poll_time(target.poll_url,
+                                       target.collection) is None
+
+        assert checkpoints == [None, None, 1, 1, 2, 2]
+        assert store.get_poll_time(target.poll_url,
+                                   target.collection) is not None
+        assert store.get_checkpoint(target.poll_url,
+                                    target.collection) is None
+
+    # An unusable state file is reported (rather than stopping the polls)
+    bad_state_file = tmpdir.join('bad_state')
+    bad_state_file.write('not a state file')
+    poller = MultiCollectionPoller([target], state_file=str(bad_state_file))
+    with pytest.raises(Exception):
+        list(poller.content_blocks())
+
+
+def test_poll_connection_reuse():
+    """Test that a poll reuses its connection for fulfillment requests,
+    accepting compressed responses, and that the content blocks are the
+    same as when a new connection is used for each request.
+    """
+    with open('tests/CA-TEST-STIX.xml') as file_:
+        document = file_.read()
+    contents = repeated_blocks(document, 12, block_size=5000)
+
+    def poll(taxii_client):
+        content_blocks = taxii_client.poll(
+            poll_url=server.poll_url,
+            collection='my_collection',
+        )
+        return [cb.to_xml() for cb in content_blocks]
+
+    with TaxiiPollServer(contents, page_size=3, compress=True) as server:
+        taxii_client = certau.util.taxii.client.SimpleTaxiiClient(
+            keep_alive=False,
+        )
+        expected = poll(taxii_client)
+        assert len(expected) == 12
+        assert server.connections == 4
+
+        server.reset()
+        pool = HttpConnectionPool()
+        taxii_client = certau.util.taxii.client.SimpleTaxiiClient(
+            connection_pool=pool,
+        )
+        assert poll(taxii_client) == expected
+        assert server.connections == 1
+        assert pool.connections_opened == 1
+        assert pool.connections_reused == 3
+        assert pool.compressed_responses == 4
+        assert pool.bytes_received < server.bytes_sent
+
+        # A closed connection is replaced
+        pool.close()
+        server.reset()
+        assert poll(taxii_client) == expected
+        assert pool.connections_opened == 2
+        assert server.connections == 1
+
+
+def test_content_charset():
+    """Test that the charset is read from a Content-Type header."""
+    assert content_charset('application/xml; charset=ISO-8859-1') == \
+        'iso-8859-1'
+    assert content_charset('application/xml; charset="utf-16"') == 'utf-16'
+    assert content_charset('application/xml') == 'utf-8'
+    assert content_charset(None) == 'utf-8'
+
+
+def test_streaming_poll_response():
+    """Test that content blocks are returned from a streamed poll response
+    as they are read, with the same content as the original blocks.
+    """
+    with open('tests/CA-TEST-STIX.xml', 'rb') as file_:
+        document = file_.read()
+    contents = repeated_blocks(document, 10, block_size=20000)
+
+    with TaxiiPollServer(contents, page_size=10) as server:
+        request = certau.util.taxii.client.SimpleTaxiiClient \
+            .create_poll_request(collection='my_collection')
+        response = server.response_for(request)
+    data = response.to_xml()
+    stream = six.BytesIO(data)
+
+    streaming = StreamingPollResponse(stream, chunk_size=4096)
+    assert streaming.message_type == libtaxii.constants.MSG_POLL_RESPONSE
+    assert streaming.in_response_to == request.message_id
+    assert streaming.result_id == response.result_id
+    assert streaming.more is False
+
+    def canonical(content):
+        return etree.tostring(etree.fromstring(content))
+
+    for index, content_block in enumerate(streaming.content_blocks):
+        # Only the blocks so far (and the next chunk) have been read
+        assert stream.tell() < len(data) * (index + 1) / 10 + 2 * 4096
+        assert canonical(content_block.content) == canonical(
+            contents[index])
+    assert index == 9
+    assert stream.closed
@@ -114,187 +114,163 @@ class PublishingTestCase(TestCase):
 		headers = { k.lower(): v for k,v in dict(r_get_version.headers).items() }
 		assert headers['authorization'] == misp_args['misp_key']
 
-		# The event creation request includes basic information.
-		r_create_event = reqs[2]
-		assert r_create_event.path == '/events'
-		assert json.loads(r_create_event.body.decode('utf-8')) == {
+		# The event creation request includes basic information, and the
+		# attributes extracted from the observables.
+		r_create_event = [r for r in reqs if r.path == '/events'][0]
+		event = json.loads(r_create_event.body.decode('utf-8'))
+		obs_attributes = event[u'Event'].pop(u'Attribute')
+		assert event == {
 			u'Event': {
 				u'info': u'CA-TEST-STIX | Test STIX data',
-				u'distribution': misp_event_args['distribution'],
-				u'threat_level_id': misp_event_args['threat_level'],
-				u'analysis': misp_event_args['analysis'],
+				u'distribution': int(misp_event_args['distribution']),
+				u'threat_level_id': int(misp_event_args['threat_level']),
+				u'analysis': int(misp_event_args['analysis']),
 				u'date': '2015-12-23',
 				u'published': False,
-				#u'Tag': [],
-				#u'attributes': [],
 			}
 		}
 
 		# The TLP tag is added to the event.
-		r_add_tag = reqs[4]
-		assert r_add_tag.path == '/tags/attachTagToObject'
+		r_add_tag = [r for r in reqs if r.path == '/tags/attachTagToObject'][0]
 		assert json.loads(r_add_tag.body.decode('utf-8')) == {
 			u'uuid': '590980a2-154c-47fb-b494-26660a00020f',
 			u'tag': '1',
 		}
 
-		# The event is then updated with the observables, over multiple
-		# requests. We're only interested in the 'Attribute' key here as that
-		# contains the data extracted from the observable.
-		obs_attributes = [json.loads(request.body.decode('utf-8')) for request in reqs[5:]]
+		# All the attributes fit in a single batch, so there are no further
+		# requests.
+		assert not [r for r in reqs if r.path.startswith('/attributes/add')]
 
 		# Need to strip out the randomly seeded uuids to make it a fair comparison.
-		for attributearrays in obs_attributes:
-			for attributes in attributearrays:
-				removal = attributes.pop(u'uuid', None)
+		for attributes in obs_attributes:
+			removal = attributes.pop(u'uuid', None)
 
 		self.maxDiff = None
 		self.assertCountEqual(obs_attributes, [
-			[{
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'md5',
 				u'value': u'11111111111111112977fa0588bd504a',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'md5',
 				u'value': u'ccccccccccccccc33574c79829dc1ccf',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'md5',
 				u'value': u'11111111111111133574c79829dc1ccf',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'md5',
 				u'value': u'11111111111111111f2601b4d21660fb',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'md5',
 				u'value': u'1111111111b42b57f518197d930471d9',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'mutex',
 				u'value': u'\\BaseNamedObjects\\MUTEX_0001',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'mutex',
 				u'value': u'\\BaseNamedObjects\\WIN_ABCDEF',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'mutex',
 				u'value': u'\\BaseNamedObjects\\iurlkjashdk',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'regkey|value',
 				u'value': u'HKEY_CURRENT_USER\\Software\\Microsoft\\Windows\\CurrentVersion\\Run|hotkey\\%APPDATA%\\malware.exe -st',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'sha1',
 				u'value': u'893fb19ac24eabf9b1fe1ddd1111111111111111',
-			}],
-			[{
+			},
+			{
 				u'category': u'Artifacts dropped',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'sha256',
 				u'value': u'11111111111111119f167683e164e795896be3be94de7f7103f67c6fde667bdf',
-			}],
-			[{
+			},
+			{
 				u'category': u'Network activity',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'domain',
 				u'value': u'bad.domain.org',
-			}],
-			[{
+			},
+			{
 				u'category': u'Network activity',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'domain',
 				u'value': u'dnsupdate.dyn.net',
-			}],
-			[{
+			},
+			{
 				u'category': u'Network activity',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'domain',
 				u'value': u'free.stuff.com',
-			}],
-			[{
+			},
+			{
 				u'category': u'Network activity',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'ip-dst',
 				u'value': u'183.82.180.95',
-			}],
-			[{
+			},
+			{
 				u'category': u'Network activity',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'ip-dst',
 				u'value': u'111.222.33.44',
-			}],
-			[{
+			},
+			{
 				u'category': u'Network activity',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'ip-dst',
 				u'value': u'158.164.39.51',
-			}],
-			[{
+			},
+			{
 				u'category': u'Network activity',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'url',
 				u'value': u'http://host.domain.tld/path/file',
-			}],
-			[{
+			},
+			{
 				u'category': u'Network activity',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'user-agent',
 				u'value': u'Mozilla/5.0 (Windows NT 5.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/35.0.2309.372 Safari/537.36',
-			}],
-			[{
+			},
+			{
 				u'category': u'Payload delivery',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'email-src',
 				u'value': u'sender@domain.tld',
-			}],
-			[{
+			},
+			{
 				u'category': u'Payload delivery',
-				u'disable_correlation': False,
 				u'to_ids': True,
 				u'type': u'email-subject',
 				u'value': u'Important project details',
-			}],
+			},
 		])
@@ -0,0 +1,264 @@
+"""Tests for the STIX package sources."""
+
+import bz2
+import gzip
+import os
+import tarfile
+import time
+import zipfile
+
+import pytest
+import ramrod
+import six
+
+import certau.source
+import certau.transform
+from certau.util.stix.stream import sniff_version
+
+
+def test_package_cache(tmpdir):
+    """Test that package summaries are stored in and read from the cache,
+    giving the same output as the parsed package.
+    """
+    cache = certau.source.PackageCache(
+        directory=str(tmpdir),
+        transform_classes=certau.transform.TRANSFORM_CLASS.values(),
+    )
+    item = certau.source.StixFileSourceItem('tests/CA-TEST-STIX.xml')
+    package = item.stix_package
+
+    cached_item = certau.source.StixFileSourceItem(
+        'tests/CA-TEST-STIX.xml',
+        cache=cache,
+    )
+    document = cached_item.read()
+    assert cache.get(document) is None
+    summary = cached_item.stix_package
+    assert cache.get(document) is not None
+    assert len(tmpdir.listdir()) == 1
+
+    # A new item for the same document is read from the cache
+    cached_item = certau.source.StixFileSourceItem(
+        'tests/CA-TEST-STIX.xml',
+        cache=cache,
+    )
+    cached_item._parse_package = None
+    summary = cached_item.stix_package
+    assert summary.title == 'CA-TEST-STIX'
+    for transform_class in (certau.transform.StixCsvTransform,
+                            certau.transform.StixBroIntelTransform,
+                            certau.transform.StixSnortTransform,
+                            certau.transform.StixStatsTransform):
+        assert transform_class(summary).text() == \
+            transform_class(package).text()
+
+
+def test_package_cache_eviction(tmpdir):
+    """Test that the least recently used summaries are evicted when the
+    cache grows beyond its maximum size.
+    """
+    cache = certau.source.PackageCache(
+        directory=str(tmpdir),
+        transform_classes=[],
+        max_size=300,
+    )
+    documents = [str(i).encode('ascii') * 100 for i in range(6)]
+    for i, document in enumerate(documents):
+        cache.put(document, certau.source.cache.PackageSummary({'i': i}))
+        path = cache._path(cache.key(document))
+        os.utime(path, (i, i))
+    cache.evict()
+    assert cache.get(documents[0]) is None
+    assert cache.get(documents[-1]).header == {'i': 5}
+    total = sum(os.path.getsize(str(path)) for path in tmpdir.listdir())
+    assert 0 < total <= 270
+
+
+def test_upgrade_cache(tmpdir, monkeypatch):
+    """Test that packages using an older STIX version are upgraded, and
+    that upgraded packages are read from the upgrade cache.
+    """
+    with open('tests/CA-TEST-STIX.xml', 'rb') as file_:
+        document = file_.read()
+    old_file = tmpdir.join('old.xml')
+    old_file.write_binary(document.replace(
+        b' version="1.1.1" timestamp',
+        b' version="1.1" timestamp',
+    ))
+    assert sniff_version(str(old_file)) == '1.1'
+    assert sniff_version('tests/CA-TEST-STIX.xml') == '1.1.1'
+
+    cache_dir = tmpdir.join('cache')
+    upgrade_cache = certau.source.UpgradeCache(str(cache_dir))
+    item = certau.source.StixFileSourceItem(str(old_file),
+                                            upgrade_cache=upgrade_cache)
+    assert item.stix_package.version == '1.1.1'
+    assert len(cache_dir.listdir()) == 1
+
+    def _update(*args, **kwargs):
+        raise AssertionError('package upgraded again')
+    monkeypatch.setattr(ramrod, 'update', _update)
+
+    item = certau.source.StixFileSourceItem(str(old_file),
+                                            upgrade_cache=upgrade_cache)
+    package = item.stix_package
+    assert package.version == '1.1.1'
+    assert certau.transform.StixCsvTransform(package).text() == \
+        certau.transform.StixCsvTransform(
+            certau.source.StixFileSourceItem(
+                'tests/CA-TEST-STIX.xml').stix_package,
+        ).text()
+
+
+def test_file_manifest(tmpdir):
+    """Test that files recorded in the manifest are skipped, unless they
+    have been modified since.
+    """
+    directory = tmpdir.mkdir('input')
+    for name in ('a.xml', 'b.xml'):
+        directory.join(name).write('<package />')
+    manifest_file = str(tmpdir.join('manifest'))
+
+    def file_names(manifest):
+        source = certau.source.StixFileSource([str(directory)],
+                                              manifest=manifest)
+        source_items = list(source.source_items())
+        for source_item in source_items:
+            source.mark_processed(source_item)
+        return [os.path.basename(item.file_name()) for item in source_items]
+
+    manifest = certau.source.FileManifest(manifest_file)
+    assert file_names(manifest) == ['a.xml', 'b.xml']
+    assert file_names(manifest) == []
+
+    # The manifest is kept between runs
+    manifest.close()
+    manifest = certau.source.FileManifest(manifest_file)
+    assert len(manifest) == 2
+    directory.join('b.xml').write('<package version="2" />')
+    directory.join('c.xml').write('<package />')
+    assert file_names(manifest) == ['b.xml', 'c.xml']
+    assert file_names(manifest) == []
+
+
+def test_archive_source(tmpdir):
+    """Test that compressed files and the members of zip and tar archives
+    are read as packages, and archives are recorded in the manifest once
+    all their members have been processed.
+    """
+    with open('tests/CA-TEST-STIX.xml', 'rb') as file_:
+        document = file_.read()
+    directory = tmpdir.mkdir('input')
+    with gzip.open(str(directory.join('a.xml.gz')), 'wb') as file_:
+        file_.write(document)
+    with bz2.BZ2File(str(directory.join('b.xml.bz2')), 'wb') as file_:
+        file_.write(document)
+    with zipfile.ZipFile(str(directory.join('c.zip')), 'w') as archive:
+        archive.writestr('2017/', b'')
+        archive.writestr('2017/one.xml', document)
+        archive.writestr('2017/two.xml', document)
+        archive.writestr('README', b'not a package')
+    with tarfile.open(str(directory.join('d.tar.gz')), 'w:gz') as archive:
+        member = tarfile.TarInfo('three.xml')
+        member.size = len(document)
+        archive.addfile(member, six.BytesIO(document))
+
+    manifest = certau.source.FileManifest(':memory:')
+    source = certau.source.StixFileSource([str(directory)], exclude=['README'],
+                                          manifest=manifest)
+    source_items = list(source.source_items())
+    assert [os.path.relpath(item.file_name(), str(directory))
+            for item in source_items] == [
+        'a.xml.gz', 'b.xml.bz2', 'c.zip!2017/one.xml', 'c.zip!2017/two.xml',
+        'd.tar.gz!three.xml',
+    ]
+    assert [os.path.basename(item.save_name()) for item in source_items] == [
+        'a.xml', 'b.xml', 'c.zip!2017_one.xml', 'c.zip!2017_two.xml',
+        'd.tar.gz!three.xml',
+    ]
+    expected = certau.transform.StixCsvTransform(
+        certau.source.StixFileSourceItem(
+            'tests/CA-TEST-STIX.xml').stix_package,
+    ).text()
+    for item in source_items:
+        assert item.read() == document
+        assert certau.transform.StixCsvTransform(
+            item.stix_package).text() == expected
+
+    # The zip archive is only recorded once its last member is processed
+    source.mark_processed(source_items[2])
+    assert len(manifest) == 0
+    source.mark_processed(source_items[3])
+    assert len(manifest) == 1
+    assert len(list(source.source_items())) == 3
+
+
+@pytest.mark.parametrize('stat_threads', [0, 4])
+def test_file_scanner(tmpdir, stat_threads):
+    """Test that subdirectories are scanned (to the maximum depth), and
+    files are included or excluded by their names or paths.
+    """
+    for path in ('a.xml', 'b.txt', 'one/c.xml', 'one/two/d.xml',
+                 'one/two/three/e.xml', 'skip/f.xml'):
+        tmpdir.join(path).write('<package />', ensure=True)
+    top = str(tmpdir)
+
+    def scan(**kwargs):
+        scanner = certau.source.FileScanner(stat_threads=stat_threads,
+                                            **kwargs)
+        stat_files = list(scanner.stat_files([top]))
+        assert [path for path, _ in stat_files] == list(scanner.files([top]))
+        assert all(stat.st_size == 11 for _, stat in stat_files)
+        return [os.path.relpath(path, top).replace(os.sep, '/')
+                for path, _ in stat_files]
+
+    assert scan() == ['a.xml', 'b.txt']
+    assert scan(recurse=True) == [
+        'a.xml', 'b.txt', 'one/c.xml', 'one/two/d.xml',
+        'one/two/three/e.xml', 'skip/f.xml',
+    ]
+    assert scan(recurse=True, max_depth=2, include=['*.xml'],
+                exclude=['skip', 'one/c.xml']) == ['a.xml', 'one/two/d.xml']
+
+    # StixFileSource recurses into subdirectories
+    source = certau.source.StixFileSource([top], recurse=True,
+                                          exclude=['*.txt'])
+    assert len(list(source.source_items())) == 5
+
+
+@pytest.mark.parametrize('polling', [False, True])
+def test_watch_source(tmpdir, polling):
+    """Test that a watched directory's files are returned once each, as
+    they are added (or modified).
+    """
+    directory = tmpdir.mkdir('input')
+    directory.join('a.xml').write('<package />')
+    source = certau.source.StixWatchSource(
+        [str(directory)],
+        recurse=True,
+        interval=0.1,
+        settle=0,
+        polling=polling,
+    )
+    source_items = source.source_items()
+
+    def next_file_name():
+        source_item = next(source_items)
+        source.mark_processed(source_item)
+        return os.path.relpath(source_item.file_name(), str(directory))
+
+    assert next_file_name() == 'a.xml'
+    directory.join('b.xml').write('<package />')
+    assert next_file_name() == 'b.xml'
+
+    # Files in new subdirectories are returned
+    subdirectory = directory.mkdir('sub')
+    time.sleep(0.2)
+    subdirectory.join('c.xml').write('<package />')
+    assert next_file_name() == os.path.join('sub', 'c.xml')
+
+    # Modified files are returned again, unmodified files aren't
+    time.sleep(0.01)
+    directory.join('a.xml').write('<package version="2" />')
+    assert next_file_name() == 'a.xml'
+    source_items.close()
@@ -1,13 +1,32 @@
 # -*- coding: utf-8 -*-
 """Basic high-level tests of the transform functionality."""
 import csv
+import datetime
+import json
+import os
+import threading
+import time
+
+import pytest
 import six
 
 from six import StringIO
 
 import textwrap
 
+import stix.core
+
+import certau.source
 import certau.transform
+from pymisp import PyMISP
+from certau.util.misp.client import TokenBucket
+from certau.util.misp.feed import MispFeedWriter
+from certau.util.misp.index import MispIndex
+from certau.util.misp.server import MispServer
+from certau.util.misp.tags import MispTagCache
+from certau.util.stix.generator import OBJECT_TYPES, PackageGenerator
+from certau.util.stix.stream import StreamingStixPackage
+from certau.util.stix.summary import PackageSummary
 
 
 def test_transform_to_text(package):
@@ -91,6 +110,19 @@ def test_text_delimiter_quoting(package):
         assert reader.next() == ['first|second', 'third']
 
 
+def test_text_join_matches_csv(package):
+    """Test that join() gives the same result as a csv writer, whether or
+    not the items require quoting.
+    """
+    transformer = certau.transform.StixCsvTransform(package)
+    for items in (['first', 'second'], ['first|second', 'third'],
+                  ['say "hi"', 'x'], ['multi\nline', 'x'], [''], ['', ''],
+                  [' padded ', 'x '], ['count', 3], ['none', None], []):
+        sio = StringIO()
+        csv.writer(sio, delimiter='|').writerow(items)
+        assert transformer.join(items) == sio.getvalue().strip()
+
+
 def test_transform_to_stats(package):
     """Test of transform between a sample STIX file and the 'stats'
     output format.
@@ -187,3 +219,596 @@ def test_transform_to_snort(package):
         alert ip any any -> 183.82.180.95 any (flow:established,to_server; msg:"CTI-Toolkit connection to potentially malicious server 183.82.180.95 (ID CCIRC-CCRIC:Observable-01234567-2823-4d6d-8d77-bae10ca5bd97)"; sid:5500005; rev:1; classtype:bad-unknown;)
         alert tcp any any -> $EXTERNAL_NET $HTTP_PORTS (flow:established,to_server; content:"host.domain.tld"; http_header; nocase; uricontent:"/path/file"; nocase; msg:"CTI-Toolkit connection to potentially malicious url http://host.domain.tld/path/file (ID cert_au:Observable-1a919136-ba69-4a28-9615-ad6ee37e88a5)"; sid:5500006; rev:1; classtype:bad-unknown;)
     """).strip().expandtabs()
+
+
+def test_streaming_package_transforms(package):
+    """Test that transforming a StreamingStixPackage gives the same results
+    as transforming the python-stix object graph of the same package.
+    """
+    streamed = StreamingStixPackage('tests/CA-TEST-STIX.xml')
+    assert streamed.title == 'CA-TEST-STIX'
+    assert streamed.tlp == 'WHITE'
+
+    for transform_class in certau.transform.TRANSFORM_CLASS.values():
+        expected = transform_class._observables_for_package(package)
+        observables = transform_class._observables_for_package(streamed)
+        assert sorted(observables) == sorted(expected)
+        for object_type in expected:
+            assert [(o['id'], o['fields']) for o in observables[object_type]] \
+                == [(o['id'], o['fields']) for o in expected[object_type]]
+
+    for transform_class in (certau.transform.StixCsvTransform,
+                            certau.transform.StixBroIntelTransform,
+                            certau.transform.StixSnortTransform,
+                            certau.transform.StixStatsTransform):
+        assert transform_class(streamed).text() == \
+            transform_class(package).text()
+
+
+def test_transform_pool(package):
+    """Test that a TransformPool returns results in input order, as text
+    for text transforms and as package summaries for other transforms.
+    """
+    source_items = [
+        certau.source.StixFileSourceItem('tests/CA-TEST-STIX.xml')
+        for _ in range(5)
+    ]
+    expected = certau.transform.StixCsvTransform(package).text()
+
+    pool = certau.transform.TransformPool(
+        workers=2,
+        transform_class=certau.transform.StixCsvTransform,
+    )
+    results = list(pool.results(iter(source_items)))
+    assert [item for item, _ in results] == source_items
+    assert [text for _, text in results] == [expected] * len(source_items)
+
+    misp_class = certau.transform.StixMispTransform
+    expected = misp_class._observables_for_package(package)
+    pool = certau.transform.TransformPool(
+        workers=2,
+        transform_class=misp_class,
+    )
+    for _, summary in pool.results(iter(source_items)):
+        assert isinstance(summary, PackageSummary)
+        assert summary.title == 'CA-TEST-STIX'
+        observables = summary.observables_for(misp_class)
+        assert sorted(observables) == sorted(expected)
+        for object_type in expected:
+            assert [(o['id'], o['fields']) for o in observables[object_type]] \
+                == [(o['id'], o['fields']) for o in expected[object_type]]
+
+
+def test_transform_pool_watch(package, tmpdir):
+    """Test that TransformPool and MispPublisher return finished results
+    while waiting for more source items (e.g. from a watched directory).
+    """
+    directory = tmpdir.mkdir('input')
+    xml = open('tests/CA-TEST-STIX.xml').read()
+    directory.join('a.xml').write(xml)
+    source = certau.source.StixWatchSource([str(directory)], interval=0.1,
+                                           settle=0)
+    pool = certau.transform.TransformPool(
+        workers=2,
+        transform_class=certau.transform.StixCsvTransform,
+    )
+    expected = certau.transform.StixCsvTransform(package).text()
+    results = pool.results(source.source_items())
+    source_item, text = next(results)
+    assert source_item.file_name().endswith('a.xml')
+    assert text == expected
+    source.mark_processed(source_item)
+    directory.join('b.xml').write(xml)
+    source_item, text = next(results)
+    assert source_item.file_name().endswith('b.xml')
+    assert text == expected
+    results.close()
+
+    # Items that never end
+    waiting = threading.Event()
+
+    def items():
+        yield certau.source.StixFileSourceItem('tests/CA-TEST-STIX.xml'), None
+        yield certau.source.StixFileSourceItem('tests/CA-TEST-STIX.xml'), \
+            package
+        waiting.wait()
+
+    with MispServer() as server:
+        misp = certau.transform.StixMispTransform.get_misp_object(
+            server.url, 'key')
+        publisher = certau.transform.MispPublisher(
+            workers=2,
+            transform_kwargs=dict(misp=misp),
+        )
+        results = publisher.results(items())
+        assert next(results)[1] is None
+        _, transform = next(results)
+        assert transform.event['Event']['id'] in server.events
+        waiting.set()
+        assert list(results) == []
+
+
+def test_transform_pipeline(package):
+    """Test that a TransformPipeline returns results in input order, and
+    that an error raised by the source is raised after the earlier results.
+    """
+    def source_items(count, error=None):
+        for _ in range(count):
+            yield certau.source.StixFileSourceItem('tests/CA-TEST-STIX.xml')
+        if error is not None:
+            raise error
+
+    expected = certau.transform.StixCsvTransform(package).text()
+    pipeline = certau.transform.TransformPipeline(
+        transform_class=certau.transform.StixCsvTransform,
+        queue_size=2,
+    )
+    results = list(pipeline.results(source_items(10)))
+    assert len(results) == 10
+    assert [text for _, text in results] == [expected] * 10
+
+    results = []
+    with pytest.raises(IOError):
+        for result in pipeline.results(source_items(3, IOError('poll'))):
+            results.append(result)
+    assert len(results) == 3
+
+    # Stopping early doesn't leave the stages running
+    threads = threading.active_count()
+    results = pipeline.results(source_items(100))
+    next(results)
+    assert threading.active_count() == threads + 3
+    results.close()
+    assert threading.active_count() == threads
+
+
+def test_observable_registry(package):
+    """Test the observable registry indexes (by ID and location) and that
+    both the object graph and streaming paths record the same locations.
+    """
+    streamed = StreamingStixPackage('tests/CA-TEST-STIX.xml')
+    expected = certau.transform.StixTransform._observables_for_package(package)
+    observables = certau.transform.StixTransform._observables_for_package(
+        streamed,
+    )
+    assert isinstance(expected, certau.transform.ObservableRegistry)
+    # Observables in the test package's indicators are references to
+    # observables in the package root
+    assert len(expected.by_location('root')) == \
+        sum(len(entries) for entries in expected.values())
+    for location in certau.transform.ObservableRegistry.LOCATIONS:
+        assert [o['id'] for o in observables.by_location(location)] == \
+            [o['id'] for o in expected.by_location(location)]
+
+    for object_type, entries in expected.items():
+        assert expected.by_object_type(object_type) is entries
+        for entry in entries:
+            assert expected.has_id(entry['id'])
+            assert expected.get_by_id(entry['id']) is entry
+
+    registry = certau.transform.ObservableRegistry()
+    assert registry.add('id-1', 'Address', None, None) is not None
+    assert registry.add('id-1', 'DomainName', None, None, 'indicator') is None
+    assert list(registry) == ['Address']
+    assert registry.by_object_type('DomainName') == []
+    assert registry.by_location('indicator') == []
+    assert registry.add('id-2', 'Address', None, None, 'composition')
+    assert [o['id'] for o in registry.by_object_type('Address')] == \
+        ['id-1', 'id-2']
+    assert [o['id'] for o in registry.by_location('composition')] == ['id-2']
+
+
+def test_compiled_field_plan():
+    """Test that dotted field names are compiled into a shared accessor
+    tree, cached separately for each transform class.
+    """
+    from certau.transform.fields import compile_fields
+
+    accessors = compile_fields([
+        'header.from_.address_value',
+        'header.to.address_value',
+        'header.subject',
+        'attachments.object_reference',
+    ])
+    assert [a.name for a in accessors] == ['header', 'attachments']
+    header = accessors[0]
+    assert [a.path for a in header.children] == \
+        ['header.from_', 'header.to', 'header.subject']
+    assert header.children[2].children is None
+    assert header.children[0].children[0].path == 'header.from_.address_value'
+
+    csv_class = certau.transform.StixCsvTransform
+    misp_class = certau.transform.StixMispTransform
+    plan = csv_class._field_plan('EmailMessage')
+    assert csv_class._field_plan('EmailMessage') is plan
+    assert misp_class._field_plan('EmailMessage') is not plan
+
+
+def test_multi_valued_field_rows():
+    """Test that multi-valued fields expand to the cartesian product of
+    their values, without sharing state between rows.
+    """
+    from cybox.objects.email_message_object import EmailMessage
+    from cybox.objects.file_object import File
+
+    csv_class = certau.transform.StixCsvTransform
+
+    email = EmailMessage()
+    email.to = ['a@example.com', 'b@example.com', 'c@example.com']
+    email.from_ = 'sender@example.com'
+    email.subject = 'Test'
+    rows = csv_class._field_values_for_properties('EmailMessage', email)
+    assert [row['header.to.address_value'] for row in rows] == \
+        ['a@example.com', 'b@example.com', 'c@example.com']
+    for row in rows:
+        assert row['header.from_.address_value'] == 'sender@example.com'
+        assert row['header.subject'] == 'Test'
+    assert len(set(id(row) for row in rows)) == len(rows)
+
+    file_ = File()
+    file_.file_name = 'test.exe'
+    file_.md5 = '0123456789abcdef0123456789abcdef'
+    file_.sha1 = '0123456789abcdef0123456789abcdef01234567'
+    rows = csv_class._field_values_for_properties('File', file_)
+    assert [(row['file_name'], row['hashes.type_']) for row in rows] == \
+        [('test.exe', 'MD5'), ('test.exe', 'SHA1')]
+
+
+def test_text_transform_write(package):
+    """Test that text transforms stream the same output as text(), one
+    line at a time.
+    """
+    for transform_class in (certau.transform.StixCsvTransform,
+                            certau.transform.StixBroIntelTransform,
+                            certau.transform.StixSnortTransform,
+                            certau.transform.StixStatsTransform):
+        for include_header in (True, False):
+            expected = transform_class(
+                package, include_header=include_header).text()
+
+            lines = list(transform_class(
+                package, include_header=include_header).iter_lines())
+            assert ''.join(lines) == expected
+            assert all(line.endswith('\n') for line in lines)
+            assert not any('\n' in line[:-1] for line in lines)
+
+            stream = StringIO()
+            transform_class(
+                package, include_header=include_header).write(stream)
+            assert stream.getvalue() == expected
+
+
+def test_synthetic_package():
+    """Test that synthetic packages contain the requested observables, and
+    that they give the same output when streamed as when parsed.
+    """
+    counts = dict((object_type, 3) for object_type in OBJECT_TYPES)
+    for kwargs in (dict(idref_ratio=0.5, composition_ratio=0.5),
+                   dict(composition_ratio=0.5, inline_compositions=True)):
+        generator = PackageGenerator(counts, hashes=2, recipients=3,
+                                     **kwargs)
+        document = generator.document().encode('utf-8')
+        package = stix.core.STIXPackage.from_xml(six.BytesIO(document))
+
+        observables = certau.transform.StixTransform._observables_for_package(
+            package,
+        )
+        assert dict((k, len(v)) for k, v in observables.items()) == counts
+
+        for transform_class in (certau.transform.StixCsvTransform,
+                                certau.transform.StixBroIntelTransform):
+            streaming = StreamingStixPackage(six.BytesIO(document))
+            assert transform_class(package).text() == \
+                transform_class(streaming).text()
+
+        csv_text = certau.transform.StixCsvTransform(package).text()
+        assert csv_text.count('|SHA1|') == 3
+        assert csv_text.count('@example4.org|Equals|Message 4|') == 3
+
+    generator = PackageGenerator.for_size(100000)
+    assert 95000 < len(generator.document()) < 105000
+
+    # Each generator gets a unique package ID unless one is given
+    package_ids = set(
+        stix.core.STIXPackage.from_xml(six.BytesIO(
+            PackageGenerator(counts).document().encode('utf-8'))).id_
+        for _ in range(2)
+    )
+    assert len(package_ids) == 2
+    generator = PackageGenerator(counts, package_id='example:Package-1')
+    assert generator.document() == generator.document()
+    assert 'id="example:Package-1"' in generator.document()
+
+
+def test_misp_batched_publishing(package):
+    """Test that MISP attributes are sent with the event and then in
+    batches, and attributes rejected by the server are reported.
+    """
+    with MispServer(reject_values=['bad.domain.org']) as server:
+        misp = certau.transform.StixMispTransform.get_misp_object(
+            server.url, 'key')
+        server.reset()
+        transform = certau.transform.StixMispTransform(
+            package, misp=misp, batch_size=5)
+        attributes = transform.attributes()
+        assert len(attributes) == 21
+        transform.publish()
+
+        # 1 event (with 5 attributes) + 2 tag requests + 4 batches of up to
+        # 5 attributes
+        assert transform.requests == 7
+        assert len(server.requests) == 7
+        assert server.requests_for(r'/attributes/add/') == 4
+        event = server.events[transform.event['Event']['id']]
+        assert event['Tag'] == [{'id': '1', 'name': 'tlp:white'}]
+        assert len(event['Attribute']) == 20
+        assert [attribute['value']
+                for attribute, _ in transform.failed_attributes] == [
+            'bad.domain.org',
+        ]
+        assert 'Value rejected' in transform.failed_attributes[0][1]
+
+        # Without batching, all the attributes are sent with the event (and
+        # the tag list is cached)
+        server.reset()
+        transform = certau.transform.StixMispTransform(
+            package, misp=misp, batch_size=0, published=True)
+        transform.publish()
+        assert server.requests_for(r'/attributes/add/') == 0
+        assert transform.requests == len(server.requests) == 3
+        assert server.events['1']['published']
+
+
+def test_misp_tag_cache(package):
+    """Test that MISP's tag list is downloaded once for all the transforms
+    (until it expires or is invalidated).
+    """
+    with MispServer() as server:
+        misp = certau.transform.StixMispTransform.get_misp_object(
+            server.url, 'key')
+        server.reset()
+
+        def publish(**kwargs):
+            certau.transform.StixMispTransform(package, misp=misp,
+                                               **kwargs).publish()
+            return server.requests_for(r'/tags$')
+
+        assert publish() == 1
+        assert publish() == 1
+        cache = MispTagCache.shared(misp)
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert all(event['Tag'] == [{'id': '1', 'name': 'tlp:white'}]
+                   for event in server.events.values())
+
+        MispTagCache.invalidate_all()
+        assert publish() == 2
+        assert publish(tag_cache_ttl=0) == 3
+        assert cache.ttl == 0
+        assert (cache.hits, cache.misses) == (1, 3)
+
+        # Tags added to the server are found once the cache is refreshed
+        cache.ttl = 3600
+        server.tags.append({'id': '5', 'name': 'new-tag'})
+        assert cache.tag_id(misp, 'new-tag') is None
+        cache.invalidate()
+        assert cache.tag_id(misp, 'new-tag') == '5'
+        assert cache.lookup(misp, 'new-tag') == ('5', False)
+        cache.invalidate()
+        assert cache.lookup(misp, 'new-tag') == ('5', True)
+
+
+def test_misp_concurrent_publishing(package):
+    """Test that a MispPublisher publishes packages concurrently over a
+    shared connection pool, limiting the requests in flight and retrying
+    server errors.
+    """
+    with MispServer(latency=0.05) as server:
+        misp = certau.transform.StixMispTransform.get_misp_object(
+            server.url, 'key', max_in_flight=3, backoff=0.01)
+        server.reset()
+        sent = misp.sent
+        publisher = certau.transform.MispPublisher(
+            workers=4,
+            transform_kwargs=dict(misp=misp, batch_size=5),
+        )
+        source_items = [
+            certau.source.StixFileSourceItem('tests/CA-TEST-STIX.xml')
+            for _ in range(6)
+        ]
+        results = list(publisher.results(
+            (source_item, package) for source_item in source_items))
+        assert [item for item, _ in results] == source_items
+        assert len(server.events) == 6
+        assert all(len(event['Attribute']) == 21
+                   for event in server.events.values())
+        assert sorted(transform.event['Event']['id']
+                      for _, transform in results) == sorted(server.events)
+        assert 1 < server.max_concurrent_requests <= 3
+        assert server.connections <= 3
+        # (All the requests were sent over the pool, and each transform
+        # only counted its own)
+        assert misp.sent - sent == len(server.requests)
+        assert sum(transform.requests for _, transform in results) == \
+            len(server.requests)
+
+        # Server errors are retried (up to misp.retries times)
+        server.reset()
+        server.fail_requests(2)
+        transform = certau.transform.StixMispTransform(package, misp=misp)
+        transform.publish()
+        assert misp.retried == 2
+        assert len(server.events) == 1
+        assert not transform.failed_attributes
+
+        server.reset()
+        server.fail_requests(misp.retries + 1)
+        transform = certau.transform.StixMispTransform(package, misp=misp)
+        transform.publish()
+        assert misp.retried == 2 + misp.retries
+        assert not server.events
+        assert len(transform.failed_attributes) == 21
+
+        # A plain PyMISP object (which isn't pooled) is rejected
+        with pytest.raises(TypeError):
+            certau.transform.StixMispTransform(
+                package, misp=PyMISP(server.url, 'key', ssl=False))
+
+
+def test_token_bucket():
+    """Test that a TokenBucket allows a burst and then limits the rate."""
+    bucket = TokenBucket(rate=50, burst=5)
+    start = time.time()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.time() - start < 0.05
+    for _ in range(10):
+        bucket.acquire()
+    assert time.time() - start >= 0.18
+    assert TokenBucket(rate=0).acquire() == 0
+
+
+
+def test_misp_index(tmpdir):
+    """Test that a MispIndex skips packages and attributes that have
+    already been published, and routes updated packages to their existing
+    event.
+    """
+    package = stix.core.STIXPackage.from_xml('tests/CA-TEST-STIX.xml')
+    index = MispIndex(str(tmpdir.join('index')))
+    with MispServer(reject_values=['bad.domain.org']) as server:
+        misp = certau.transform.StixMispTransform.get_misp_object(
+            server.url, 'key')
+        requests = []
+
+        def publish(**kwargs):
+            start = len(server.requests)
+            transform = certau.transform.StixMispTransform(
+                package, misp=misp, index=index, batch_size=5, **kwargs)
+            transform.publish()
+            requests[:] = [path for _, path in server.requests[start:]]
+            assert transform.requests == len(requests)
+            return transform
+
+        # The rejected attribute isn't recorded as published
+        transform = publish()
+        event_id = transform.event['Event']['id']
+        indexed = index.package(server.url, package.id_)
+        assert indexed.event_id == event_id
+        assert indexed.timestamp == package.timestamp
+        assert len(index.known_attributes(server.url,
+                                          transform.attributes())) == 20
+
+        # An unchanged package is skipped
+        transform = publish()
+        assert transform.skipped
+        assert requests == []
+
+        # An updated package only adds its new attributes to the event
+        server.reject_values.clear()
+        package.timestamp = package.timestamp + datetime.timedelta(days=1)
+        transform = publish(published=True)
+        assert transform.skipped_attributes == 20
+        assert requests == ['/attributes/add/' + event_id,
+                            '/events/alert/' + event_id]
+        assert len(server.events) == 1
+        assert len(server.events[event_id]['Attribute']) == 21
+        assert index.package(server.url, package.id_).timestamp == \
+            package.timestamp
+
+        # A new package with the same attributes is only skipped if the
+        # index's scope is the server
+        package.id_ = 'example:Package-2'
+        transform = publish(index_scope='server')
+        assert transform.skipped
+        assert transform.skipped_attributes == 21
+        transform = publish()
+        assert transform.skipped_attributes == 0
+        assert len(server.events) == 2
+
+        # If the package's event has been deleted, a new event is created
+        # (with all the package's attributes)
+        package.id_ = 'example:Package-3'
+        server.reject_values.add('bad.domain.org')
+        event_id = publish().event['Event']['id']
+        server.reject_values.clear()
+        del server.events[event_id]
+        package.timestamp = package.timestamp + datetime.timedelta(days=1)
+        transform = publish()
+        assert requests[:2] == ['/attributes/add/' + event_id,
+                                '/events/' + event_id]
+        assert not transform.failed_attributes
+        new_event_id = transform.event['Event']['id']
+        assert len(server.events[new_event_id]['Attribute']) == 21
+        assert index.package(server.url, package.id_).event_id == new_event_id
+
+        # An event whose new attributes are all rejected is kept
+        package.id_ = 'example:Package-4'
+        server.reject_values.add('bad.domain.org')
+        event_id = publish().event['Event']['id']
+        package.timestamp = package.timestamp + datetime.timedelta(days=1)
+        transform = publish()
+        assert requests == ['/attributes/add/' + event_id,
+                            '/events/' + event_id]
+        assert len(transform.failed_attributes) == 1
+        assert index.package(server.url, package.id_).event_id == event_id
+        assert event_id in server.events
+
+
+def test_misp_feed(package, tmpdir):
+    """Test that MISP events are written to a MISP feed, replacing the
+    event for an updated package.
+    """
+    with pytest.raises(TypeError):
+        certau.transform.StixMispTransform(package, misp=None)
+
+    directory = str(tmpdir.join('feed'))
+    with MispFeedWriter(directory) as feed:
+        transform = certau.transform.StixMispTransform(
+            package, misp=None, feed=feed, threat_level=3)
+        transform.publish()
+    event_uuid = MispFeedWriter.event_uuid(package.id_)
+    assert transform.event['Event']['uuid'] == event_uuid
+    assert (feed.events, feed.attributes) == (1, 21)
+
+    with open(str(tmpdir.join('feed', 'manifest.json'))) as file_:
+        manifest = json.load(file_)
+    assert list(manifest) == [event_uuid]
+    assert manifest[event_uuid]['Tag'] == [{'name': 'tlp:white'}]
+    assert manifest[event_uuid]['threat_level_id'] == '3'
+    assert manifest[event_uuid]['Orgc']['name'] == 'CTI Toolkit'
+
+    def event():
+        with open(str(tmpdir.join('feed', event_uuid + '.json'))) as file_:
+            return json.load(file_)['Event']
+
+    written = event()
+    assert written['info'] == manifest[event_uuid]['info']
+    assert sorted((a['type'], a['value']) for a in written['Attribute']) == \
+        sorted((a['type'], a['value']) for a in transform.attributes())
+
+    # Writing the package again replaces the event (with the same UUIDs)
+    with MispFeedWriter(directory) as feed:
+        certau.transform.StixMispTransform(package, misp=None,
+                                           feed=feed).publish()
+    assert sorted(os.listdir(directory)) == [event_uuid + '.json',
+                                             'manifest.json']
+    assert [a['uuid'] for a in event()['Attribute']] == \
+        [a['uuid'] for a in written['Attribute']]
+
+    # The manifest is written with each event, and non-ASCII values (UTF-8
+    # strings on Python 2) are written as text
+    value = u'ex\u00e4mple.org'
+    feed = MispFeedWriter(str(tmpdir.join('feed_2')))
+    feed.write_event(
+        {'info': 'Example'},
+        [{'type': 'domain', 'category': 'Network activity', 'to_ids': True,
+          'value': value.encode('utf-8') if six.PY2 else value}],
+        key='example',
+    )
+    event_uuid = MispFeedWriter.event_uuid('example')
+    with open(str(tmpdir.join('feed_2', 'manifest.json'))) as file_:
+        assert list(json.load(file_)) == [event_uuid]
+    with open(str(tmpdir.join('feed_2', event_uuid + '.json'))) as file_:
+        written = json.load(file_)['Event']
+    assert written['info'] == 'Example'
+    assert [a['value'] for a in written['Attribute']] == [value]